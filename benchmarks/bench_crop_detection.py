@@ -0,0 +1,105 @@
+"""Crop detection: compiled trie matchers vs. the legacy per-call substring scan.
+
+The legacy detect_explicit_crop rebuilt the synonym dict literal on every call
+and returned the first synonym, in dict order, found anywhere in the query. It
+is recreated here from CROP_SYNONYMS and timed against the compiled matchers
+(first mention, and all mentions with positions) on queries in every language,
+short and long, with and without crop names. Queries where the two disagree
+are counted; they come from the legacy scan preferring an earlier dict entry to
+a longer or earlier mention.
+
+    python benchmarks/bench_crop_detection.py --queries 5000
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+logging.getLogger("whisper_main").setLevel(logging.WARNING)
+
+LEGACY_SOURCE = f'''
+def legacy_detect_explicit_crop(query, language):
+    crop_synonyms = {wm.CROP_SYNONYMS!r}
+    mapping = crop_synonyms.get(language, crop_synonyms['en'])
+    query_lower = query.lower()
+    for crop_name, standardized_name in mapping.items():
+        if crop_name.lower() in query_lower:
+            return standardized_name
+    return ""
+'''
+namespace = {}
+exec(LEGACY_SOURCE, namespace)
+legacy_detect_explicit_crop = namespace["legacy_detect_explicit_crop"]
+
+
+def make_queries(n: int, seed: int = 0) -> list:
+    """(language, query) pairs built from KB sentences with 0-2 crop names mixed in"""
+    rng = random.Random(seed)
+    sentences = {}
+    for items in wm.FALLBACK_KB.values():
+        for variants in items.values():
+            for lang, text in variants.items():
+                sentences.setdefault(lang, []).extend(s.strip() for s in text.split(".") if s.strip())
+    languages = sorted(wm.CROP_SYNONYMS)
+    queries = []
+    for i in range(n):
+        lang = languages[i % len(languages)]
+        words = " ".join(rng.sample(sentences[lang], rng.choice([1, 1, 3]))).split()
+        for synonym in rng.sample(list(wm.CROP_SYNONYMS[lang]), rng.choice([0, 1, 1, 2])):
+            words.insert(rng.randrange(len(words) + 1), synonym)
+        queries.append((lang, " ".join(words)))
+    return queries
+
+
+def timed_us(detect, queries: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for lang, query in queries:
+            detect(query, lang)
+        best = min(best, time.perf_counter() - started)
+    return best / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print a JSON line instead of a table")
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    legacy_us = timed_us(legacy_detect_explicit_crop, queries, args.repeat)
+    matcher_us = timed_us(wm.detect_explicit_crop, queries, args.repeat)
+    mentions_us = timed_us(wm.find_crop_mentions, queries, args.repeat)
+    differing = [(lang, query) for lang, query in queries
+                 if legacy_detect_explicit_crop(query, lang) != wm.detect_explicit_crop(query, lang)]
+
+    row = {
+        "queries": len(queries),
+        "legacy_us": round(legacy_us, 2),
+        "matcher_us": round(matcher_us, 2),
+        "speedup": round(legacy_us / matcher_us, 2),
+        "mentions_us": round(mentions_us, 2),
+        "differing": len(differing),
+    }
+    if args.json:
+        print(json.dumps(row))
+        return
+    print(f"{'queries':>8} {'legacy_us':>10} {'matcher_us':>11} {'speedup':>8} {'mentions_us':>12} {'differing':>10}")
+    print(f"{row['queries']:>8} {row['legacy_us']:>10} {row['matcher_us']:>11} {row['speedup']:>8} "
+          f"{row['mentions_us']:>12} {row['differing']:>10}")
+    for lang, query in differing[:3]:
+        print(f"  [{lang}] {query[:60]!r}: legacy={legacy_detect_explicit_crop(query, lang)!r} "
+              f"mentions={wm.find_crop_mentions(query, lang)}")
+
+
+if __name__ == "__main__":
+    main()
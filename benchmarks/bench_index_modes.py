@@ -0,0 +1,108 @@
+"""Compare the RAG index modes: fitted TF-IDF, stateless hashing and dense LSA.
+
+Builds each index type over a synthetic KB of increasing size (every entry in
+all KB languages) and reports
+build time, peak allocation during the build, retained index memory,
+single-query latency and recall@3 against the exact TF-IDF ranking for --lang.
+
+    python benchmarks/bench_index_modes.py --sizes 1000 10000 50000 --lang en
+    python benchmarks/bench_index_modes.py --modes tfidf lsa
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+from kb_generator import synthetic_kb  # noqa: E402
+
+logging.getLogger("whisper_main").setLevel(logging.WARNING)
+
+
+def index_bytes(idx: dict) -> int:
+    mat = idx["vectors"]
+    vect = idx["vectorizer"]
+    if idx["mode"] == "lsa":
+        total = mat.nbytes + sum(p.nbytes for p in vect.projections) + sum(c.nbytes for c in vect.columns)
+        vect = vect.tfidf
+    else:
+        total = mat.data.nbytes + mat.indices.nbytes + mat.indptr.nbytes
+    if idx["mode"] == "hashing":
+        total += vect.df.nbytes + vect.idf_.nbytes + idx["row_norms"].nbytes
+    else:
+        vocab = vect.vocabulary_
+        total += sys.getsizeof(vocab) + sum(sys.getsizeof(term) + sys.getsizeof(col) for term, col in vocab.items())
+        total += vect.idf_.nbytes
+    return total
+
+
+def ranked_rows(idx: dict, queries: list, lang: str, top_k: int = 3) -> list:
+    query_vectors = idx["vectorizer"].transform(queries)
+    ranked = wm.rank_exhaustive(idx, query_vectors, [[] for _ in queries], top_k, wm.language_rows(idx, lang))
+    return [{row for row, score in hits if score > 0} for hits in ranked]
+
+
+def bench(mode: str, kb: dict, lang: str, queries: list):
+    tracemalloc.start()
+    started = time.perf_counter()
+    idx = wm.build_index(kb, mode)
+    build_s = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mat = idx["vectors"]
+    started = time.perf_counter()
+    for query in queries:
+        ranked_rows(idx, [query], lang)
+    query_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    return {
+        "mode": mode,
+        "rows": mat.shape[0],
+        "features": mat.shape[1],
+        "build_s": round(build_s, 3),
+        "build_peak_mb": round(peak / 2 ** 20, 1),
+        "index_mb": round(index_bytes(idx) / 2 ** 20, 2),
+        "query_ms": round(query_ms, 3),
+    }, idx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--modes", nargs="+", default=["tfidf", "hashing", "lsa"])
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    queries = ["rice fertilizer", "tomato pest control", "clay soil drainage", "drip irrigation"] * 25
+    if not args.json:
+        print(f"{'mode':<8} {'rows':>8} {'features':>9} {'build_s':>8} {'peak_mb':>8} {'index_mb':>9} "
+              f"{'query_ms':>9} {'recall@3':>9}")
+    for size in args.sizes:
+        kb = wm.KnowledgeStore.from_dict(synthetic_kb(size))
+        # Recall queries: the opening words of a sample of KB entries
+        texts, _ = wm.collect_lang_corpus(args.lang, kb)
+        recall_queries = [" ".join(text.split()[:6]) for text in random.Random(1).sample(texts, min(200, len(texts)))]
+        exact = ranked_rows(wm.build_index(kb, "tfidf"), recall_queries, args.lang)
+        expected = sum(len(rows) for rows in exact)
+
+        for mode in args.modes:
+            row, idx = bench(mode, kb, args.lang, queries)
+            found = sum(len(rows & truth) for rows, truth in zip(ranked_rows(idx, recall_queries, args.lang), exact))
+            row["recall_at_3"] = round(found / expected, 3) if expected else 1.0
+            if args.json:
+                print(json.dumps(row))
+            else:
+                print(f"{row['mode']:<8} {row['rows']:>8} {row['features']:>9} {row['build_s']:>8} "
+                      f"{row['build_peak_mb']:>8} {row['index_mb']:>9} {row['query_ms']:>9} {row['recall_at_3']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Startup cost of loading the KB: nested JSON vs. streaming JSONL.
+
+Writes a synthetic KB in both formats, then loads each in a fresh interpreter
+and reports load time, file size and peak RSS (the baseline RSS after importing
+the app is shown for reference).
+
+    python benchmarks/bench_kb_loading.py --sizes 10000 50000
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import whisper_main as wm  # noqa: E402
+from kb_generator import synthetic_kb  # noqa: E402
+
+CHILD = """
+import json, resource, sys, time
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+import whisper_main as wm
+
+def rss_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+baseline = rss_mb("VmRSS:")
+started = time.perf_counter()
+kb, kb_hash = wm.read_kb_file(Path(sys.argv[2]))
+load_s = time.perf_counter() - started
+print(json.dumps({"load_s": round(load_s, 3), "baseline_rss_mb": round(baseline, 1),
+                  "peak_rss_mb": round(rss_mb("VmHWM:"), 1), "items": len(kb)}))
+"""
+
+
+def measure(path: Path) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, str(ROOT), str(path)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'format':<7} {'items':>8} {'file_mb':>8} {'load_s':>7} {'base_mb':>8} {'peak_mb':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            kb = synthetic_kb(size)
+            json_path = Path(tmp) / "kb.json"
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(kb, f, ensure_ascii=False)
+            jsonl_path = Path(tmp) / "kb.jsonl"
+            wm.write_kb_jsonl(wm.iter_kb_records(kb), jsonl_path)
+            del kb
+
+            for fmt, path in (("json", json_path), ("jsonl", jsonl_path)):
+                row = {"format": fmt, "file_mb": round(path.stat().st_size / 2 ** 20, 1), **measure(path)}
+                if args.json:
+                    print(json.dumps(row))
+                else:
+                    print(f"{fmt:<7} {row['items']:>8} {row['file_mb']:>8} {row['load_s']:>7} "
+                          f"{row['baseline_rss_mb']:>8} {row['peak_rss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Resident size of the KB: nested dicts vs. the columnar KnowledgeStore.
+
+Builds a synthetic KB as nested dicts and as a KnowledgeStore, measures the bytes
+each allocates (tracemalloc) and the latency of decoding one variant by entry id,
+for a few compression block sizes.
+
+    python benchmarks/bench_kb_store.py --entries 20000 --blocks 1 16 32 64
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import whisper_main as wm  # noqa: E402
+from kb_generator import synthetic_kb  # noqa: E402
+
+
+def allocated(build):
+    """(result, bytes still allocated by build())"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def lookup_us(get, n_entries: int, languages: list, n: int = 20000) -> float:
+    rng = random.Random(0)
+    probes = [(rng.randrange(n_entries), rng.choice(languages)) for _ in range(n)]
+    started = time.perf_counter()
+    for entry, lang in probes:
+        get(entry, lang)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[1, 16, 32, 64])
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    # Serialize first so the dict measurement covers only the parsed KB
+    payload = json.dumps(synthetic_kb(args.entries), ensure_ascii=False)
+    kb, dict_bytes = allocated(lambda: json.loads(payload))
+    languages = sorted({lang for items in kb.values() for variants in items.values() for lang in variants})
+    entries = [variants for items in kb.values() for variants in items.values()]
+
+    rows = [{"layout": "dict", "bytes_per_entry": round(dict_bytes / len(entries)),
+             "lookup_us": round(lookup_us(lambda e, lang: entries[e].get(lang, ""), len(entries), languages), 2)}]
+    for block in args.blocks:
+        store, store_bytes = allocated(lambda: wm.KnowledgeStore.from_records(wm.iter_kb_records(kb), block))
+        rows.append({"layout": f"store/{block}", "bytes_per_entry": round(store_bytes / len(store)),
+                     "lookup_us": round(lookup_us(store.text, len(store), languages), 2)})
+        del store
+
+    if not args.json:
+        print(f"{'layout':<10} {'bytes/entry':>12} {'ratio':>6} {'lookup_us':>10}")
+    for row in rows:
+        row["ratio"] = round(rows[0]["bytes_per_entry"] / row["bytes_per_entry"], 1)
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{row['layout']:<10} {row['bytes_per_entry']:>12} {row['ratio']:>6} {row['lookup_us']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Retrieval scaling suite: index build and query latency as the KB grows.
+
+For each KB size (synthetic, all five KB languages, see kb_generator.py) and
+index mode, reports KB load time and store size, index build time and memory,
+and p50/p99 latency of single queries (get_rag_context) and of query batches
+(get_rag_context_batch), over queries in every KB language.
+
+Results are written as one JSON document (environment, git revision, rows) so
+runs of different versions can be compared with --baseline:
+
+    python benchmarks/bench_retrieval_scaling.py --sizes 1000 10000 100000 --out results/v2.json
+    python benchmarks/bench_retrieval_scaling.py --sizes 1000 10000 --baseline results/v2.json
+    python benchmarks/bench_retrieval_scaling.py --sizes 1000000 --modes hashing --no-trace
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import whisper_main as wm  # noqa: E402
+from bench_index_modes import index_bytes  # noqa: E402
+from kb_generator import synthetic_records  # noqa: E402
+
+logging.getLogger("whisper_main").setLevel(logging.WARNING)
+
+# Lower is better for every compared metric
+COMPARED = ["kb_load_s", "build_s", "index_mb", "single_p50_ms", "single_p99_ms", "batch_p50_ms", "batch_p99_ms"]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentiles(samples: list) -> tuple:
+    p50, p99 = np.percentile(np.asarray(samples) * 1000, [50, 99])
+    return round(float(p50), 3), round(float(p99), 3)
+
+
+def make_queries(store, languages: list, n: int, seed: int = 1) -> list:
+    """(language, query) pairs: the opening words of random entries in each language"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n):
+        lang = languages[i % len(languages)]
+        words = store.text(rng.randrange(len(store)), lang).split()
+        start = rng.randrange(max(1, len(words) - 5))
+        queries.append((lang, " ".join(words[start:start + 5])))
+    return queries
+
+
+def run(size: int, mode: str, store, kb_load_s: float, args) -> dict:
+    if args.trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    idx = wm.build_index(store, mode)
+    build_s = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if args.trace else 0
+    if args.trace:
+        tracemalloc.stop()
+
+    # Route the app's retrieval functions to this index
+    wm.AGRICULTURE_KB, wm.kb_index = store, idx
+    queries = make_queries(store, args.languages, args.queries)
+    # Warm-up: the first query per language builds its row mask
+    for lang in args.languages:
+        wm.get_rag_context_batch(["warm up"], lang)
+
+    single = []
+    for lang, query in queries:
+        started = time.perf_counter()
+        wm.get_rag_context(query, lang)
+        single.append(time.perf_counter() - started)
+
+    # Batches are per language, as the batch endpoint takes one language
+    batches = []
+    for lang in args.languages:
+        texts = [query for query_lang, query in queries if query_lang == lang]
+        for i in range(0, len(texts), args.batch):
+            started = time.perf_counter()
+            wm.get_rag_context_batch(texts[i:i + args.batch], lang)
+            batches.append((time.perf_counter() - started, len(texts[i:i + args.batch])))
+
+    single_p50, single_p99 = percentiles(single)
+    batch_p50, batch_p99 = percentiles([seconds for seconds, _ in batches])
+    batch_queries = sum(count for _, count in batches)
+    return {
+        "entries": size,
+        "mode": mode,
+        "rows": idx["vectors"].shape[0],
+        "kb_load_s": round(kb_load_s, 3),
+        "kb_store_mb": round(store.nbytes / 2 ** 20, 2),
+        "build_s": round(build_s, 3),
+        "build_peak_mb": round(peak / 2 ** 20, 1) if args.trace else None,
+        "index_mb": round(index_bytes(idx) / 2 ** 20, 2),
+        "rss_mb": round(rss_mb(), 1),
+        "single_p50_ms": single_p50,
+        "single_p99_ms": single_p99,
+        "batch_size": args.batch,
+        "batch_p50_ms": batch_p50,
+        "batch_p99_ms": batch_p99,
+        "batch_qps": round(batch_queries / sum(seconds for seconds, _ in batches), 1),
+    }
+
+
+def environment() -> dict:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = "unknown"
+    return {
+        "git_revision": revision,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "RAG_CANDIDATE_BUDGET": wm.RAG_CANDIDATE_BUDGET,
+            "RAG_SHARDS": wm.RAG_SHARDS,
+            "KB_STORE_BLOCK": wm.KB_STORE_BLOCK,
+        },
+    }
+
+
+def compare(rows: list, baseline_path: Path, threshold: float) -> int:
+    """Print the change of each metric against a previous run; returns the number of regressions"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(row["entries"], row["mode"]): row for row in baseline["results"]}
+    print(f"\nvs. {baseline_path} ({baseline['environment']['git_revision']}), "
+          f"! marks a regression above {threshold:.0%}")
+    print(f"{'entries':>8} {'mode':<8} " + " ".join(f"{name:>14}" for name in COMPARED))
+    regressions = 0
+    for row in rows:
+        old = previous.get((row["entries"], row["mode"]))
+        if old is None:
+            continue
+        cells = []
+        for name in COMPARED:
+            if not old.get(name):
+                cells.append(f"{'-':>14}")
+                continue
+            change = row[name] / old[name] - 1
+            flag = "!" if change > threshold else " "
+            regressions += flag == "!"
+            cells.append(f"{change:>+12.1%} {flag}")
+        print(f"{row['entries']:>8} {row['mode']:<8} " + " ".join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modes", nargs="+", default=[wm.RAG_INDEX_MODE])
+    parser.add_argument("--languages", nargs="+", default=None, help="Query languages (default: all KB languages)")
+    parser.add_argument("--queries", type=int, default=200, help="Single queries per run")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--novel-words", type=int, default=3, help="Made-up words per variant (vocabulary growth)")
+    parser.add_argument("--no-trace", dest="trace", action="store_false",
+                        help="Skip tracemalloc (much faster builds for very large KBs; "
+                             "only compare build_s between runs with the same setting)")
+    parser.add_argument("--out", type=Path, default=None, help="Results file (default: results/scaling-<rev>.json)")
+    parser.add_argument("--baseline", type=Path, default=None, help="Compare against an earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    env = environment()
+    rows = []
+    print(f"{'entries':>8} {'mode':<8} {'load_s':>7} {'kb_mb':>7} {'build_s':>8} {'peak_mb':>8} {'index_mb':>9} "
+          f"{'rss_mb':>7} {'p50_ms':>7} {'p99_ms':>7} {'batch_p50':>10} {'batch_p99':>10} {'qps':>8}")
+    for size in args.sizes:
+        started = time.perf_counter()
+        store = wm.KnowledgeStore.from_records(
+            synthetic_records(size, categories=tuple(wm.FALLBACK_KB), novel_words=args.novel_words)
+        )
+        kb_load_s = time.perf_counter() - started
+        args.languages = args.languages or store.languages
+
+        for mode in args.modes:
+            row = run(size, mode, store, kb_load_s, args)
+            rows.append(row)
+            print(f"{row['entries']:>8} {row['mode']:<8} {row['kb_load_s']:>7} {row['kb_store_mb']:>7} "
+                  f"{row['build_s']:>8} {str(row['build_peak_mb']):>8} {row['index_mb']:>9} {row['rss_mb']:>7} "
+                  f"{row['single_p50_ms']:>7} {row['single_p99_ms']:>7} {row['batch_p50_ms']:>10} "
+                  f"{row['batch_p99_ms']:>10} {row['batch_qps']:>8}", flush=True)
+        wm.kb_index = None
+
+    out = args.out or Path(__file__).resolve().parent / "results" / f"scaling-{env['git_revision']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"environment": env, "languages": args.languages, "results": rows}, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.baseline and compare(rows, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
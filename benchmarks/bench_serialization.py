@@ -0,0 +1,115 @@
+"""Response size and serialization CPU: full vs. compact responses.
+
+Builds real /query responses (answer_query over KB sentences in every language,
+with and without soil/land profiles) and encodes each the way the endpoints do:
+a plain dict through FastAPI (jsonable_encoder + JSONResponse), or a compact
+response (constant fields dropped) through CompactJSONResponse (orjson when
+installed). For /generate-tts, a synthetic MP3 is sent as base64 inside JSON or
+as raw audio/mpeg. Reports mean bytes on the wire (plain and gzip) and
+microseconds of encoding per response.
+
+    python benchmarks/bench_serialization.py --responses 500 --audio-kb 32
+"""
+import argparse
+import base64
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+logging.getLogger("whisper_main").setLevel(logging.WARNING)
+
+
+def make_responses(n: int, seed: int = 0) -> list:
+    """Full /query response dicts for KB sentences in every language"""
+    rng = random.Random(seed)
+    sentences = {}
+    for items in wm.FALLBACK_KB.values():
+        for variants in items.values():
+            for lang, text in variants.items():
+                sentences.setdefault(lang, []).extend(s.strip() for s in text.split(".") if s.strip())
+    languages = sorted(sentences)
+    season = wm.season_of_day()
+    responses = []
+    for i in range(n):
+        request = wm.QueryRequest(
+            query=rng.choice(sentences[languages[i % len(languages)]]),
+            language=languages[i % len(languages)],
+            soil_type=rng.choice(["", "clay", "sandy"]),
+            land_size=rng.choice(["", "small"])
+        )
+        answer, rag_sources = wm.answer_query(request, season)
+        responses.append(wm.query_response(request, answer, rag_sources, wm.query_user_context(request), time.time()))
+    return responses
+
+
+def measure(name: str, encode, contents: list, repeat: int) -> dict:
+    bodies = [encode(content).body for content in contents]
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for content in contents:
+            encode(content)
+        best = min(best, time.perf_counter() - started)
+    return {
+        "variant": name,
+        "bytes": round(sum(map(len, bodies)) / len(bodies)),
+        "gzip_bytes": round(sum(len(gzip.compress(body)) for body in bodies) / len(bodies)),
+        "encode_us": round(best / len(contents) * 1e6, 2),
+    }
+
+
+def tts_json(audio: bytes) -> JSONResponse:
+    return JSONResponse(jsonable_encoder({
+        "success": True,
+        "audio_base64": base64.b64encode(audio).decode("utf-8"),
+        "service": "gTTS-en",
+        "voice": "Google-en",
+        "language": "en",
+        "audio_format": "mp3",
+        "message": "Generated high-quality gTTS for en"
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", type=int, default=500)
+    parser.add_argument("--audio-kb", type=int, default=32, help="Synthetic MP3 size (gTTS: ~4 KB per second of speech)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    responses = make_responses(args.responses)
+    encoder = "orjson" if wm.orjson is not None else "json"
+    audio = [os.urandom(args.audio_kb * 1024)]
+    rows = [
+        measure("query/full", lambda r: JSONResponse(jsonable_encoder(r)), responses, args.repeat),
+        measure(f"query/full-{encoder}", wm.CompactJSONResponse, responses, args.repeat),
+        measure(f"query/compact-{encoder}", lambda r: wm.CompactJSONResponse(wm.compact_response(r)),
+                responses, args.repeat),
+        measure("tts/base64-json", tts_json, audio, args.repeat * 20),
+        measure("tts/raw-mp3", lambda a: Response(a, media_type="audio/mpeg"), audio, args.repeat * 20),
+    ]
+
+    if not args.json:
+        print(f"{'variant':<22} {'bytes':>8} {'gzip_bytes':>11} {'encode_us':>10}")
+    for row in rows:
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{row['variant']:<22} {row['bytes']:>8} {row['gzip_bytes']:>11} {row['encode_us']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Scaling of sharded scoring with the size of the thread pool.
+
+Builds one index over a synthetic multi-category KB, then scores a query batch
+unsharded and with RAG shards on pools of 1/2/4/8 threads. By default this is
+exhaustive scoring, checking that every configuration returns the same rows;
+with --candidate-budget it is two-stage retrieval, where shards rerank a superset
+of the unsharded candidates and same_rows reports whether the top rows still agree.
+
+    python benchmarks/bench_sharded_scoring.py --entries 100000 --pools 1 2 4 8
+    python benchmarks/bench_sharded_scoring.py --entries 100000 --candidate-budget 300
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+from kb_generator import synthetic_kb  # noqa: E402
+
+logging.getLogger("whisper_main").setLevel(logging.WARNING)
+
+CATEGORIES = ("crops", "soil", "pests", "irrigation", "fertilizer", "weather", "market", "schemes")
+
+
+def timed(fn, repeat: int):
+    result = fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return result, (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--pools", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--shards", type=int, default=0, help="Shard count (default: same as the pool size)")
+    parser.add_argument("--batch", type=int, default=32, help="Queries per scoring call")
+    parser.add_argument("--candidate-budget", type=int, default=0, help="Two-stage budget (0: exhaustive)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    kb = wm.KnowledgeStore.from_dict(synthetic_kb(args.entries, categories=CATEGORIES))
+    idx = wm.build_index(kb)
+    mask = wm.language_rows(idx, args.lang)
+    queries = (["rice fertilizer", "tomato pest control", "clay soil drainage", "drip irrigation"] * args.batch)[:args.batch]
+    query_vectors = idx["vectorizer"].transform(queries)
+    boosts = [[] for _ in queries]
+
+    budget = args.candidate_budget
+    if budget:
+        def unsharded():
+            return wm.rank_candidates(idx, query_vectors, boosts, 3, budget, mask)
+
+        def sharded(pool):
+            return wm.rank_candidates_sharded(idx, query_vectors, boosts, 3, budget, mask, pool)
+    else:
+        def unsharded():
+            return wm.rank_exhaustive(idx, query_vectors, boosts, 3, mask)
+
+        def sharded(pool):
+            return wm.rank_sharded(idx, query_vectors, boosts, 3, mask, pool)
+
+    baseline, baseline_ms = timed(unsharded, args.repeat)
+    rows = [{"pool": 0, "shards": 1, "ms": round(baseline_ms, 2), "speedup": 1.0, "same_rows": True}]
+
+    for pool_size in args.pools:
+        idx["shards"] = wm.build_shard_ranges(idx["keys"], args.shards or pool_size)
+        idx.pop("shard_matrices", None)
+        with ThreadPoolExecutor(max_workers=pool_size) as pool:
+            ranked, ms = timed(lambda: sharded(pool), args.repeat)
+        same = [[r for r, _ in hits] for hits in ranked] == [[r for r, _ in hits] for hits in baseline]
+        rows.append({"pool": pool_size, "shards": len(idx["shards"]), "ms": round(ms, 2),
+                     "speedup": round(baseline_ms / ms, 2), "same_rows": same})
+
+    path = f"two-stage (budget {budget})" if budget else "exhaustive"
+    print(f"# {args.entries} entries, {len(queries)} queries per call, {path}, {os.cpu_count()} CPUs")
+    if not args.json:
+        print(f"{'pool':>5} {'shards':>7} {'ms':>9} {'speedup':>8} {'same_rows':>10}")
+    for row in rows:
+        if args.json:
+            print(json.dumps(row))
+        else:
+            pool = row["pool"] or "mono"
+            print(f"{pool:>5} {row['shards']:>7} {row['ms']:>9} {row['speedup']:>8} {str(row['same_rows']):>10}")
+
+
+if __name__ == "__main__":
+    main()
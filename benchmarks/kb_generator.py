@@ -0,0 +1,75 @@
+"""Synthetic multilingual knowledge bases for the benchmarks.
+
+Entries recombine sentences of the built-in KB in every one of its languages
+(en, hi, ta, te, ml: five scripts). With novel_words, each variant also gets
+made-up words assembled from letter fragments of its own language, so the
+vocabulary keeps growing with the KB as it would with real content.
+
+    python benchmarks/kb_generator.py 100000 --novel-words 3 --out /tmp/kb.jsonl
+"""
+import argparse
+import random
+import sys
+import unicodedata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+def language_pools() -> tuple:
+    """Per-language sentences and word fragments of the built-in KB"""
+    sentences, fragments = {}, {}
+    for items in wm.FALLBACK_KB.values():
+        for variants in items.values():
+            for lang, text in variants.items():
+                sentences.setdefault(lang, []).extend(s.strip() for s in text.split(".") if s.strip())
+                pool = fragments.setdefault(lang, set())
+                for word in text.split():
+                    word = "".join(ch for ch in word if unicodedata.category(ch)[0] in "LM")
+                    # Keep combining marks attached to their base letter
+                    pool.update(word[i:i + 3] for i in range(len(word) - 2)
+                                if unicodedata.category(word[i])[0] == "L")
+    return sentences, {lang: sorted(pool) for lang, pool in fragments.items()}
+
+
+def synthetic_records(n_entries: int, seed: int = 0, categories: tuple = ("crops",), novel_words: int = 0):
+    """Stream (category, item, variants) records without materializing the KB"""
+    rng = random.Random(seed)
+    sentences, fragments = language_pools()
+    for i in range(n_entries):
+        category = categories[i * len(categories) // n_entries]
+        variants = {}
+        for lang, pool in sentences.items():
+            text = ". ".join(rng.sample(pool, min(4, len(pool))))
+            if novel_words:
+                words = ("".join(rng.choices(fragments[lang], k=rng.randint(2, 3))) for _ in range(novel_words))
+                text += ". " + " ".join(words)
+            variants[lang] = text + f". Variety {i}."
+        yield category, f"{category}_{i}", variants
+
+
+def synthetic_kb(n_entries: int, seed: int = 0, categories: tuple = ("crops",), novel_words: int = 0) -> dict:
+    """Grow the built-in KB to n_entries by recombining sentences of its entries"""
+    kb = {category: {} for category in categories}
+    for category, item, variants in synthetic_records(n_entries, seed, categories, novel_words):
+        kb[category][item] = variants
+    return kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic KB as JSONL")
+    parser.add_argument("entries", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--novel-words", type=int, default=3)
+    parser.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args()
+
+    records = synthetic_records(args.entries, args.seed, tuple(wm.FALLBACK_KB), args.novel_words)
+    count = wm.write_kb_jsonl(records, args.out)
+    print(f"Wrote {count} entries to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
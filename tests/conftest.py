@@ -0,0 +1,29 @@
+"""Shared fixtures: keep index artifacts and client budgets per test."""
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+# Set before whisper_main is imported, so nothing is ever written under data/
+os.environ.setdefault("KB_INDEX_DIR", tempfile.mkdtemp(prefix="agri_kb_index_"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    """KB_INDEX_DIR under tmp_path for every test"""
+    monkeypatch.setattr(wm, "INDEX_DIR", tmp_path / "agri_kb.index")
+    monkeypatch.setattr(wm, "INDEX_PATH", tmp_path / "agri_kb.index" / "kb.idx")
+    return tmp_path / "agri_kb.index"
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits(monkeypatch):
+    """Every test starts with full token buckets"""
+    for buckets in (wm.query_buckets, wm.tts_buckets):
+        monkeypatch.setattr(buckets, "_buckets", OrderedDict())
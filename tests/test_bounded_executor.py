@@ -0,0 +1,68 @@
+"""Retrieval runs on the bounded pools, and a saturated pool answers 503."""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+client = TestClient(wm.app)
+
+
+def test_submissions_past_max_pending_are_rejected():
+    executor = wm.BoundedExecutor("test-worker", 1, 2)
+    release = threading.Event()
+
+    async def scenario():
+        running = executor.submit(release.wait)
+        queued = executor.submit(lambda: "queued")
+        with pytest.raises(wm.ExecutorSaturated):
+            executor.submit(lambda: "rejected")
+        assert executor.stats()["queued"] + executor.stats()["running"] == 2
+        release.set()
+        return await running, await queued, await executor.run(lambda: "after")
+
+    try:
+        assert asyncio.run(scenario()) == (True, "queued", "after")
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert (stats["completed"], stats["rejected"], stats["max_queued"]) == (3, 1, 1)
+    assert stats["wait_ms"]["samples"] == 3
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    executor = wm.BoundedExecutor("saturated", 1, 0)
+    monkeypatch.setattr(wm, "retrieval_executor", executor)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/query", {"query": "saturated pool rice fertilizer"}),
+    ("/query/stream", {"query": "saturated pool wheat sowing"}),
+    ("/query/batch", {"queries": ["saturated pool tomato pests"]})
+])
+def test_saturated_pool_answers_503(saturated, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert saturated.stats()["rejected"] == 1
+
+
+def test_retrieval_runs_off_the_event_loop(monkeypatch):
+    threads = []
+    retrieve = wm.retrieve_for_query
+
+    def recording(request):
+        threads.append(threading.current_thread().name)
+        return retrieve(request)
+    monkeypatch.setattr(wm, "retrieve_for_query", recording)
+    assert client.post("/query", json={"query": "which thread scores rice fertilizer"}).status_code == 200
+    assert len(threads) == 1 and threads[0].startswith("rag-worker")
@@ -0,0 +1,83 @@
+"""Identical concurrent work runs once (SingleFlight) and its callers share the result."""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+def test_concurrent_callers_share_one_call():
+    flights = wm.SingleFlight("test")
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    async def scenario():
+        results = await asyncio.gather(*(flights.do((key,), lambda key=key: work(key)) for key in "aaab"))
+        assert flights.stats()["in_flight"] == 0
+        # Once finished, the next call for the key runs again
+        return results, await flights.do(("a",), lambda: work("a"))
+
+    assert asyncio.run(scenario()) == (["A", "A", "A", "B"], "A")
+    assert calls == ["a", "b", "a"]
+    assert flights.stats() == {"executed": 3, "coalesced": 2, "in_flight": 0, "coalesced_ratio": 0.4}
+
+
+def test_failures_reach_every_caller_and_clear_the_flight():
+    flights = wm.SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(*(flights.do(("k",), fail) for _ in range(3)), return_exceptions=True)
+        return results, flights.stats()["in_flight"]
+
+    results, in_flight = asyncio.run(scenario())
+    assert [str(e) for e in results] == ["boom"] * 3 and in_flight == 0
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_work():
+    flights = wm.SingleFlight("test")
+
+    async def scenario():
+        first = asyncio.ensure_future(flights.do(("k",), lambda: asyncio.sleep(0.02, result="done")))
+        second = asyncio.ensure_future(flights.do(("k",), lambda: pytest.fail("ran twice")))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_identical_concurrent_queries_run_retrieval_once(monkeypatch):
+    calls = []
+    answer_query = wm.answer_query
+
+    def slow_answer(request, season):
+        calls.append(request.query)
+        time.sleep(0.2)
+        return answer_query(request, season)
+    monkeypatch.setattr(wm, "answer_query", slow_answer)
+    monkeypatch.setattr(wm, "query_flights", wm.SingleFlight("query"))
+
+    async def scenario():
+        async with httpx.AsyncClient(app=wm.app, base_url="http://test") as client:
+            body = {"query": "How do I coalesce rice fertilizer questions?"}
+            return await asyncio.gather(*(client.post("/query", json=body) for _ in range(5)))
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200] * 5
+    assert len({response.json()["answer"] for response in responses}) == 1
+    assert len(calls) == 1
+    assert wm.query_flights.stats()["coalesced"] == 4
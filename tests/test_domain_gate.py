@@ -0,0 +1,106 @@
+"""The domain gate must admit everything the KB or a fallback answer can handle."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+FALLBACK_TERMS = sorted({term for _, terms in wm.FALLBACK_CATEGORY_TERMS for term in terms})
+
+
+@pytest.mark.parametrize("language", wm.SUPPORTED_LANGUAGES)
+def test_kb_names_are_admitted(language):
+    rejected = [name for name in wm.kb_vocabulary(wm.AGRICULTURE_KB)
+                if not wm.is_agriculture_related(name, language)]
+    assert rejected == []
+
+
+@pytest.mark.parametrize("language", wm.SUPPORTED_LANGUAGES)
+def test_fallback_terms_are_admitted(language):
+    assert [term for term in FALLBACK_TERMS if not wm.is_agriculture_related(term, language)] == []
+
+
+@pytest.mark.parametrize("query", [
+    "how to treat blight",
+    "sprinkler system cost",
+    "drip system for my orchard",
+    "loamy or clay better",
+    "urea dose per acre",
+    "dap dose",
+])
+def test_kb_vocabulary_questions_are_admitted(query):
+    assert wm.is_agriculture_related(query, "en")
+
+
+# Real farm questions, as typed: crop and pest names outside the KB, inflections, and
+# Hindi/Tamil/Malayalam in Latin script
+FARM_QUERIES = [
+    ("best time to sow mustard", "en"),
+    ("thrips in chilli", "en"),
+    ("aphids on my roses", "en"),
+    ("yellow leaves on tomato plants", "en"),
+    ("root rot in beans", "en"),
+    ("soil ph test", "en"),
+    ("green tea cultivation", "en"),
+    ("how much water does sugarcane need", "en"),
+    ("is it good weather for spraying", "en"),
+    ("price of onions in mandi", "en"),
+    ("How much urea for wheat?", "en"),
+    ("my cotton crop has whitefly", "en"),
+    ("how deep to plant potatoes", "en"),
+    ("coconut tree yellowing", "en"),
+    ("which crop for sandy soil", "en"),
+    ("pest control for brinjal", "en"),
+    ("gehun mein khad kab dalein", "en"),
+    ("dhan ki buvai kab kare", "hi"),
+    ("kapas me keet lag gaye", "hi"),
+    ("tamatar ki kheti kaise kare", "en"),
+    ("nel vivasayam tips", "ta"),
+    ("nellu krishi", "ml"),
+    ("धान की बुवाई कब करें", "hi"),
+    ("நெல் சாகுபடி எப்படி", "ta"),
+    ("వరి పంటకు ఎరువులు", "te"),
+    ("നെല്ല് കൃഷി എങ്ങനെ", "ml"),
+]
+
+
+@pytest.mark.parametrize("query, language", FARM_QUERIES)
+def test_farm_questions_are_admitted(query, language):
+    assert wm.is_agriculture_related(query, language)
+
+
+# Off-topic text containing short vocabulary terms inside longer words
+# ('ph', 'tea', 'rot', 'dap', 'rain', 'plant', 'pest')
+@pytest.mark.parametrize("query", [
+    "what is the capital of france",
+    "my phone is broken",
+    "steam engine history",
+    "how to rotate a pdf",
+    "adapter for my laptop",
+    "teacher salary in delhi",
+    "train ticket booking",
+    "planetarium opening hours",
+    "budapest travel guide",
+    "graph theory basics",
+])
+def test_off_topic_questions_are_rejected(query):
+    assert not wm.is_agriculture_related(query, "en")
+
+
+def test_short_terms_match_whole_words_only():
+    assert wm.shortest_prefixes(["tea", "teak", "team", "crop", "crops", "cropping"]) == ["crop", "tea", "teak", "team"]
+    pattern = wm.compile_terms(["tea", "crop"], words=True)
+    assert pattern.search("tea leaves") and pattern.search("cropping season")
+    assert not pattern.search("steam") and not pattern.search("teas") and not pattern.search("microcrop")
+
+
+def test_new_vocabulary_admits_new_kb_items():
+    gate = wm.DomainGate(wm.AGRICULTURE_KB)
+    assert not gate.matches("is zorbleweed worth it", "en")
+    records = list(wm.iter_kb_records(wm.FALLBACK_KB))
+    records.append(("crops", "zorbleweed", {"en": "Zorbleweed is a made-up test crop."}))
+    gate.vocabulary = gate.compile_vocabulary(wm.KnowledgeStore.from_records(records))
+    assert gate.matches("is zorbleweed worth it", "en")
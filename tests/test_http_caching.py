@@ -0,0 +1,73 @@
+"""GET /query validators: ETag, Cache-Control and 304 revalidation."""
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+client = TestClient(wm.app)
+PARAMS = {"query": "When to plant rice?", "soil_type": "clay"}
+
+
+def etag_for(**params):
+    response = client.get("/query", params=params)
+    assert response.status_code == 200
+    return response.headers["etag"]
+
+
+def test_answer_carries_a_weak_etag_and_public_max_age():
+    response = client.get("/query", params=PARAMS)
+    assert response.status_code == 200 and response.json()["answer"]
+    assert response.headers["etag"].startswith('W/"')
+    directive, max_age = response.headers["cache-control"].split(", max-age=")
+    assert directive == "public" and 0 < int(max_age) <= wm.QUERY_HTTP_MAX_AGE
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "{opaque}", '"other", {etag}', "*"])
+def test_matching_if_none_match_gets_304_without_retrieval(monkeypatch, if_none_match):
+    etag = etag_for(**PARAMS)
+
+    async def fail(request):
+        pytest.fail("answered a revalidation")
+    monkeypatch.setattr(wm, "timed_query", fail)
+    header = if_none_match.format(etag=etag, opaque=etag[2:])
+    response = client.get("/query", params=PARAMS, headers={"If-None-Match": header})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_stale_etag_gets_the_answer():
+    response = client.get("/query", params=PARAMS, headers={"If-None-Match": 'W/"stale"'})
+    assert response.status_code == 200 and response.json()["answer"]
+
+
+def test_etag_follows_the_normalized_request_and_the_kb(monkeypatch):
+    etag = etag_for(**PARAMS)
+    assert etag_for(**dict(PARAMS, query="  when TO plant   rice? ")) == etag
+    assert etag_for(**dict(PARAMS, soil_type="sandy")) != etag
+    assert etag_for(**dict(PARAMS, compact=True)) != etag
+    monkeypatch.setattr(wm, "KB_HASH", "reloaded")
+    assert etag_for(**PARAMS) != etag
+
+
+def test_max_age_never_outlives_the_season(monkeypatch):
+    monkeypatch.setattr(wm, "next_season_boundary", lambda: time.time() + 10.5)
+    assert wm.query_cache_control() == "public, max-age=10"
+    monkeypatch.setattr(wm, "next_season_boundary", lambda: time.time() - 1)
+    assert wm.query_cache_control() == "no-cache"
+
+
+def test_error_fallback_is_not_cacheable(monkeypatch):
+    def fail(request, season):
+        raise RuntimeError("retrieval failed")
+    monkeypatch.setattr(wm, "answer_query", fail)
+    response = client.get("/query", params={"query": "uncacheable wheat fertilizer schedule"})
+    assert response.json()["error"] == "handled_gracefully"
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
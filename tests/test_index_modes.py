@@ -0,0 +1,65 @@
+"""tfidf, hashing and lsa indexes must retrieve the same items."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+MODES = ["tfidf", "hashing", "lsa"]
+QUERIES = {
+    "en": ["tomato pests and blight", "how to grow wheat", "potato storage", "cotton bolls harvest", "clay soil drainage"],
+    "hi": ["धान की खेती", "गेहूं की बुवाई"],
+    "ta": ["தக்காளி பூச்சி"]
+}
+
+
+@pytest.fixture(scope="module")
+def kb():
+    return wm.KnowledgeStore.from_dict(wm.FALLBACK_KB)
+
+
+@pytest.fixture(scope="module")
+def indexes(kb):
+    return {mode: wm.build_index(kb, mode) for mode in MODES}
+
+
+def top_items(idx, language, queries):
+    mask = wm.language_rows(idx, language)
+    ranked = wm.rank_exhaustive(idx, idx['vectorizer'].transform(queries), [[] for _ in queries], 1, mask)
+    return [idx['keys'][hits[0][0]] for hits in ranked]
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("language", ["en", "ta", "hi"])
+def test_every_row_retrieves_itself(kb, indexes, mode, language):
+    idx = indexes[mode]
+    rows = np.flatnonzero(idx['row_langs'] == idx['languages'].index(language))
+    texts = [kb.text(int(idx['item_ids'][row]), language) for row in rows]
+    assert top_items(idx, language, texts) == [idx['keys'][row] for row in rows]
+
+
+@pytest.mark.parametrize("language", QUERIES)
+def test_modes_agree_on_the_best_item(indexes, language):
+    expected = top_items(indexes["tfidf"], language, QUERIES[language])
+    for mode in MODES[1:]:
+        assert top_items(indexes[mode], language, QUERIES[language]) == expected, mode
+
+
+def test_lsa_embeddings_are_normalized_float32(indexes):
+    idx = indexes["lsa"]
+    embeddings = idx['vectors']
+    assert embeddings.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, atol=1e-5)
+
+
+def test_lsa_rows_are_scored_in_their_language_space(indexes):
+    idx = indexes["lsa"]
+    query_vectors = idx['vectorizer'].transform(QUERIES["en"] + QUERIES["ta"])
+    assert query_vectors.shape[:2] == (len(QUERIES["en"]) + len(QUERIES["ta"]), len(idx['languages']))
+    scores = wm.dense_scores(query_vectors, idx['vectors'], idx['row_langs'])
+    for row, code in enumerate(idx['row_langs'].tolist()):
+        np.testing.assert_allclose(scores[:, row], query_vectors[:, code] @ idx['vectors'][row], atol=1e-6)
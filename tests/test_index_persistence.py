@@ -0,0 +1,71 @@
+"""The flat index file: save, memory-map back, and rank exactly like the built index."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+QUERIES = {"en": ["rice fertilizer schedule", "tomato leaf curl"], "hi": ["गेहूं की बुवाई", "धान में खाद"]}
+
+
+@pytest.fixture
+def kb():
+    return wm.KnowledgeStore.from_dict(wm.FALLBACK_KB)
+
+
+def memory_mapped(arr) -> bool:
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+def rankings(idx):
+    results = {}
+    for language, queries in QUERIES.items():
+        mask = wm.language_rows(idx, language)
+        query_vectors = idx['vectorizer'].transform(queries)
+        boosts = [wm.boost_rows_for(idx, crop, "", mask) for crop in ("rice", "")]
+        results[language] = wm.rank_exhaustive(idx, query_vectors, boosts, 5, mask)
+    return results
+
+
+@pytest.mark.parametrize("mode", ["tfidf", "hashing", "lsa"])
+def test_round_trip_is_memory_mapped_and_ranks_the_same(kb, tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(wm, "RAG_INDEX_MODE", mode)
+    built = wm.build_index(kb, mode)
+    path = tmp_path / "kb.idx"
+    assert wm.save_index(built, "kb-hash", path)
+    assert not [p for p in tmp_path.iterdir() if p != path]
+
+    loaded = wm.load_index(kb, "kb-hash", path)
+    assert loaded is not None and loaded['mode'] == mode
+    vectors = loaded['vectors']
+    assert memory_mapped(vectors if mode == 'lsa' else vectors.data)
+    assert list(loaded['keys']) == list(built['keys'])
+    assert loaded['languages'] == built['languages']
+    np.testing.assert_array_equal(loaded['row_langs'], built['row_langs'])
+
+    for language, ranked in rankings(built).items():
+        for got, want in zip(rankings(loaded)[language], ranked):
+            assert [row for row, _ in got] == [row for row, _ in want]
+            assert [score for _, score in got] == pytest.approx([score for _, score in want], abs=1e-6)
+
+
+def test_stale_or_foreign_files_are_not_loaded(kb, tmp_path, monkeypatch):
+    monkeypatch.setattr(wm, "RAG_INDEX_MODE", "tfidf")
+    path = tmp_path / "kb.idx"
+    assert wm.save_index(wm.build_index(kb, "tfidf"), "kb-hash", path)
+
+    assert wm.load_index(kb, "other-hash", path) is None
+    monkeypatch.setattr(wm, "RAG_INDEX_MODE", "hashing")
+    assert wm.load_index(kb, "kb-hash", path) is None
+    assert wm.load_index(kb, "kb-hash", tmp_path / "missing.idx") is None
+
+    path.write_bytes(b"not an index")
+    assert wm.load_index(kb, "kb-hash", path) is None
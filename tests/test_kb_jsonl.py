@@ -0,0 +1,61 @@
+"""The streaming JSONL KB format and its loader."""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+def test_jsonl_round_trip_matches_the_nested_kb(tmp_path):
+    nested = tmp_path / "agri_kb.json"
+    nested.write_text(json.dumps(wm.FALLBACK_KB, ensure_ascii=False), encoding="utf-8")
+    converted = tmp_path / "agri_kb.jsonl"
+    assert wm.write_kb_jsonl(wm.iter_kb_records(wm.FALLBACK_KB), converted) == len(wm.KnowledgeStore.from_dict(wm.FALLBACK_KB))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["agri_kb.json", "agri_kb.jsonl"]
+
+    from_json, json_hash = wm.read_kb_file(nested)
+    from_jsonl, jsonl_hash = wm.read_kb_file(converted)
+    assert jsonl_hash == json_hash == wm.compute_kb_hash(wm.FALLBACK_KB)
+    assert list(from_jsonl.records()) == list(from_json.records()) == list(wm.iter_kb_records(wm.FALLBACK_KB))
+
+
+def test_blank_lines_are_skipped(tmp_path):
+    path = tmp_path / "kb.jsonl"
+    path.write_text('\n{"category": "crops", "item": "rice", "variants": {"en": "Rice."}}\n\n', encoding="utf-8")
+    assert list(wm.iter_kb_jsonl(path)) == [("crops", "rice", {"en": "Rice."})]
+
+
+@pytest.mark.parametrize("line, error", [
+    ("{not json", "kb.jsonl: line 2:"),
+    ('["crops", "rice"]', "kb.jsonl: line 2: expected an object"),
+    ('{"category": "crops", "item": "rice"}', 'kb.jsonl: line 2: expected "category", "item" and "variants"'),
+    ('{"category": "crops", "item": 7, "variants": {}}', 'kb.jsonl: line 2: expected "category", "item" and "variants"')
+])
+def test_bad_lines_are_reported_with_their_line_number(tmp_path, line, error):
+    path = tmp_path / "kb.jsonl"
+    path.write_text('{"category": "crops", "item": "wheat", "variants": {"en": "Wheat."}}\n' + line + "\n",
+                    encoding="utf-8")
+    with pytest.raises(ValueError, match="^" + error):
+        wm.read_kb_file(path)
+
+
+def test_duplicate_items_are_rejected(tmp_path):
+    record = '{"category": "crops", "item": "rice", "variants": {"en": "Rice."}}\n'
+    path = tmp_path / "kb.jsonl"
+    path.write_text(record * 2, encoding="utf-8")
+    with pytest.raises(ValueError, match="^kb.jsonl: duplicate item crops/rice"):
+        wm.read_kb_file(path)
+
+
+def test_jsonl_takes_precedence_over_the_nested_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(wm, "DATA_PATH", tmp_path / "agri_kb.json")
+    monkeypatch.setattr(wm, "KB_JSONL_PATH", tmp_path / "agri_kb.jsonl")
+    assert wm.kb_source_path() == wm.DATA_PATH
+    wm.write_kb_jsonl(wm.iter_kb_records({"crops": {"rice": {"en": "Rice."}}}), wm.KB_JSONL_PATH)
+    assert wm.kb_source_path() == wm.KB_JSONL_PATH
+    kb, _ = wm.load_kb()
+    assert list(kb.records()) == [("crops", "rice", {"en": "Rice."})]
@@ -0,0 +1,91 @@
+"""Hot reload swaps KB, index and gate vocabulary together, and survives bad edits."""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+NEW_ITEM = {"en": "Zorbleweed is a made-up test crop sown after the first rains."}
+
+
+@pytest.fixture
+def kb_file(tmp_path, monkeypatch):
+    """A KB file under tmp_path; the served KB, index and gate are restored afterwards"""
+    path = tmp_path / "agri_kb.json"
+    monkeypatch.setattr(wm, "DATA_PATH", path)
+    monkeypatch.setattr(wm, "KB_JSONL_PATH", path.with_suffix(".jsonl"))
+    for name in ("AGRICULTURE_KB", "KB_HASH", "kb_index"):
+        monkeypatch.setattr(wm, name, getattr(wm, name))
+    monkeypatch.setattr(wm.domain_gate, "vocabulary", wm.domain_gate.vocabulary)
+    monkeypatch.setattr(wm, "kb_reload_status", {"last_reload": None, "last_error": None, "reloads": 0})
+    wm.ensure_index()
+    return path
+
+
+def write_kb(path: Path, kb: dict):
+    path.write_text(json.dumps(kb, ensure_ascii=False), encoding="utf-8")
+
+
+def with_new_item() -> dict:
+    kb = json.loads(json.dumps(wm.FALLBACK_KB))
+    kb["crops"]["zorbleweed"] = NEW_ITEM
+    return kb
+
+
+def test_reload_swaps_kb_index_and_gate(kb_file):
+    write_kb(kb_file, with_new_item())
+    assert wm.reload_kb()
+    assert wm.kb_index['kb'] is wm.AGRICULTURE_KB
+    assert wm.is_agriculture_related("zorbleweed", "en")
+    assert wm.get_rag_context("zorbleweed", "en")[0]['item'] == "zorbleweed"
+    assert wm.kb_reload_status["reloads"] == 1
+
+
+def test_unindexable_kb_keeps_serving_the_current_one(kb_file):
+    kb, kb_hash, index = wm.AGRICULTURE_KB, wm.KB_HASH, wm.kb_index
+    # Parses fine, but every text is empty: TF-IDF has no vocabulary to fit
+    write_kb(kb_file, {"crops": {"zorbleweed": {"en": ""}}})
+    assert not wm.reload_kb()
+    assert "empty vocabulary" in wm.kb_reload_status["last_error"]
+    assert (wm.AGRICULTURE_KB, wm.KB_HASH, wm.kb_index) == (kb, kb_hash, index)
+    assert not wm.is_agriculture_related("zorbleweed", "en")
+
+    # The next valid edit is picked up and clears the error
+    write_kb(kb_file, with_new_item())
+    assert wm.reload_kb()
+    assert wm.kb_reload_status["last_error"] is None
+    assert wm.is_agriculture_related("zorbleweed", "en")
+
+
+class StopWatching(BaseException):
+    pass
+
+
+def test_watcher_survives_a_failed_reload(monkeypatch):
+    signatures = iter([("kb", 1, 1), ("kb", 2, 2), ("kb", 3, 3)])
+    reloads = []
+
+    def signature():
+        try:
+            return next(signatures)
+        except StopIteration:
+            raise StopWatching from None
+
+    def reload():
+        reloads.append(len(reloads))
+        if len(reloads) == 1:
+            raise RuntimeError("disk on fire")
+        return True
+
+    monkeypatch.setattr(wm, "KB_WATCH_INTERVAL", 0)
+    monkeypatch.setattr(wm, "kb_file_signature", signature)
+    monkeypatch.setattr(wm, "reload_kb", reload)
+    monkeypatch.setattr(wm, "kb_reload_status", {"last_reload": None, "last_error": None, "reloads": 0})
+    with pytest.raises(StopWatching):
+        wm.watch_kb_file()
+    assert reloads == [0, 1]
+    assert wm.kb_reload_status["last_error"] == "disk on fire"
@@ -0,0 +1,47 @@
+"""The columnar KnowledgeStore must hold exactly the nested KB it was built from."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 32])
+def test_records_round_trip(block_size):
+    store = wm.KnowledgeStore.from_records(wm.iter_kb_records(wm.FALLBACK_KB), block_size)
+    assert list(store.records()) == list(wm.iter_kb_records(wm.FALLBACK_KB))
+    assert len(store) == sum(len(items) for items in wm.FALLBACK_KB.values())
+    assert store.categories == list(wm.FALLBACK_KB)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 32])
+def test_random_access_decodes_one_entry(block_size):
+    records = list(wm.iter_kb_records(wm.FALLBACK_KB))
+    store = wm.KnowledgeStore.from_records(records, block_size)
+    for entry in reversed(range(len(store))):
+        category, item, variants = records[entry]
+        assert (store.category(entry), store.item(entry)) == (category, item)
+        for lang in store.languages:
+            assert store.text(entry, lang) == variants.get(lang, "")
+    assert store.text(0, "fr") == ""
+
+
+def test_sparse_languages_and_empty_blocks():
+    # "hi" first appears on the fifth entry and skips the seventh
+    records = [("crops", f"item{i}", {"en": f"Text {i}", **({"hi": f"पाठ {i}"} if i >= 4 and i != 6 else {})})
+               for i in range(9)]
+    store = wm.KnowledgeStore.from_records(records, 2)
+    assert store.languages == ["en", "hi"]
+    assert [store.text(i, "hi") for i in range(9)] == ["", "", "", "", "पाठ 4", "पाठ 5", "", "पाठ 7", "पाठ 8"]
+    assert list(store.records()) == records
+    assert store.nbytes > 0
+
+
+def test_missing_variants_are_skipped_and_bad_ones_rejected():
+    store = wm.KnowledgeStore.from_dict({"crops": {"rice": {"en": "Rice.", "ta": None}}})
+    assert list(store.records()) == [("crops", "rice", {"en": "Rice."})]
+    with pytest.raises(ValueError, match="crops/rice/en: text must be a string"):
+        wm.KnowledgeStore.from_dict({"crops": {"rice": {"en": 42}}})
@@ -0,0 +1,28 @@
+"""language="auto" picks the language from the query's script."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+@pytest.mark.parametrize("query, language", [
+    ("When to plant rice?", "en"),
+    ("quand planter le riz", "en"),
+    ("dhan kab lagaye", "en"),
+    ("1234 ?!", "en"),
+    ("धान कब लगाएं", "hi"),
+    ("நெல் எப்போது நடவு", "ta"),
+    ("వరి ఎప్పుడు నాటాలి", "te"),
+    ("നെല്ല് എപ്പോൾ നടണം", "ml"),
+    ("rice ki kheti धान", "hi"),
+])
+def test_detect_language(query, language):
+    assert wm.detect_language(query) == language
+
+
+def test_explicit_language_is_kept():
+    assert wm.resolve_language("ta", "When to plant rice?") == "ta"
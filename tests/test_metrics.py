@@ -0,0 +1,91 @@
+"""Per-stage latency histograms and the Prometheus /metrics exposition."""
+import re
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+client = TestClient(wm.app)
+SAMPLE = re.compile(r'^(agri_\w+)(?:\{(.*)\})? (\S+)$')
+
+
+@pytest.fixture
+def histograms(monkeypatch):
+    histograms = wm.StageHistograms(wm.STAGE_BUCKETS)
+    monkeypatch.setattr(wm, "stage_histograms", histograms)
+    return histograms
+
+
+def samples(text):
+    """(name, labels, value) of every sample line; comments must be HELP/TYPE"""
+    parsed = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            assert line.startswith(("# HELP ", "# TYPE "))
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        parsed.append((name, dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or "")), float(value)))
+    return parsed
+
+
+def test_observations_from_many_threads_are_merged(histograms):
+    def record():
+        for seconds in (0.0001, 0.0002, 0.3, 20.0):
+            histograms.observe("score", "/query", "en", seconds)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts = histograms.merged()[("score", "/query", "en")]
+    # A value equal to a bound falls in that bucket (le is inclusive); 20s overflows to +Inf
+    assert counts[0] == counts[1] == 4
+    assert counts[wm.STAGE_BUCKETS.index(0.5)] == 4
+    assert counts[len(wm.STAGE_BUCKETS)] == 4
+    assert sum(counts[:-1]) == 16 and counts[-1] == pytest.approx(4 * 20.3003)
+
+
+def test_query_stages_are_exported(histograms):
+    body = client.post("/query", json={"query": "metrics for rice fertilizer", "stage_timings": True}).json()
+    assert {"crop_detection", "score", "compose"} <= set(body["stage_ms"])
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    parsed = samples(response.text)
+    stages = {labels["stage"] for name, labels, _ in parsed
+              if name == "agri_stage_duration_seconds_count" and labels["endpoint"] == "/query"}
+    assert {"crop_detection", "vectorize", "score", "content", "compose", "total"} <= stages
+
+    for stage in stages:
+        labels = {"stage": stage, "endpoint": "/query", "language": "en"}
+        buckets = [value for name, sample, value in parsed
+                   if name == "agri_stage_duration_seconds_bucket" and sample.items() > labels.items()]
+        assert buckets == sorted(buckets) and len(buckets) == len(wm.STAGE_BUCKETS) + 1
+        count = next(value for name, sample, value in parsed
+                     if name == "agri_stage_duration_seconds_count" and sample == labels)
+        assert buckets[-1] == count >= 1
+
+    names = {name for name, _, _ in parsed}
+    assert {"agri_query_cache_hits", "agri_retrieval_executor_completed", "agri_query_rate_limit_admitted"} <= names
+
+
+def test_language_labels_are_bounded():
+    assert wm.metric_language("ta") == "ta"
+    assert wm.metric_language('x"}\n') == "other"
+    assert wm.prometheus_label_value('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_metrics_can_be_turned_off(monkeypatch, histograms):
+    monkeypatch.setattr(wm, "METRICS_ENABLED", False)
+    wm.record_stage("score", "en", 0.1)
+    assert histograms.merged() == {}
+    assert client.get("/metrics").status_code == 404
@@ -0,0 +1,85 @@
+"""/query/stream event order, and the page's stream client reading it."""
+import json
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+client = TestClient(wm.app)
+
+
+def stream_events(body):
+    response = client.post("/query/stream", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == wm.STREAM_MEDIA_TYPE
+    return response.content, [json.loads(line) for line in response.content.splitlines()]
+
+
+def test_events_arrive_in_order():
+    body = {"query": "How much fertilizer for rice on clay soil?", "soil_type": "clay", "land_size": "small"}
+    _, events = stream_events(body)
+    types = [event["type"] for event in events]
+    assert types[:2] == ["status", "sources"] and types[-1] == "done"
+    assert set(types[2:-1]) == {"text"}
+    assert [event["kind"] for event in events[2:-1]][:3] == ["content", "soil", "land_size"]
+    assert events[1]["rag_sources"]
+
+    answer = "".join(event["text"] for event in events if event["type"] == "text")
+    assert client.post("/query", json=body).json()["answer"] == answer
+
+
+def test_cached_answer_replays_as_one_text_event():
+    body = {"query": "When should I sow wheat?"}
+    _, first = stream_events(body)
+    _, again = stream_events(body)
+    assert [event["type"] for event in again] == ["sources", "text", "done"]
+    assert again[1]["kind"] == "cached" and again[-1]["cached"] is True
+    assert again[1]["text"] == "".join(event["text"] for event in first if event["type"] == "text")
+
+
+def test_off_topic_query_streams_the_scope_reply():
+    _, events = stream_events({"query": "who won the football match yesterday"})
+    assert [event["type"] for event in events] == ["sources", "text", "done"]
+    assert events[1]["kind"] == "off_topic" and events[-1]["mode"] == "off_topic"
+
+
+def page_function(html, name):
+    """Source of a top-level function of the page script, as the browser receives it"""
+    match = re.search(rf"^( *)(?:async )?function {name}\(.*?^\1\}}$", html, re.S | re.M)
+    assert match, name
+    return match.group(0)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_page_client_reads_the_stream():
+    raw, events = stream_events({"query": "Tomato leaves have yellow spots, what to do?", "language": "ta"})
+    html = client.get("/").text
+    script = "\n".join([
+        page_function(html, "readQueryStream"),
+        page_function(html, "renderAnswer"),
+        # A reader handing out 5-byte chunks, splitting lines and multi-byte characters
+        f"const raw = Buffer.from({json.dumps(raw.decode('utf-8'))}, 'utf-8');",
+        "let offset = 0;",
+        "const response = { body: { getReader: () => ({ read: async () => offset >= raw.length",
+        "    ? { done: true } : { done: false, value: raw.subarray(offset, offset += 5) } }) } };",
+        "const updates = [];",
+        "readQueryStream(response, (data) => updates.push(renderAnswer(data))).then((data) =>",
+        "    console.log(JSON.stringify({ data, updates: updates.length, rendered: updates.pop() })));",
+    ])
+    result = subprocess.run(["node", "-e", script], capture_output=True, text=True, timeout=30, check=True)
+    output = json.loads(result.stdout)
+
+    data = output["data"]
+    assert data["answer"] == "".join(event["text"] for event in events if event["type"] == "text")
+    assert data["rag_sources"] == events[1]["rag_sources"]
+    assert data["done"] is True and data["mode"] == events[-1]["mode"]
+    assert output["updates"] == len(events)
+    assert data["answer"] in output["rendered"] and "\n\n" in output["rendered"]
@@ -0,0 +1,56 @@
+"""The vectorized top-k kernel against a row-by-row reference."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+QUERIES = ["When to plant rice?", "tomato pests and blight", "clay soil drainage", "wheat fertilizer dose"]
+
+
+@pytest.fixture(scope="module")
+def idx():
+    return wm.build_index(wm.KnowledgeStore.from_dict(wm.FALLBACK_KB), "tfidf")
+
+
+@pytest.mark.parametrize("top_k", [1, 3, 7, 50])
+def test_top_k_rows_matches_a_full_sort(top_k):
+    scores = np.random.default_rng(top_k).random((5, 7)).astype(np.float32)
+    expected = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    np.testing.assert_array_equal(wm.top_k_rows(scores, top_k), expected)
+
+
+def test_boost_rows_are_the_crop_and_soil_rows_of_the_language(idx):
+    mask = wm.language_rows(idx, "en")
+    (crop_rows, crop_boost), (soil_rows, soil_boost) = wm.boost_rows_for(idx, "Rice", "clay", mask)
+    keys = list(idx['keys'])
+    assert (crop_boost, soil_boost) == (wm.CROP_BOOST, wm.SOIL_BOOST)
+    assert len(crop_rows) and len(soil_rows)
+    assert set(crop_rows.tolist()) == {row for row, key in enumerate(keys) if key == ("crops", "rice") and mask[row]}
+    assert set(soil_rows.tolist()) == {row for row, key in enumerate(keys) if key == ("soil", "clay") and mask[row]}
+    assert wm.boost_rows_for(idx, "no such crop", "", mask) == []
+
+
+@pytest.mark.parametrize("language", ["en", "ta"])
+def test_rank_exhaustive_matches_row_by_row_scoring(idx, language):
+    mask = wm.language_rows(idx, language)
+    query_vectors = idx['vectorizer'].transform(QUERIES)
+    boosts = [wm.boost_rows_for(idx, crop, soil, mask)
+              for crop, soil in [("rice", ""), ("", ""), ("tomato", "clay"), ("wheat", "sandy")]]
+    ranked = wm.rank_exhaustive(idx, query_vectors, boosts, 5, mask)
+
+    for i, hits in enumerate(ranked):
+        boost = np.zeros(len(mask))
+        for rows, value in boosts[i]:
+            boost[rows] += value
+        reference = sorted(
+            (float(idx['vectors'][row].multiply(query_vectors[i]).sum()) + boost[row]
+             for row in np.flatnonzero(mask)),
+            reverse=True
+        )[:5]
+        assert all(mask[row] for row, _ in hits)
+        assert [score for _, score in hits] == pytest.approx(reference, abs=1e-6)
@@ -0,0 +1,96 @@
+"""Per-client admission control: who a client is and what a call costs."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+
+def scope(peer, *forwarded_for):
+    headers = [(b"x-forwarded-for", value.encode("latin-1")) for value in forwarded_for]
+    return {"type": "http", "client": (peer, 50000), "headers": headers}
+
+
+@pytest.mark.parametrize("spoofed", ["1.1.1.1", "2.2.2.2, 3.3.3.3", "garbage", "10.0.0.9"])
+def test_forged_forwarded_for_entries_share_the_real_clients_bucket(spoofed):
+    # The platform proxy (10.0.0.2) appends the address it saw to whatever the client sent
+    assert wm.rate_limit_client(scope("10.0.0.2", f"{spoofed}, 203.0.113.7")) == ("ip:203.0.113.7", 1.0)
+
+
+def test_chained_trusted_proxies_are_skipped():
+    assert wm.rate_limit_client(scope("10.0.0.2", "203.0.113.7, 10.1.2.3", "192.168.1.1"))[0] == "ip:203.0.113.7"
+
+
+def test_forwarded_for_from_untrusted_peer_is_ignored():
+    assert wm.rate_limit_client(scope("198.51.100.4", "203.0.113.7"))[0] == "ip:198.51.100.4"
+
+
+def test_trusted_peer_without_forwarded_for():
+    assert wm.rate_limit_client(scope("127.0.0.1"))[0] == "ip:127.0.0.1"
+
+
+@pytest.fixture
+def batch_client(monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(wm, "RATE_LIMIT_ENABLED", True)
+    buckets = wm.TokenBuckets("query", 2, 30, 100, 600)
+    monkeypatch.setattr(wm, "query_buckets", buckets)
+    monkeypatch.setitem(wm.RATE_LIMITED_PATHS, "/query/batch", buckets)
+    return TestClient(wm.app)
+
+
+def test_large_batch_is_rejected_before_retrieval(batch_client, monkeypatch):
+    monkeypatch.setattr(wm, "retrieve_batch", lambda request: pytest.fail("retrieval ran"))
+    response = batch_client.post("/query/batch", json={"queries": ["rice fertilizer"] * 512})
+    assert response.status_code == 429
+    assert "split" in response.json()["detail"]
+    assert int(response.headers["retry-after"]) >= 1
+
+
+def test_batches_are_charged_per_query(batch_client):
+    assert batch_client.post("/query/batch", json={"queries": ["rice fertilizer"] * 20}).status_code == 200
+    response = batch_client.post("/query/batch", json={"queries": ["wheat sowing"] * 20})
+    assert response.status_code == 429
+    assert response.json()["detail"] == "Too many requests, retry shortly"
+    # Base token and remaining queries of the first batch, base token of the second
+    assert wm.query_buckets.stats()["admitted"] == 3
+    assert wm.query_buckets.stats()["rejected"] == 1
+
+
+def test_over_budget_batch_is_rejected_before_parsing(batch_client):
+    assert batch_client.post("/query/batch", json={"queries": ["rice fertilizer"] * 30}).status_code == 200
+    response = batch_client.post("/query/batch", content=b"{" * 100000, headers={"content-type": "application/json"})
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many requests, retry shortly"}
+
+
+def test_api_key_batches_cost_less(batch_client, monkeypatch):
+    monkeypatch.setattr(wm, "RATE_LIMIT_API_KEYS", ["gateway-key"])
+    headers = {"X-API-Key": "gateway-key"}
+    assert batch_client.post("/query/batch", json={"queries": ["rice"] * 300}, headers=headers).status_code == 200
+    assert batch_client.post("/query/batch", json={"queries": ["rice"] * 301}, headers=headers).status_code == 429
+
+
+def test_idle_buckets_are_dropped_once_refilled():
+    buckets = wm.TokenBuckets("test", 1, 10, 100, 5)
+    buckets.acquire("a", 10, now=0)
+    buckets.acquire("b", now=9)
+    assert buckets.stats()["clients"] == 2
+    buckets.acquire("b", now=10)
+    assert buckets.stats() | {"clients": 1, "evicted": 1} == buckets.stats()
+
+
+def test_full_table_sheds_new_clients_until_a_bucket_refills():
+    buckets = wm.TokenBuckets("test", 1, 10, 2, 600)
+    buckets.acquire("a", 10, now=0)
+    buckets.acquire("b", 10, now=1)
+    # "a" has 4 of its 10 tokens back: evicting it would hand it a fresh burst
+    assert buckets.acquire("c", now=4) == pytest.approx(6)
+    assert buckets.stats()["shed"] == 1
+    assert buckets.acquire("a", 10, now=4) == pytest.approx(6)
+    # Touching "a" made "b" the least recently used; it refills at t=11
+    assert buckets.acquire("c", now=11) == 0
+    assert buckets.stats() | {"clients": 2, "evicted": 1} == buckets.stats()
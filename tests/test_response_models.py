@@ -0,0 +1,55 @@
+"""Responses are built through the documented models; check what actually goes on the wire."""
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+client = TestClient(wm.app)
+
+
+def assert_shape(model, body):
+    """body validates against model and has no field the model leaves out"""
+    assert model.model_validate(body).model_dump(exclude_unset=True) == body
+
+
+@pytest.mark.parametrize("extra", [{}, {"stage_timings": True}, {"soil_type": "clay", "land_size": "small"}])
+@pytest.mark.parametrize("compact, model", [(False, wm.QueryResponse), (True, wm.CompactQueryResponse)])
+def test_query_response(compact, model, extra):
+    body = client.post("/query", json={"query": "When to plant rice?", "compact": compact, **extra}).json()
+    assert body["rag_sources"]
+    assert_shape(model, body)
+
+
+@pytest.mark.parametrize("compact, model", [(False, wm.QueryResponse), (True, wm.CompactQueryResponse)])
+def test_off_topic_response(compact, model):
+    body = client.get("/query", params={"query": "what is the capital of france", "compact": compact}).json()
+    assert body["mode"] == "off_topic"
+    assert_shape(model, body)
+
+
+@pytest.mark.parametrize("compact, model", [(False, wm.QueryResponse), (True, wm.CompactQueryResponse)])
+def test_error_fallback_response(monkeypatch, compact, model):
+    def fail(request, season):
+        raise RuntimeError("retrieval failed")
+    monkeypatch.setattr(wm, "answer_query", fail)
+    body = client.post("/query", json={"query": f"wheat fertilizer schedule {compact}", "compact": compact}).json()
+    assert body["error"] == "handled_gracefully"
+    assert_shape(model, body)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_batch_response(compact):
+    queries = ["When to plant rice?", "tomato pests", "drip irrigation cost"]
+    body = client.post("/query/batch", json={"queries": queries, "compact": compact, "stage_timings": True}).json()
+    assert body["count"] == len(queries)
+    assert_shape(wm.BatchQueryResponse, body)
+
+
+def test_openapi_documents_response_models():
+    schemas = client.get("/openapi.json").json()["components"]["schemas"]
+    assert {"QueryResponse", "CompactQueryResponse", "BatchQueryResponse"} <= set(schemas)
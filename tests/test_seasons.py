@@ -0,0 +1,37 @@
+"""Kharif/Rabi season resolution and the season advice it selects."""
+import datetime
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+CONTEXT = [{"content": "Rice is a staple grain crop.", "category": "crops", "item": "rice", "similarity": 0.9}]
+
+
+@pytest.mark.parametrize("month, season", [
+    (1, "rabi"), (4, "rabi"), (5, ""), (6, "kharif"), (10, "kharif"), (11, "rabi"), (12, "rabi")
+])
+def test_current_season_wraps_around_the_new_year(month, season):
+    assert wm.current_season(datetime.datetime(2026, month, 15)) == season
+
+
+@pytest.mark.parametrize("now, boundary", [
+    (datetime.datetime(2026, 2, 10), datetime.datetime(2026, 5, 1)),
+    (datetime.datetime(2026, 5, 31, 23), datetime.datetime(2026, 6, 1)),
+    (datetime.datetime(2026, 10, 1), datetime.datetime(2026, 11, 1)),
+    (datetime.datetime(2026, 12, 31), datetime.datetime(2027, 5, 1))
+])
+def test_next_season_boundary(now, boundary):
+    assert wm.next_season_boundary(now) == boundary.timestamp()
+
+
+@pytest.mark.parametrize("language", wm.ANSWER_LANGUAGES)
+def test_each_season_appends_its_advice(language):
+    for season in ("kharif", "rabi"):
+        answer = wm.compose_answer("rice", language, CONTEXT, "", "", season)
+        assert answer.endswith(wm.SEASON_ADVICE[season][language])
+    assert wm.compose_answer("rice", language, CONTEXT, "", "", "") == CONTEXT[0]["content"]
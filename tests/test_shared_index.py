@@ -0,0 +1,61 @@
+"""One index over every language: each query only sees its language's rows."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import whisper_main as wm  # noqa: E402
+
+KB = {
+    "crops": {
+        "rice": {"en": "Rice grows in flooded paddy fields.", "ta": "நெல் வெள்ளம் நிறைந்த வயல்களில் வளரும்."},
+        "wheat": {"en": "Wheat is sown in winter.", "ta": "கோதுமை குளிர்காலத்தில் விதைக்கப்படுகிறது."},
+        "millet": {"en": "Millet tolerates drought and poor soil."}
+    },
+    "soil": {
+        "clay": {"en": "Clay soil holds water and needs drainage.", "hi": "चिकनी मिट्टी पानी रोकती है।"}
+    }
+}
+
+
+@pytest.fixture(scope="module")
+def idx():
+    return wm.build_index(wm.KnowledgeStore.from_dict(KB), "tfidf")
+
+
+def visible(idx, language):
+    mask = wm.language_rows(idx, language)
+    return {(idx['keys'][row], idx['languages'][code])
+            for row, code in enumerate(idx['row_langs'].tolist()) if mask[row]}
+
+
+def test_one_row_per_language_variant(idx):
+    assert len(idx['keys']) == 7
+    assert sorted(idx['languages']) == ["en", "hi", "ta"]
+    assert idx['vectors'].shape[0] == len(idx['keys'])
+
+
+def test_language_sees_its_rows_plus_english_for_missing_items(idx):
+    assert visible(idx, "ta") == {
+        (("crops", "rice"), "ta"), (("crops", "wheat"), "ta"),
+        (("crops", "millet"), "en"), (("soil", "clay"), "en")
+    }
+    assert visible(idx, "en") == {(key, "en") for key in [("crops", "rice"), ("crops", "wheat"),
+                                                           ("crops", "millet"), ("soil", "clay")]}
+
+
+def test_languages_without_rows_use_the_english_rows(idx):
+    np.testing.assert_array_equal(wm.language_rows(idx, "te"), wm.language_rows(idx, "en"))
+
+
+def test_queries_never_get_other_languages_rows(idx):
+    mask = wm.language_rows(idx, "ta")
+    queries = ["rice paddy", "நெல் வயல்", "चिकनी मिट्टी", "drought"]
+    ranked = wm.rank_exhaustive(idx, idx['vectorizer'].transform(queries), [[] for _ in queries], 4, mask)
+    for hits in ranked:
+        assert hits and all(mask[row] for row, _ in hits)
+    assert idx['keys'][ranked[1][0][0]] == ("crops", "rice")
+    assert idx['keys'][ranked[3][0][0]] == ("crops", "millet")
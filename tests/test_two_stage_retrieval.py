@@ -0,0 +1,92 @@
+"""Two-stage retrieval must rank like exhaustive scoring."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import whisper_main as wm  # noqa: E402
+from kb_generator import synthetic_kb  # noqa: E402
+
+CATEGORIES = ("crops", "soil", "pests", "irrigation", "fertilizer")
+QUERIES = ["rice fertilizer", "tomato pest control", "clay soil drainage", "drip irrigation schedule",
+           "நெல் சாகுபடி", "धान की खेती"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    kb = wm.KnowledgeStore.from_dict(synthetic_kb(1000, categories=CATEGORIES, novel_words=2))
+    built = {}
+
+    def get(mode):
+        if mode not in built:
+            built[mode] = wm.build_index(kb, mode)
+        return built[mode]
+    return get
+
+
+def kept(hits):
+    """The hits retrieval keeps (rows sharing no n-gram score 0 and tie arbitrarily)"""
+    return [(row, score) for row, score in hits if score > 0]
+
+
+def inputs(idx, language, crop=None):
+    mask = wm.language_rows(idx, language)
+    crop = crop or next(iter(idx['crop_rows']))
+    boosts = [wm.boost_rows_for(idx, crop if i % 2 else "", "", mask) for i in range(len(QUERIES))]
+    return idx['vectorizer'].transform(QUERIES), boosts, mask
+
+
+@pytest.mark.parametrize("mode", ["tfidf", "hashing"])
+@pytest.mark.parametrize("language", ["en", "ta"])
+def test_full_budget_matches_exhaustive(index, mode, language):
+    idx = index(mode)
+    query_vectors, boosts, mask = inputs(idx, language)
+    exact = wm.rank_exhaustive(idx, query_vectors, boosts, 5, mask)
+    ranked = wm.rank_candidates(idx, query_vectors, boosts, 5, int(np.count_nonzero(mask)), mask)
+    for got, want in zip(ranked, exact):
+        assert kept(got) == pytest.approx(kept(want))
+
+
+@pytest.mark.parametrize("language", ["en", "ta", "hi"])
+def test_default_budget_matches_exhaustive(index, language):
+    idx = index("tfidf")
+    query_vectors, boosts, mask = inputs(idx, language)
+    assert wm.RAG_CANDIDATE_BUDGET < np.count_nonzero(mask)
+    exact = wm.rank_exhaustive(idx, query_vectors, boosts, 3, mask)
+    ranked = wm.rank_candidates(idx, query_vectors, boosts, 3, wm.RAG_CANDIDATE_BUDGET, mask)
+    for got, want in zip(ranked, exact):
+        assert kept(got) == pytest.approx(kept(want))
+
+
+def test_crop_rows_compete_under_any_budget(index):
+    """Crop-forced inclusion: boosted rows rank as in exhaustive scoring even with a budget of 1"""
+    idx = index("tfidf")
+    crop = next(iter(idx['crop_rows']))
+    query_vectors, boosts, mask = inputs(idx, "en", crop)
+    crop_rows = set(idx['crop_rows'][crop].tolist())
+    exact = wm.rank_exhaustive(idx, query_vectors, boosts, 10, mask)
+    ranked = wm.rank_candidates(idx, query_vectors, boosts, 10, 1, mask)
+    compared = 0
+    for got, want in zip(ranked, exact):
+        got = dict(got)
+        for row, score in want:
+            if row in crop_rows:
+                assert got[row] == pytest.approx(score)
+                compared += 1
+    assert compared
+
+
+def test_crop_does_not_restrict_candidates(index):
+    """A strong match outside the detected crop still outranks weak crop rows"""
+    idx = index("tfidf")
+    crop = next(iter(idx['crop_rows']))
+    query_vectors, boosts, mask = inputs(idx, "en", crop)
+    crop_rows = set(idx['crop_rows'][crop].tolist())
+    ranked = wm.rank_candidates(idx, query_vectors, boosts, 3, wm.RAG_CANDIDATE_BUDGET, mask)
+    assert any(row not in crop_rows for hits, query_boosts in zip(ranked, boosts) if query_boosts
+               for row, _ in hits)
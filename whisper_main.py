@@ -1,24 +1,51 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import logging
 import time
 import json
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import base64
-import tempfile
+import datetime
+import hashlib
+import hmac
+import io
+import ipaddress
+import math
 import os
 import re
+import struct
+import threading
+import unicodedata
+import zlib
+import heapq
+import asyncio
+import contextvars
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from operator import itemgetter
 
 # Import lightweight TTS and utilities
 from gtts import gTTS
 import platform
-from langdetect import detect
 
 # Import minimal ML dependencies
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix, diags, vstack
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+# Optional: faster JSON encoding for compact responses and streamed events (stdlib json otherwise)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -222,261 +249,2379 @@ FALLBACK_KB = {
             "te": "బ్లైట్ ఆకులు మరియు కాండాలపై ముదురు మచ్చలను కలిగిస్తుంది. ఫంగల్ ఇన్ఫెక్షన్ వల్ల కలుగుతుంది. ప్రభావిత భాగాలను వెంటనే తొలగించండి.",
             "ml": "ബ്ലൈറ്റ് ഇലകളിലും തണ്ടുകളിലും ഇരുണ്ട പാടുകൾ ഉണ്ടാക്കുന്നു. ഫംഗൽ അണുബാധ മൂലമാണ് ഇത് സംഭവിക്കുന്നത്. ബാധിത ഭാഗങ്ങൾ ഉടനെ നീക്കം ചെയ്യുക."
         }
-    }
+    }
+}
+
+# In memory the KB is a columnar KnowledgeStore: text is kept per language as
+# zlib-compressed blocks of KB_STORE_BLOCK entries and decoded on demand.
+KB_STORE_BLOCK = int(os.environ.get("KB_STORE_BLOCK", 32))
+KB_STORE_LEVEL = int(os.environ.get("KB_STORE_LEVEL", 6))
+
+class StringTable:
+    """Read-only list of strings stored as one UTF-8 blob plus an offsets array"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @staticmethod
+    def encode(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+class PackedStrings:
+    """Read-only list of strings stored as zlib-compressed blocks of consecutive UTF-8 values
+
+    Only the block holding a requested value is inflated, so a lookup costs one
+    small decompression instead of keeping every value as a Python string.
+    """
+
+    def __init__(self, blob, block_offsets: np.ndarray, offsets: np.ndarray, block_size: int):
+        self.blob = blob
+        self.block_offsets = block_offsets
+        self.offsets = offsets
+        self.block_size = block_size
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _block(self, block: int) -> bytes:
+        lo, hi = self.block_offsets[block], self.block_offsets[block + 1]
+        return zlib.decompress(self.blob[lo:hi]) if hi > lo else b""
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if start == end:
+            return ""
+        block = i // self.block_size
+        base = self.offsets[block * self.block_size]
+        return self._block(block)[start - base:end - base].decode("utf-8")
+
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        for block in range(len(self.block_offsets) - 1):
+            raw = self._block(block)
+            first = block * self.block_size
+            base = offsets[first]
+            for i in range(first, min(first + self.block_size, len(self))):
+                yield raw[offsets[i] - base:offsets[i + 1] - base].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.blob) + self.block_offsets.nbytes + self.offsets.nbytes
+
+class PackedStringsBuilder:
+    def __init__(self, block_size: int, count: int = 0):
+        self.block_size = block_size
+        self.blob = bytearray()
+        self.block_offsets = array("q", [0])
+        self.offsets = array("q", [0])
+        self.pending = bytearray()
+        for _ in range(count):
+            self.add(b"")
+
+    def add(self, value: bytes):
+        self.pending += value
+        self.offsets.append(self.offsets[-1] + len(value))
+        if (len(self.offsets) - 1) % self.block_size == 0:
+            self._flush()
+
+    def _flush(self):
+        # Blocks with no text take no space: equal block offsets decode to b""
+        if self.pending:
+            self.blob += zlib.compress(bytes(self.pending), KB_STORE_LEVEL)
+        self.block_offsets.append(len(self.blob))
+        self.pending = bytearray()
+
+    def build(self) -> PackedStrings:
+        if (len(self.offsets) - 1) % self.block_size:
+            self._flush()
+        return PackedStrings(
+            self.blob,
+            np.frombuffer(self.block_offsets, dtype=np.int64),
+            np.frombuffer(self.offsets, dtype=np.int64),
+            self.block_size
+        )
+
+def iter_kb_records(kb: Dict[str, Dict]) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """(category, item, variants) records of a nested KB dict"""
+    for category, items in kb.items():
+        for item, variants in items.items():
+            yield category, item, variants
+
+class KnowledgeStore:
+    """Read-only columnar KB replacing the nested category/item/language dicts
+
+    Entries keep an interned category id and their item name; each language is one
+    PackedStrings column aligned with the entries (missing variants are empty), and
+    text is decoded only for the entries that are actually returned.
+    """
+
+    def __init__(self, categories: List[str], entry_categories: np.ndarray, items: StringTable,
+                 texts: Dict[str, PackedStrings]):
+        self.categories = categories
+        self.entry_categories = entry_categories
+        self.items = items
+        self.texts = texts
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, str, Dict[str, str]]],
+                     block_size: Optional[int] = None) -> "KnowledgeStore":
+        block_size = block_size or KB_STORE_BLOCK
+        category_ids: Dict[str, int] = {}
+        entry_categories = array("I")
+        items = bytearray()
+        item_offsets = array("q", [0])
+        columns: Dict[str, PackedStringsBuilder] = {}
+        seen = set()
+
+        for category, item, variants in records:
+            key = f"{category}\x1f{item}"
+            if key in seen:
+                raise ValueError(f"duplicate item {category}/{item}")
+            seen.add(key)
+            entry = len(entry_categories)
+            entry_categories.append(category_ids.setdefault(category, len(category_ids)))
+            items += item.encode("utf-8")
+            item_offsets.append(len(items))
+
+            for lang, text in variants.items():
+                if text is None:
+                    continue
+                if not isinstance(text, str):
+                    raise ValueError(f"{category}/{item}/{lang}: text must be a string")
+                if lang not in columns:
+                    columns[lang] = PackedStringsBuilder(block_size, count=entry)
+            for lang, column in columns.items():
+                column.add((variants.get(lang) or "").encode("utf-8"))
+
+        return cls(
+            list(category_ids),
+            np.frombuffer(entry_categories, dtype=np.uint32),
+            StringTable(np.frombuffer(items, dtype=np.uint8), np.frombuffer(item_offsets, dtype=np.int64)),
+            {lang: column.build() for lang, column in columns.items()}
+        )
+
+    @classmethod
+    def from_dict(cls, kb: Dict[str, Dict]) -> "KnowledgeStore":
+        return cls.from_records(iter_kb_records(kb))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def languages(self) -> List[str]:
+        return list(self.texts)
+
+    def category(self, entry: int) -> str:
+        return self.categories[self.entry_categories[entry]]
+
+    def item(self, entry: int) -> str:
+        return self.items[entry]
+
+    def text(self, entry: int, lang: str) -> str:
+        column = self.texts.get(lang)
+        return column[entry] if column is not None else ""
+
+    def records(self) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+        """Every entry in order, decoding each compressed block once"""
+        columns = {lang: iter(column) for lang, column in self.texts.items()}
+        for entry in range(len(self)):
+            variants = {}
+            for lang, column in columns.items():
+                text = next(column)
+                if text:
+                    variants[lang] = text
+            yield self.category(entry), self.item(entry), variants
+
+    @property
+    def nbytes(self) -> int:
+        return (self.entry_categories.nbytes + self.items.blob.nbytes + self.items.offsets.nbytes
+                + sum(column.nbytes for column in self.texts.values()))
+
+# Load Knowledge Base (external file if present; fallback to built-in).
+# data/agri_kb.jsonl (one item per line, read as a stream) takes precedence over
+# the nested data/agri_kb.json; convert with --convert-kb.
+DATA_PATH = Path(__file__).parent / "data" / "agri_kb.json"
+KB_JSONL_PATH = DATA_PATH.with_suffix(".jsonl")
+
+class KbHasher:
+    """Incremental KB content hash: one canonical line per item, in KB order"""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def update(self, category: str, item: str, variants: Dict[str, str]):
+        record = json.dumps([category, item, variants], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        self._hash.update(record.encode("utf-8"))
+        self._hash.update(b"\n")
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def compute_kb_hash(kb: Dict[str, Dict]) -> str:
+    """Stable content hash of a nested KB, used to key persisted index artifacts"""
+    hasher = KbHasher()
+    for record in iter_kb_records(kb):
+        hasher.update(*record)
+    return hasher.hexdigest()
+
+def iter_kb_jsonl(path: Path) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """Stream (category, item, variants) records from a JSONL KB, one line at a time"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"line {line_no}: {e}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"line {line_no}: expected an object")
+            category, item, variants = record.get("category"), record.get("item"), record.get("variants")
+            if not isinstance(category, str) or not isinstance(item, str) or not isinstance(variants, dict):
+                raise ValueError(f"line {line_no}: expected \"category\", \"item\" and \"variants\"")
+            yield category, item, variants
+
+def read_nested_kb(path: Path) -> Dict[str, Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        kb = json.load(f)
+    if not isinstance(kb, dict) or not all(isinstance(items, dict) for items in kb.values()):
+        raise ValueError("KB must map categories to items")
+    return kb
+
+def read_kb_file(path: Path) -> Tuple[KnowledgeStore, str]:
+    """Load a KB file into a KnowledgeStore and return it with its content hash"""
+    if path.suffix == ".jsonl":
+        # Streaming: only one line is parsed at a time and the hash is built as we go
+        records = iter_kb_jsonl(path)
+    else:
+        records = iter_kb_records(read_nested_kb(path))
+
+    hasher = KbHasher()
+
+    def hashed(records):
+        for record in records:
+            hasher.update(*record)
+            yield record
+
+    try:
+        store = KnowledgeStore.from_records(hashed(records))
+    except ValueError as e:
+        raise ValueError(f"{path.name}: {e}") from None
+    return store, hasher.hexdigest()
+
+def kb_source_path() -> Path:
+    return KB_JSONL_PATH if KB_JSONL_PATH.exists() else DATA_PATH
+
+def load_kb() -> Tuple[KnowledgeStore, str]:
+    path = kb_source_path()
+    if path.exists():
+        try:
+            kb, kb_hash = read_kb_file(path)
+            logger.info(f"📚 Loaded external KB: {path}")
+            return kb, kb_hash
+        except Exception as e:
+            logger.warning(f"Could not load external KB ({e}), using built-in fallback.")
+    return KnowledgeStore.from_dict(FALLBACK_KB), compute_kb_hash(FALLBACK_KB)
+
+def write_kb_jsonl(records: Iterable[Tuple[str, str, Dict[str, str]]], path: Path) -> int:
+    """Write KB records as JSONL (atomically), returning the number of items"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    count = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for category, item, variants in records:
+                record = {"category": category, "item": item, "variants": variants}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return count
+
+AGRICULTURE_KB, KB_HASH = load_kb()
+
+# Multilingual, character n-gram based RAG index with crop/soil boosting.
+# One index covers every language variant of every KB item; each row carries a
+# language tag and queries are scored against their language's rows only.
+# The index is never mutated after publication: a KB reload builds a new one and
+# swaps it in, and the index keeps a reference to the KB it was built from.
+kb_index: Optional[Dict] = None
+_index_lock = threading.Lock()
+
+# The prebuilt index lives next to the KB file as one flat binary file. Workers
+# memory-map it read-only so every uvicorn worker shares the same pages through
+# the OS page cache. KB_INDEX_DIR moves it elsewhere (e.g. a writable volume).
+INDEX_DIR = Path(os.environ.get("KB_INDEX_DIR", DATA_PATH.parent / "agri_kb.index"))
+INDEX_PATH = INDEX_DIR / "kb.idx"
+INDEX_FORMAT_VERSION = 3
+INDEX_MAGIC = b"AGRIIDX\x00"
+INDEX_ALIGNMENT = 64
+VECTORIZER_PARAMS = {
+    'analyzer': 'char_wb',
+    'ngram_range': (3, 5),
+    'min_df': 1,
+    'max_features': 5000,
+    'dtype': np.float32
+}
+
+# Index modes: 'tfidf' fits one vocabulary of up to max_features n-grams per KB
+# language (default); 'hashing' uses a
+# stateless hashed char n-gram space plus a document-frequency array, so it needs
+# no vocabulary dict, builds in chunks and can append entries without a refit;
+# 'lsa' projects each language's TF-IDF rows onto its own RAG_LSA_DIMS TruncatedSVD
+# components and scores dense float32 embeddings instead of sparse rows.
+RAG_INDEX_MODE = os.environ.get("RAG_INDEX_MODE", "tfidf")
+HASHING_N_FEATURES = int(os.environ.get("RAG_HASHING_FEATURES", 2 ** 18))
+HASHING_CHUNK_SIZE = int(os.environ.get("RAG_HASHING_CHUNK", 10000))
+LSA_DIMENSIONS = int(os.environ.get("RAG_LSA_DIMS", 128))
+
+def collect_lang_corpus(lang: str, kb: Optional[KnowledgeStore] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    kb = AGRICULTURE_KB if kb is None else kb
+    texts: List[str] = []
+    keys: List[Tuple[str, str]] = []
+
+    for category, item, langs in kb.records():
+        content = (langs.get(lang) or langs.get('en') or '').strip()
+        if content:
+            texts.append(content)
+            keys.append((category, item))
+
+    if not texts:
+        # fallback to English entries if none for the language
+        for category, item, langs in kb.records():
+            content = (langs.get('en') or '').strip()
+            if content:
+                texts.append(content)
+                keys.append((category, item))
+
+    return texts, keys
+
+def collect_corpus(kb: Optional[KnowledgeStore] = None) -> Tuple[List[str], List[Tuple[str, str]], List[str], List[int]]:
+    """One row per non-empty language variant of every KB item, grouped by category and item
+
+    The last list holds each row's KnowledgeStore entry id.
+    """
+    kb = AGRICULTURE_KB if kb is None else kb
+    texts: List[str] = []
+    keys: List[Tuple[str, str]] = []
+    langs: List[str] = []
+    entries: List[int] = []
+
+    for entry, (category, item, variants) in enumerate(kb.records()):
+        for lang, text in variants.items():
+            content = text.strip()
+            if content:
+                texts.append(content)
+                keys.append((category, item))
+                langs.append(lang)
+                entries.append(entry)
+
+    return texts, keys, langs, entries
+
+def compute_corpus_hash(texts: List[str], keys: List[Tuple[str, str]], langs: List[str]) -> str:
+    """Hash of the indexed corpus, used to reuse an unaffected index on reload"""
+    h = hashlib.sha256()
+    for (category, item), lang, text in zip(keys, langs, texts):
+        h.update(f"{category}\x1f{item}\x1f{lang}\x1f{text}\x1e".encode("utf-8"))
+    return h.hexdigest()
+
+def encode_row_languages(entries: List[int], langs: List[str]) -> Dict:
+    """Per-row language codes and KnowledgeStore entry ids, the inputs of language_rows()"""
+    languages = sorted(set(langs) | {'en'})
+    codes = {lang: i for i, lang in enumerate(languages)}
+    return {
+        'languages': languages,
+        'row_langs': np.fromiter((codes[lang] for lang in langs), dtype=np.uint16, count=len(langs)),
+        'item_ids': np.asarray(entries, dtype=np.int32)
+    }
+
+# Score boosts for the user's selected crop/soil, applied to matching KB rows
+CROP_BOOST = 0.25
+SOIL_BOOST = 0.15
+
+# Two-stage retrieval: once a language has more rows than the candidate budget,
+# candidates come from the posting lists of the query's rarest (highest-idf)
+# n-grams, walked until about RAG_CANDIDATE_POOL x budget postings are seen, and
+# only the best-scoring candidates get the exact TF-IDF rerank.
+# Crop-forced inclusion: the rows of the user's crop/soil (the crop named in the
+# query, else the profile's) are added to the candidates on top of the budget.
+# They do not restrict the candidates, because the boost only shifts scores:
+# a strong match outside the crop can still win, as it does in exhaustive scoring.
+# A budget of 0 disables candidate generation.
+RAG_CANDIDATE_BUDGET = int(os.environ.get("RAG_CANDIDATE_BUDGET", 300))
+RAG_CANDIDATE_TERMS = int(os.environ.get("RAG_CANDIDATE_TERMS", 24))
+RAG_CANDIDATE_POOL = int(os.environ.get("RAG_CANDIDATE_POOL", 4))
+
+# Sharded scoring: indexes with at least RAG_SHARD_MIN_ROWS rows are split into
+# RAG_SHARDS contiguous row ranges along category boundaries (default: one per core,
+# up to 4), scored concurrently on a shared pool of RAG_POOL_SIZE threads (numpy and
+# scipy release the GIL in their kernels) and the per-shard top hits merged. Both
+# paths are sharded: exhaustive scoring runs one product per shard, and two-stage
+# retrieval walks each shard's slice of the posting lists and reranks that shard's
+# own candidates. RAG_SHARDS=1 disables sharding.
+RAG_SHARDS = int(os.environ.get("RAG_SHARDS", min(4, os.cpu_count() or 1)))
+RAG_SHARD_MIN_ROWS = int(os.environ.get("RAG_SHARD_MIN_ROWS", 20000))
+RAG_POOL_SIZE = int(os.environ.get("RAG_POOL_SIZE", min(8, os.cpu_count() or 1)))
+
+def build_boost_rows(keys: List[Tuple[str, str]], category: str) -> Dict[str, np.ndarray]:
+    """Map each lowercased item of a category to the index rows it occupies"""
+    rows: Dict[str, List[int]] = {}
+    for i, (cat, item) in enumerate(keys):
+        if cat == category:
+            rows.setdefault(item.lower(), []).append(i)
+    return {item: np.array(positions, dtype=np.intp) for item, positions in rows.items()}
+
+def build_shard_ranges(keys: List[Tuple[str, str]], n_shards: int) -> List[Tuple[int, int]]:
+    """Contiguous (start, end) row ranges: one per category, then merged or split to n_shards"""
+    n_rows = len(keys)
+    if n_shards <= 1 or n_rows == 0:
+        return [(0, n_rows)]
+
+    bounds = [0]
+    previous = None
+    for i, (category, _) in enumerate(keys):
+        if i and category != previous:
+            bounds.append(i)
+        previous = category
+    bounds.append(n_rows)
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+
+    # Too many categories: merge the smallest adjacent pair
+    while len(ranges) > n_shards:
+        i = min(range(len(ranges) - 1), key=lambda j: ranges[j + 1][1] - ranges[j][0])
+        ranges[i:i + 2] = [(ranges[i][0], ranges[i + 1][1])]
+    # Too few: halve the largest shard
+    while len(ranges) < n_shards:
+        i = max(range(len(ranges)), key=lambda j: ranges[j][1] - ranges[j][0])
+        start, end = ranges[i]
+        if end - start < 2:
+            break
+        middle = (start + end) // 2
+        ranges[i:i + 1] = [(start, middle), (middle, end)]
+    return ranges
+
+def make_index_entry(vect, mat, keys, rows: Dict, kb: KnowledgeStore, corpus_hash: str, postings=None, **extra) -> Dict:
+    """rows holds the per-row language tags from encode_row_languages()"""
+    return {
+        'mode': 'tfidf',
+        'vectorizer': vect,
+        'vectors': mat,
+        'keys': keys,
+        'kb': kb,
+        'corpus_hash': corpus_hash,
+        'idf': vect.idf_,
+        'postings': postings,
+        'crop_rows': build_boost_rows(keys, 'crops'),
+        'soil_rows': build_boost_rows(keys, 'soil'),
+        'shards': build_shard_ranges(keys, RAG_SHARDS if len(keys) >= RAG_SHARD_MIN_ROWS else 1),
+        **rows,
+        'lang_masks': {},
+        **extra
+    }
+
+def get_postings(idx: Dict):
+    """Column-major copy of the matrix: column j lists the rows containing n-gram j"""
+    postings = idx.get('postings')
+    if postings is None:
+        postings = idx['vectors'].tocsc()
+        idx['postings'] = postings
+    return postings
+
+class HashedTfidfVectorizer:
+    """Char n-gram TF-IDF over a hashed feature space: no vocabulary, incremental df"""
+
+    def __init__(self, n_features: int = HASHING_N_FEATURES, df: Optional[np.ndarray] = None, n_docs: int = 0):
+        self.hasher = HashingVectorizer(
+            analyzer=VECTORIZER_PARAMS['analyzer'],
+            ngram_range=VECTORIZER_PARAMS['ngram_range'],
+            n_features=n_features,
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32
+        )
+        self.n_features = n_features
+        self.df = np.zeros(n_features, dtype=np.int64) if df is None else df
+        self.n_docs = n_docs
+        self.idf_ = self._idf()
+
+    def _idf(self) -> np.ndarray:
+        # Smoothed idf, computed the same way TfidfVectorizer does
+        return (np.log((1 + self.n_docs) / (1 + self.df)) + 1).astype(np.float32)
+
+    def count(self, texts: List[str]):
+        return self.hasher.transform(texts)
+
+    def add_documents(self, counts):
+        self.df = self.df + np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+        self.idf_ = self._idf()
+
+    def weight(self, counts):
+        """Apply idf and L2-normalize raw counts; also returns the pre-normalization row norms"""
+        weighted = counts @ diags(self.idf_)
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel()).astype(np.float32)
+        return normalize(weighted), norms
+
+    def transform(self, texts: List[str]):
+        return self.weight(self.count(texts))[0]
+
+def tfidf_vectorizer(n_languages: int) -> TfidfVectorizer:
+    # Scripts rarely share n-grams, so each language gets its own max_features budget
+    return TfidfVectorizer(**dict(VECTORIZER_PARAMS, max_features=VECTORIZER_PARAMS['max_features'] * max(1, n_languages)))
+
+class LsaVectorizer:
+    """TF-IDF followed by per-language SVD projections to L2-normalized dense embeddings
+
+    Each language's components only span the vocabulary columns its rows use, so
+    the components grow with the vocabulary rather than with languages x vocabulary.
+    """
+
+    def __init__(self, tfidf: TfidfVectorizer, columns: List[np.ndarray], projections: List[np.ndarray]):
+        self.tfidf = tfidf
+        self.columns = columns
+        # (columns x dims) per language: the transposed SVD components, kept C-contiguous
+        self.projections = projections
+        self.idf_ = tfidf.idf_
+
+    def project(self, tfidf_rows, code: int) -> np.ndarray:
+        projected = tfidf_rows[:, self.columns[code]] @ self.projections[code]
+        return normalize(np.asarray(projected, dtype=np.float32))
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """(queries, languages, dims) projections, one per language's components"""
+        tfidf_rows = self.tfidf.transform(texts)
+        return np.stack([self.project(tfidf_rows, code) for code in range(len(self.columns))], axis=1)
+
+def build_lsa_index(texts: List[str], keys, rows: Dict, kb: KnowledgeStore, corpus_hash: str) -> Dict:
+    tfidf = tfidf_vectorizer(len(rows['languages']))
+    mat = tfidf.fit_transform(texts)
+    row_langs = rows['row_langs']
+
+    columns, factors = [], []
+    for code in range(len(rows['languages'])):
+        sub = mat[row_langs == code]
+        cols = np.unique(sub.indices).astype(np.int32)
+        sub = sub[:, cols]
+        # TruncatedSVD needs fewer components than rows and features
+        dims = min(LSA_DIMENSIONS, sub.shape[0] - 1, sub.shape[1] - 1)
+        if dims >= 1:
+            svd = TruncatedSVD(n_components=dims, algorithm='randomized', random_state=0)
+            factors.append(svd.fit(sub).components_.astype(np.float32))
+        else:
+            # A language with a single row (or none) just keeps that row as its component
+            factors.append(normalize(sub.toarray()).astype(np.float32))
+        columns.append(cols)
+
+    # Pad every language to the same width so the embeddings are one contiguous array
+    width = max([f.shape[0] for f in factors] + [1])
+    projections = [
+        np.ascontiguousarray(np.vstack([f, np.zeros((width - f.shape[0], f.shape[1]), dtype=np.float32)]).T)
+        for f in factors
+    ]
+    vect = LsaVectorizer(tfidf, columns, projections)
+    embeddings = np.zeros((mat.shape[0], width), dtype=np.float32)
+    for code in range(len(columns)):
+        lang_rows = np.flatnonzero(row_langs == code)
+        embeddings[lang_rows] = vect.project(mat[lang_rows], code)
+    return make_index_entry(vect, embeddings, keys, rows, kb, corpus_hash, mode='lsa')
+
+def build_hashed_index(texts: List[str], keys, rows: Dict, kb: KnowledgeStore, corpus_hash: str) -> Dict:
+    vect = HashedTfidfVectorizer()
+    chunks = []
+    for start in range(0, len(texts), HASHING_CHUNK_SIZE):
+        counts = vect.count(texts[start:start + HASHING_CHUNK_SIZE])
+        vect.add_documents(counts)
+        chunks.append(counts)
+    counts = vstack(chunks).tocsr() if chunks else csr_matrix((0, vect.n_features), dtype=np.float32)
+    mat, norms = vect.weight(counts)
+    return make_index_entry(vect, mat, keys, rows, kb, corpus_hash, mode='hashing', row_norms=norms)
+
+def row_language_list(idx: Dict) -> List[str]:
+    languages = idx['languages']
+    return [languages[code] for code in idx['row_langs'].tolist()]
+
+def append_to_index(idx: Dict, keys: List[Tuple[str, str]], rows: Dict, new_texts: List[str],
+                    kb: KnowledgeStore, corpus_hash: str) -> Dict:
+    """Hashing mode: add rows without re-tokenizing the existing ones"""
+    old = idx['vectorizer']
+    vect = HashedTfidfVectorizer(old.n_features, old.df.copy(), old.n_docs)
+    counts = vect.count(new_texts)
+    vect.add_documents(counts)
+
+    # Existing rows are stored normalized; their norms recover tf*idf, which is then
+    # rescaled column-wise from the old idf to the new one
+    rescaled = diags(idx['row_norms']) @ idx['vectors'] @ diags(vect.idf_ / old.idf_)
+    weighted = vstack([rescaled, counts @ diags(vect.idf_)]).tocsr()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel()).astype(np.float32)
+    return make_index_entry(vect, normalize(weighted), keys, rows, kb, corpus_hash, mode='hashing', row_norms=norms)
+
+def reuse_or_extend_index(idx: Dict, texts: List[str], keys: List[Tuple[str, str]], langs: List[str],
+                          entries: List[int], kb: KnowledgeStore) -> Optional[Dict]:
+    """Reuse an index whose rows are unchanged in the new corpus, appending new rows in hashing mode"""
+    positions = {(key, lang): i for i, (key, lang) in enumerate(zip(keys, langs))}
+    old_keys = list(idx['keys'])
+    old_langs = row_language_list(idx)
+    old_rows = list(zip(old_keys, old_langs))
+    if any(row not in positions for row in old_rows):
+        return None
+    old_texts = [texts[positions[row]] for row in old_rows]
+    if compute_corpus_hash(old_texts, old_keys, old_langs) != idx['corpus_hash']:
+        return None
+
+    known = set(old_rows)
+    extra = [i for i, row in enumerate(zip(keys, langs)) if row not in known]
+    if extra and idx['mode'] != 'hashing':
+        return None
+    # Entry ids follow the new store, so existing rows are renumbered
+    order = [positions[row] for row in old_rows] + extra
+    new_keys = [keys[i] for i in order]
+    new_langs = [langs[i] for i in order]
+    rows = encode_row_languages([entries[i] for i in order], new_langs)
+    if not extra:
+        return dict(idx, kb=kb, lang_masks={}, **rows)
+    extra_texts = [texts[i] for i in extra]
+    corpus_hash = compute_corpus_hash(old_texts + extra_texts, new_keys, new_langs)
+    logger.info(f"➕ Appending {len(extra)} entries to hashed RAG index")
+    return append_to_index(idx, new_keys, rows, extra_texts, kb, corpus_hash)
+
+def build_index(kb: Optional[KnowledgeStore] = None, mode: Optional[str] = None) -> Dict:
+    """Fit one index over every language variant of every KB item"""
+    kb = AGRICULTURE_KB if kb is None else kb
+    mode = mode or RAG_INDEX_MODE
+    texts, keys, langs, entries = collect_corpus(kb)
+    corpus_hash = compute_corpus_hash(texts, keys, langs)
+    rows = encode_row_languages(entries, langs)
+
+    if mode == 'hashing':
+        idx = build_hashed_index(texts, keys, rows, kb, corpus_hash)
+    elif mode == 'lsa':
+        idx = build_lsa_index(texts, keys, rows, kb, corpus_hash)
+    else:
+        vect = tfidf_vectorizer(len(rows['languages']))
+        mat = vect.fit_transform(texts)
+        idx = make_index_entry(vect, mat, keys, rows, kb, corpus_hash)
+
+    logger.info(f"✅ RAG index ({mode}) built with {len(texts)} entries in {len(rows['languages'])} languages")
+    return idx
+
+def language_rows(idx: Dict, lang: str) -> np.ndarray:
+    """Boolean row filter for a language: its own rows plus the English rows of items it lacks"""
+    languages = idx['languages']
+    # Languages absent from the KB all share the English-only filter
+    key = lang if lang in languages else 'en'
+    mask = idx['lang_masks'].get(key)
+    if mask is None:
+        row_langs, item_ids = idx['row_langs'], idx['item_ids']
+        mask = row_langs == languages.index('en')
+        if key != 'en':
+            own = row_langs == languages.index(key)
+            covered = np.zeros(int(item_ids.max()) + 1 if len(item_ids) else 0, dtype=bool)
+            covered[item_ids[own]] = True
+            mask = own | (mask & ~covered[item_ids])
+        idx['lang_masks'][key] = mask
+    return mask
+
+class KeyTable:
+    """(category, item) per index row, decoded lazily from shared string tables"""
+
+    def __init__(self, categories: StringTable, items: StringTable):
+        self.categories = categories
+        self.items = items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, i: int) -> Tuple[str, str]:
+        return self.categories[i], self.items[i]
+
+    def __iter__(self):
+        return zip(self.categories, self.items)
+
+def _aligned(offset: int) -> int:
+    return -(-offset // INDEX_ALIGNMENT) * INDEX_ALIGNMENT
+
+def write_flat_arrays(path: Path, header: Dict, arrays: Dict[str, np.ndarray]):
+    """Write a JSON header plus 64-byte aligned raw arrays into one file"""
+    specs = {}
+    offset = 0
+    for name, arr in arrays.items():
+        offset = _aligned(offset)
+        specs[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+    header_bytes = json.dumps(dict(header, arrays=specs)).encode("utf-8")
+    data_start = _aligned(len(INDEX_MAGIC) + 16 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack("<QQ", len(header_bytes), data_start))
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + specs[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+
+def read_flat_arrays(path: Path) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Memory-map a file written by write_flat_arrays; arrays are read-only views"""
+    with open(path, "rb") as f:
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError("not a RAG index file")
+        header_len, data_start = struct.unpack("<QQ", f.read(16))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, spec in header.pop("arrays").items():
+        dtype = np.dtype(spec["dtype"])
+        start = data_start + spec["offset"]
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = buf[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return header, arrays
+
+def save_index(idx: Dict, kb_hash: Optional[str] = None, path: Optional[Path] = None) -> bool:
+    """Persist the index (CSR/CSC arrays, idf, vocabulary, keys, row languages) as a flat binary file"""
+    kb_hash = KB_HASH if kb_hash is None else kb_hash
+    path = INDEX_PATH if path is None else path
+    vect = idx['vectorizer']
+    keys = list(idx['keys'])
+    if idx['mode'] == 'lsa':
+        mat = idx['vectors']
+        matrix_arrays = {"embeddings": mat}
+    else:
+        mat = idx['vectors'].tocsr()
+        postings = get_postings(idx)
+        matrix_arrays = {
+            "data": mat.data.astype(np.float32, copy=False),
+            "indices": mat.indices,
+            "indptr": mat.indptr,
+            "csc_data": postings.data.astype(np.float32, copy=False),
+            "csc_indices": postings.indices,
+            "csc_indptr": postings.indptr
+        }
+    mode_header = {}
+    if idx['mode'] == 'hashing':
+        mode_header = {"n_docs": vect.n_docs, "n_features": vect.n_features}
+        mode_arrays = {"df": vect.df, "row_norms": idx['row_norms']}
+    else:
+        tfidf = vect.tfidf if idx['mode'] == 'lsa' else vect
+        terms_blob, terms_offsets = StringTable.encode(tfidf.get_feature_names_out().tolist())
+        mode_arrays = {"idf": np.asarray(tfidf.idf_), "terms_blob": terms_blob, "terms_offsets": terms_offsets}
+        if idx['mode'] == 'lsa':
+            mode_arrays["lsa_columns"] = np.concatenate(vect.columns)
+            mode_arrays["lsa_column_offsets"] = np.cumsum([0] + [len(c) for c in vect.columns], dtype=np.int64)
+            mode_arrays["lsa_projections"] = np.concatenate([p.ravel() for p in vect.projections])
+    categories_blob, categories_offsets = StringTable.encode([cat for cat, _ in keys])
+    items_blob, items_offsets = StringTable.encode([item for _, item in keys])
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_flat_arrays(
+            tmp_path,
+            {
+                "version": INDEX_FORMAT_VERSION,
+                "mode": idx['mode'],
+                "kb_hash": kb_hash,
+                "corpus_hash": idx['corpus_hash'],
+                "languages": idx['languages'],
+                "shape": list(mat.shape),
+                **mode_header
+            },
+            {
+                **matrix_arrays,
+                **mode_arrays,
+                "categories_blob": categories_blob,
+                "categories_offsets": categories_offsets,
+                "items_blob": items_blob,
+                "items_offsets": items_offsets,
+                "row_langs": idx['row_langs'],
+                "item_ids": idx['item_ids']
+            }
+        )
+        # Atomic rename: readers (and workers that already mapped the old file) never see a partial artifact
+        os.replace(tmp_path, path)
+        logger.info(f"💾 RAG index saved to {path}")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not persist RAG index ({e})")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        return False
+
+def load_index(kb: Optional[KnowledgeStore] = None, kb_hash: Optional[str] = None,
+               path: Optional[Path] = None) -> Optional[Dict]:
+    """Memory-map the prebuilt index if it matches the KB hash"""
+    kb = AGRICULTURE_KB if kb is None else kb
+    kb_hash = KB_HASH if kb_hash is None else kb_hash
+    path = INDEX_PATH if path is None else path
+    if not path.exists():
+        return None
+    try:
+        header, arrays = read_flat_arrays(path)
+        if (header.get("version") != INDEX_FORMAT_VERSION or header.get("kb_hash") != kb_hash
+                or header.get("mode") != RAG_INDEX_MODE):
+            logger.info(f"♻️ Stale RAG index at {path}, rebuilding")
+            return None
+
+        shape = tuple(header["shape"])
+        if header["mode"] == 'lsa':
+            mat, postings = arrays["embeddings"], None
+        else:
+            mat = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False)
+            postings = csc_matrix((arrays["csc_data"], arrays["csc_indices"], arrays["csc_indptr"]), shape=shape, copy=False)
+        keys = KeyTable(
+            StringTable(arrays["categories_blob"], arrays["categories_offsets"]),
+            StringTable(arrays["items_blob"], arrays["items_offsets"])
+        )
+        rows = {
+            "languages": header["languages"],
+            "row_langs": arrays["row_langs"],
+            "item_ids": arrays["item_ids"]
+        }
+        extra = {}
+        if header["mode"] == 'hashing':
+            vect = HashedTfidfVectorizer(header["n_features"], arrays["df"], header["n_docs"])
+            extra = {"mode": 'hashing', "row_norms": arrays["row_norms"]}
+        else:
+            terms = StringTable(arrays["terms_blob"], arrays["terms_offsets"])
+            vect = TfidfVectorizer(**VECTORIZER_PARAMS)
+            vect.vocabulary_ = {term: i for i, term in enumerate(terms)}
+            vect.idf_ = arrays["idf"]
+            if header["mode"] == 'lsa':
+                # Projections are stored as one flat array of per-language (columns x dims) blocks
+                offsets, width = arrays["lsa_column_offsets"], shape[1]
+                columns = [arrays["lsa_columns"][lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+                projections = [arrays["lsa_projections"][lo * width:hi * width].reshape(hi - lo, width)
+                               for lo, hi in zip(offsets[:-1], offsets[1:])]
+                vect = LsaVectorizer(vect, columns, projections)
+                extra = {"mode": 'lsa'}
+
+        logger.info(f"📦 RAG index ({header['mode']}) mapped with {len(keys)} entries "
+                    f"in {len(rows['languages'])} languages")
+        return make_index_entry(vect, mat, keys, rows, kb, header["corpus_hash"], postings, **extra)
+    except Exception as e:
+        logger.warning(f"Could not load RAG index ({e}), rebuilding")
+        return None
+
+def persist_and_map(idx: Dict, kb: KnowledgeStore, kb_hash: str) -> Dict:
+    """Save a freshly built index and switch to the shared memory-mapped copy"""
+    if save_index(idx, kb_hash):
+        return load_index(kb, kb_hash) or idx
+    return idx
+
+def prebuild_index() -> bool:
+    """Build and persist the index for the current KB"""
+    return save_index(build_index())
+
+def ensure_index() -> Dict:
+    global kb_index
+    idx = kb_index
+    if idx is None:
+        # Serialize the first build so concurrent requests don't fit the index twice
+        with _index_lock:
+            idx = kb_index
+            if idx is None:
+                kb, kb_hash = AGRICULTURE_KB, KB_HASH
+                idx = load_index(kb, kb_hash)
+                if idx is None:
+                    idx = persist_and_map(build_index(kb), kb, kb_hash)
+                kb_index = idx
+    return idx
+
+kb_index = load_index()
+
+# Hot reload: the KB file is polled every KB_WATCH_INTERVAL seconds (0 disables)
+# and can be reloaded on demand via POST /admin/reload-kb (requires ADMIN_TOKEN).
+KB_WATCH_INTERVAL = float(os.environ.get("KB_WATCH_INTERVAL", 5))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+_reload_lock = threading.Lock()
+kb_reload_status: Dict[str, object] = {
+    "last_reload": None,
+    "last_error": None,
+    "reloads": 0
+}
+
+def kb_file_signature() -> Optional[Tuple[str, int, int]]:
+    try:
+        path = kb_source_path()
+        stat = path.stat()
+    except OSError:
+        return None
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+def reload_kb() -> bool:
+    """Rebuild indexes for a changed KB off the request path, then swap them in atomically"""
+    global AGRICULTURE_KB, KB_HASH, kb_index
+
+    if not _reload_lock.acquire(blocking=False):
+        logger.info("♻️ KB reload already in progress")
+        return False
+    try:
+        started = time.time()
+        try:
+            new_kb, new_hash = read_kb_file(kb_source_path())
+        except Exception as e:
+            # Keep serving the current KB; a half-written file is picked up on the next change
+            kb_reload_status["last_error"] = str(e)
+            logger.warning(f"Could not reload KB ({e}), keeping current KB")
+            return False
+
+        if new_hash == KB_HASH:
+            kb_reload_status["last_error"] = None
+            return False
+
+        # Everything the new KB needs is built before the swap; if any of it fails (e.g. a KB
+        # whose texts are all empty has no vocabulary to fit) the current KB keeps serving
+        try:
+            old_index = kb_index
+            new_index = load_index(new_kb, new_hash)
+            action = "mapped"
+            if new_index is None:
+                # An unaffected corpus keeps its fitted index; hashed indexes also absorb new entries
+                texts, keys, langs, entries = collect_corpus(new_kb)
+                new_index = None
+                if old_index is not None:
+                    new_index = reuse_or_extend_index(old_index, texts, keys, langs, entries, new_kb)
+                action = "reused"
+                if new_index is None:
+                    new_index = build_index(new_kb)
+                    action = "rebuilt"
+                new_index = persist_and_map(new_index, new_kb, new_hash)
+            vocabulary = domain_gate.compile_vocabulary(new_kb)
+        except Exception as e:
+            kb_reload_status["last_error"] = f"index build failed: {e}"
+            logger.error(f"❌ Could not index reloaded KB ({e}), keeping current KB")
+            return False
+
+        # The gate admits exactly the vocabulary of the KB that answers
+        with _index_lock:
+            AGRICULTURE_KB, KB_HASH, kb_index = new_kb, new_hash, new_index
+            domain_gate.vocabulary = vocabulary
+        query_cache.clear()
+
+        kb_reload_status.update(
+            last_reload=time.time(),
+            last_error=None,
+            reloads=kb_reload_status["reloads"] + 1
+        )
+        logger.info(
+            f"♻️ KB reloaded (hash {new_hash[:12]}) in {(time.time() - started) * 1000:.0f}ms, "
+            f"index: {action}"
+        )
+        return True
+    finally:
+        _reload_lock.release()
+
+def start_kb_reload() -> bool:
+    if _reload_lock.locked():
+        return False
+    threading.Thread(target=reload_kb, name="kb-reload", daemon=True).start()
+    return True
+
+def watch_kb_file():
+    last_signature = kb_file_signature()
+    while True:
+        time.sleep(KB_WATCH_INTERVAL)
+        signature = kb_file_signature()
+        if signature is not None and signature != last_signature:
+            last_signature = signature
+            # One bad edit must not end hot reload: the next change is tried again
+            try:
+                reload_kb()
+            except Exception as e:
+                kb_reload_status["last_error"] = str(e)
+                logger.error(f"❌ KB reload failed ({e})")
+
+CROP_SYNONYMS = {
+    'en': {
+        # Cereals
+        'rice': 'rice', 'paddy': 'rice', 'wheat': 'wheat', 'corn': 'corn', 'maize': 'corn',
+        'barley': 'barley', 'oats': 'oats', 'millet': 'millet', 'quinoa': 'quinoa',
+        # Legumes
+        'soybeans': 'soybeans', 'soy': 'soybeans', 'chickpeas': 'chickpeas', 'lentils': 'lentils',
+        'beans': 'beans', 'peas': 'peas', 'groundnut': 'groundnut', 'peanut': 'groundnut',
+        # Vegetables
+        'tomato': 'tomatoes', 'tomatoes': 'tomatoes', 'potato': 'potatoes', 'potatoes': 'potatoes',
+        'onion': 'onions', 'onions': 'onions', 'carrot': 'carrots', 'carrots': 'carrots',
+        'cabbage': 'cabbage', 'lettuce': 'lettuce', 'spinach': 'spinach', 'broccoli': 'broccoli',
+        # Fruits
+        'apple': 'apples', 'apples': 'apples', 'orange': 'oranges', 'oranges': 'oranges',
+        'banana': 'bananas', 'bananas': 'bananas', 'grape': 'grapes', 'grapes': 'grapes',
+        'mango': 'mango', 'papaya': 'papaya', 'pineapple': 'pineapple',
+        # Cash crops
+        'cotton': 'cotton', 'sugarcane': 'sugarcane', 'coffee': 'coffee', 'tea': 'tea',
+        'tobacco': 'tobacco', 'rubber': 'rubber'
+    },
+    'ta': {
+        # Tamil crop names
+        'அரிசி': 'rice', 'நெல்': 'rice', 'கோதுமை': 'wheat', 'சோளம்': 'corn',
+        'கேழ்வரகு': 'millet', 'பார்லி': 'barley', 'வெண்ணையடுங்': 'barley',
+        'சோயாபீன்': 'soybeans', 'கொண்டைக்கடலை': 'chickpeas', 'பருப்பு': 'lentils',
+        'தக்காளி': 'tomatoes', 'உருளைக்கிழங்கு': 'potatoes', 'வெங்காயம்': 'onions',
+        'கேரட்': 'carrots', 'முட்டைக்கோஸ்': 'cabbage', 'கீரை': 'spinach',
+        'ஆப்பிள்': 'apples', 'ஆரஞ்சு': 'oranges', 'வாழைப்பழம்': 'bananas',
+        'திராட்சை': 'grapes', 'மாம்பழம்': 'mango', 'பப்பாளி': 'papaya',
+        'பருத்தி': 'cotton', 'கரும்பு': 'sugarcane', 'காபி': 'coffee', 'தேயிலை': 'tea'
+    },
+    'te': {
+        # Telugu crop names
+        'వరి': 'rice', 'బియ్యం': 'rice', 'గోధుమ': 'wheat', 'మొక్కజొన్న': 'corn',
+        'జొన్న': 'millet', 'బార్లీ': 'barley', 'వోట్స్': 'oats',
+        'సోయాబీన్స్': 'soybeans', 'శనగలు': 'chickpeas', 'మసూర్': 'lentils',
+        'టమోటా': 'tomatoes', 'బంగాళాదుంప': 'potatoes', 'ఉల్లిపాయలు': 'onions',
+        'క్యారెట్': 'carrots', 'కాబేజీ': 'cabbage', 'పాలకూర': 'spinach',
+        'ఆపిల్స్': 'apples', 'నారింజలు': 'oranges', 'అరటిపండ్లు': 'bananas',
+        'ద్రాక్షలు': 'grapes', 'మామిడిపండు': 'mango', 'బొప్పాయి': 'papaya',
+        'పత్తి': 'cotton', 'చెరకు': 'sugarcane', 'కాఫీ': 'coffee', 'తేనీరు': 'tea'
+    },
+    'ml': {
+        # Malayalam crop names
+        'അരി': 'rice', 'നെൽ': 'rice', 'ഗോതമ്പ്': 'wheat', 'ചോളം': 'corn',
+        'കേഴ്വരകു': 'millet', 'ബാർലി': 'barley', 'ഓട്സ്': 'oats',
+        'സോയാബീൻ': 'soybeans', 'ചെറുപയർ': 'chickpeas', 'പയർ': 'lentils',
+        'തക്കാളി': 'tomatoes', 'ഉരുളക്കിഴങ്ങ്': 'potatoes', 'ഉള്ളി': 'onions',
+        'കാരറ്റ്': 'carrots', 'കാബേജ്': 'cabbage', 'ചീര': 'spinach',
+        'ആപ്പിൾ': 'apples', 'ഓറഞ്ച്': 'oranges', 'വാഴപ്പഴം': 'bananas',
+        'മുന്തിരി': 'grapes', 'മാമ്പഴം': 'mango', 'പപ്പായ': 'papaya',
+        'പരുത്തി': 'cotton', 'കരിമ്പ്': 'sugarcane', 'കാപ്പി': 'coffee', 'ചായ': 'tea'
+    },
+    'hi': {
+        # Hindi crop names
+        'चावल': 'rice', 'धान': 'rice', 'गेहूं': 'wheat', 'मक्का': 'corn',
+        'बाजरा': 'millet', 'जौ': 'barley', 'जई': 'oats',
+        'सोयाबीन': 'soybeans', 'चना': 'chickpeas', 'मसूर': 'lentils',
+        'टमाटर': 'tomatoes', 'आलू': 'potatoes', 'प्याज': 'onions',
+        'गाजर': 'carrots', 'पत्तागोभी': 'cabbage', 'पालक': 'spinach',
+        'सेब': 'apples', 'संतरा': 'oranges', 'केला': 'bananas',
+        'अंगूर': 'grapes', 'आम': 'mango', 'पपीता': 'papaya',
+        'कपास': 'cotton', 'गन्ना': 'sugarcane', 'कॉफी': 'coffee', 'चाय': 'tea'
+    }
+}
+
+def _trie_pattern(node: Dict[str, Dict]) -> str:
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # A term ending here is the fallback when no longer one continues
+    return '(?:' + body + ')?' if '' in node else body
+
+def _term_trie(terms: Iterable[str]) -> Dict[str, Dict]:
+    trie: Dict[str, Dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term.casefold():
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    return trie
+
+# Word-bounded matching (compile_terms(words=True)): a term must start a word, and
+# terms shorter than MIN_WORD_PREFIX must also end one, so 'tea' or 'ph' match
+# "tea" and "soil ph" but not "steam" or "phone". Only Latin letters and digits
+# count as word characters: Indic vowel signs are not \w to the re module, so \b
+# would split words inside, and Indic terms keep matching anywhere.
+MIN_WORD_PREFIX = 4
+WORD_START = r'(?<![0-9a-z])'
+WORD_END = r'(?![0-9a-z])'
+
+def compile_terms(terms: Iterable[str], words: bool = False) -> "re.Pattern":
+    """Regex matching any of the terms in casefold()ed text, longest first at each position
+
+    Terms sharing a prefix share a trie branch and every optional suffix is greedy,
+    so one scan finds the leftmost mention and the longest term starting there.
+    Matching casefolded text instead of using re.IGNORECASE keeps the regex
+    engine's first-character prefilter, which skips most non-matching positions.
+    With words=True terms only match as word prefixes (whole words when short).
+    """
+    if not words:
+        return re.compile(_trie_pattern(_term_trie(terms)))
+    folded = {term.casefold() for term in terms if term}
+    branches = []
+    prefixes = [term for term in folded if len(term) >= MIN_WORD_PREFIX]
+    if prefixes:
+        branches.append(_trie_pattern(_term_trie(prefixes)))
+    whole = [term for term in folded if len(term) < MIN_WORD_PREFIX]
+    if whole:
+        branches.append('(?:' + _trie_pattern(_term_trie(whole)) + ')' + WORD_END)
+    if not branches:
+        return re.compile('(?!)')
+    return re.compile(WORD_START + '(?:' + '|'.join(branches) + ')')
+
+class CropMatcher:
+    """One language's crop synonyms compiled into a single regex (see compile_terms)"""
+
+    def __init__(self, synonyms: Dict[str, str]):
+        self.crops = {synonym.casefold(): crop for synonym, crop in synonyms.items()}
+        self.pattern = compile_terms(self.crops)
+
+    def first(self, text: str) -> str:
+        match = self.pattern.search(text.casefold())
+        return self.crops[match.group()] if match else ""
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping (start, end, crop) mentions in text, case-insensitive"""
+        folded = text.casefold()
+        if len(folded) == len(text):
+            return [(m.start(), m.end(), self.crops[m.group()]) for m in self.pattern.finditer(folded)]
+        # Casefolding expanded some characters: map positions back to the original text
+        sources = [i for i, ch in enumerate(text) for _ in ch.casefold()]
+        return [(sources[m.start()], sources[m.end() - 1] + 1, self.crops[m.group()])
+                for m in self.pattern.finditer(folded)]
+
+CROP_MATCHERS = {language: CropMatcher(synonyms) for language, synonyms in CROP_SYNONYMS.items()}
+
+def find_crop_mentions(query: str, language: str) -> List[Tuple[int, int, str]]:
+    """(start, end, crop) of every crop mentioned in the query, in order"""
+    return CROP_MATCHERS.get(language, CROP_MATCHERS['en']).find(query)
+
+def detect_explicit_crop(query: str, language: str) -> str:
+    """Detect crop mentions in multiple languages"""
+    return CROP_MATCHERS.get(language, CROP_MATCHERS['en']).first(query)
+
+AGRICULTURE_KEYWORDS = {
+    'en': [
+        'crop', 'farming', 'agriculture', 'plant', 'soil', 'fertilizer', 'pest', 'disease',
+        'irrigation', 'harvest', 'seed', 'growth', 'cultivation', 'farm', 'field',
+        'pesticide', 'herbicide', 'organic', 'yield', 'planting', 'sowing', 'tractor',
+        'compost', 'manure', 'greenhouse', 'nursery', 'pruning', 'grafting', 'weather',
+        'climate', 'rain', 'drought', 'water', 'nitrogen', 'phosphorus', 'potassium',
+        'ph', 'acidity', 'alkaline', 'mulch', 'weeds', 'insects', 'fungus', 'bacteria',
+        'rice', 'wheat', 'corn', 'barley', 'oats', 'tomato', 'potato', 'onion', 'carrot',
+        'apple', 'orange', 'banana', 'grape', 'cotton', 'sugarcane', 'coffee', 'tea',
+        'beans', 'peas', 'lentil', 'soybean', 'cabbage', 'lettuce', 'spinach', 'mango',
+        'nutrient'
+    ],
+    'ta': [
+        'பயிர்', 'விவசாயம்', 'வேளாண்மை', 'தாவரம்', 'மண்', 'உரம்', 'பூச்சி', 'நோய்',
+        'நீர்ப்பாசனம்', 'அறுவடை', 'விதை', 'வளர்ச்சி', 'சாகுபடி', 'வயல்', 'அரிசி', 'நெல்',
+        'கோதுமை', 'தக்காளி', 'உருளைக்கிழங்கு', 'வெங்காயம்', 'கேரட்', 'ஆப்பிள்', 'பருத்தி',
+        'பூச்சிக்கொல்லி', 'களைக்கொல்லி', 'கரிம', 'விளைச்சல்', 'நடவு', 'கரும்பு', 'காபி'
+    ],
+    'te': [
+        'పంట', 'వ్యవసాయం', 'వేషధారణ', 'మొక్క', 'మట్టి', 'ఎరువులు', 'కీటకాలు', 'వ్యాధి',
+        'నీటిపారుదల', 'కోత', 'విత్తనం', 'పెరుగుదల', 'సాగు', 'పొలం', 'వరి', 'గోధుమ',
+        'టమోటా', 'బంగాళాదుంప', 'ఉల్లిపాయలు', 'క్యారెట్', 'ఆపిల్స్', 'పత్తి', 'చెరకు'
+    ],
+    'ml': [
+        'വിള', 'കൃഷി', 'കാർഷികം', 'ചെടി', 'മണ്ണ്', 'വളം', 'കീടം', 'രോഗം',
+        'ജലസേചനം', 'വിളവെടുപ്പ്', 'വിത്ത്', 'വളർച്ച', 'കൃഷി', 'വയൽ', 'അരി', 'ഗോതമ്പ്',
+        'തക്കാളി', 'ഉരുളക്കിഴങ്ങ്', 'ഉള്ളി', 'കാരറ്റ്', 'ആപ്പിൾ', 'പരുത്തി', 'കരിമ്പ്'
+    ],
+    'hi': [
+        'फसल', 'खेती', 'कृषि', 'पौधा', 'मिट्टी', 'खाद', 'कीट', 'बीमारी',
+        'सिंचाई', 'कटाई', 'बीज', 'वृद्धि', 'खेती', 'खेत', 'चावल', 'गेहूं',
+        'टमाटर', 'आलू', 'प्याज', 'गाजर', 'सेब', 'कपास', 'गन्ना'
+    ]
+}
+
+AGRI_PHRASES = {
+    'en': ['grow', 'plant', 'farm', 'soil', 'water', 'sun', 'season', 'harvest', 'food production', 'agricultural'],
+    'ta': ['வளர்', 'நட', 'பயிர்', 'உணவு', 'மழை', 'காலநிலை'],
+    'te': ['పెరుగు', 'నాట', 'పంట', 'ఆహారం', 'వర్షం', 'వాతావరణం'],
+    'ml': ['വളർ', 'നട', 'വിള', 'ഭക്ഷണം', 'മഴ', 'കാലാവസ്ഥ'],
+    'hi': ['उग', 'लगा', 'फसल', 'भोजन', 'बारिश', 'मौसम']
+}
+
+# Everyday farm words the lists above lack, and common romanized Hindi, Tamil, Telugu
+# and Malayalam ones (many farmers type their language in Latin script); the domain
+# gate admits them in every language
+FARM_TERMS = [
+    # Field work, inputs and seasons
+    'sow', 'sows', 'seedling', 'germination', 'transplant', 'spacing', 'variety', 'hybrid',
+    'tillage', 'plough', 'plow', 'orchard', 'garden', 'farmer', 'grower', 'acre', 'hectare',
+    'bigha', 'kharif', 'rabi', 'monsoon', 'frost', 'mandi', 'npk', 'potash', 'zinc', 'gypsum',
+    'vermicompost', 'biofertilizer', 'neem', 'insecticide', 'fungicide', 'weedicide', 'weed',
+    'spray', 'drip', 'sprinkler', 'borewell', 'canal',
+    # Pests and diseases
+    'thrips', 'aphid', 'whitefly', 'mite', 'borer', 'caterpillar', 'locust', 'weevil',
+    'nematode', 'wilt', 'mildew', 'rust', 'leaf curl', 'mosaic', 'rot', 'blight',
+    # Crops
+    'mustard', 'chilli', 'chili', 'brinjal', 'eggplant', 'okra', 'cauliflower', 'cucumber',
+    'pumpkin', 'gourd', 'garlic', 'ginger', 'turmeric', 'coconut', 'arecanut', 'cashew',
+    'cardamom', 'pepper', 'jute', 'sorghum', 'jowar', 'bajra', 'ragi', 'pulses', 'moong',
+    'urad', 'arhar', 'sesame', 'sunflower', 'castor', 'guava', 'pomegranate', 'watermelon',
+    'lemon', 'vegetable', 'fruit', 'paddy', 'millet',
+    # Romanized Hindi
+    'kheti', 'fasal', 'khad', 'beej', 'keet', 'keeda', 'rog', 'bimari', 'mitti', 'sinchai',
+    'gehun', 'gehu', 'dhan', 'chawal', 'makka', 'sarson', 'chana', 'kapas', 'ganna', 'aloo',
+    'pyaz', 'pyaaz', 'tamatar', 'mirch', 'baingan', 'gobhi', 'bhindi', 'buvai', 'buwai',
+    'bowai', 'katai', 'ropai', 'yuria', 'urvarak', 'kisan', 'khet', 'upaj', 'paidavar',
+    # Romanized Tamil, Telugu and Malayalam
+    'vivasayam', 'payir', 'nel', 'uram', 'poochi', 'vithai', 'vyavasayam', 'panta', 'vari',
+    'eruvulu', 'krishi', 'vithu', 'valam', 'nellu', 'thengu'
+]
+
+# Fallback category: the first whose terms appear in the query
+FALLBACK_CATEGORY_TERMS = [
+    ('fertilizer', ['fertilizer', 'urea', 'dap', 'nutrients', 'উরम্', 'ఎరువులు', 'വളം', 'खाद']),
+    ('pest', ['pest', 'insect', 'bug', 'spray', 'পূচ্চি', 'కీటకాలు', 'കീടം', 'कीट']),
+    ('disease', ['disease', 'fungus', 'rot', 'blight', 'নোয়', 'వ్యాధి', 'രോഗം', 'बीमारी'])
+]
+FALLBACK_CATEGORY_PATTERNS = [(category, compile_terms(terms)) for category, terms in FALLBACK_CATEGORY_TERMS]
+
+# Domain gate: /query answers questions that mention no crop, agriculture keyword,
+# phrase, KB category or item name, or fallback-answer term with a canned reply,
+# before any retrieval. Each language's terms plus the English ones are compiled
+# into one regex; the KB and fallback vocabulary, shared by all languages, into
+# another that is rebuilt on KB reload. DOMAIN_GATE=0 admits everything.
+DOMAIN_GATE_ENABLED = os.environ.get("DOMAIN_GATE", "1") != "0"
+
+def kb_vocabulary(kb: KnowledgeStore) -> set:
+    """Category and item names of the KB, underscores read as spaces ('crop_rotation' -> 'crop rotation')"""
+    names = {kb.category(entry) for entry in range(len(kb))}
+    names.update(kb.item(entry) for entry in range(len(kb)))
+    return {name.replace('_', ' ') for name in names if name}
+
+def shortest_prefixes(terms: Iterable[str]) -> List[str]:
+    """Casefolded terms minus those extending a shorter word prefix (they can only match where it does)
+
+    Terms under MIN_WORD_PREFIX characters only match whole words, so they absorb nothing.
+    """
+    kept: List[str] = []
+    prefix = None
+    for term in sorted({term.casefold() for term in terms if term}):
+        # Sorted order puts every extension of a term right after it
+        if prefix is not None and term.startswith(prefix):
+            continue
+        kept.append(term)
+        prefix = term if len(term) >= MIN_WORD_PREFIX else None
+    return kept
+
+class DomainGate:
+    """Agriculture check (language terms, then KB and fallback vocabulary) with admitted/rejected counters"""
+
+    def __init__(self, kb: KnowledgeStore):
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.patterns = {}
+        for language in set(CROP_SYNONYMS) | set(AGRICULTURE_KEYWORDS) | set(AGRI_PHRASES):
+            terms = set()
+            for table in (CROP_SYNONYMS, AGRICULTURE_KEYWORDS, AGRI_PHRASES):
+                terms.update(table.get(language, table['en']))
+                terms.update(table['en'])
+            terms.update(FARM_TERMS)
+            self.patterns[language] = compile_terms(terms, words=True)
+        self.vocabulary = self.compile_vocabulary(kb)
+
+    @staticmethod
+    def compile_vocabulary(kb: KnowledgeStore) -> "re.Pattern":
+        """The language-independent KB and fallback vocabulary (reload_kb swaps it in with the KB)"""
+        terms = kb_vocabulary(kb)
+        terms.update(term for _, category_terms in FALLBACK_CATEGORY_TERMS for term in category_terms)
+        return compile_terms(shortest_prefixes(terms), words=True)
+
+    def matches(self, query: str, language: str) -> bool:
+        folded = query.casefold()
+        return (self.patterns.get(language, self.patterns['en']).search(folded) is not None
+                or self.vocabulary.search(folded) is not None)
+
+    def check(self, query: str, language: str) -> bool:
+        """matches(), counted in the admitted/rejected stats"""
+        admitted = self.matches(query, language)
+        with self._lock:
+            if admitted:
+                self.admitted += 1
+            else:
+                self.rejected += 1
+        return admitted
+
+    def stats(self) -> Dict:
+        total = self.admitted + self.rejected
+        return {
+            "enabled": DOMAIN_GATE_ENABLED,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "rejection_rate": self.rejected / total if total else 0.0
+        }
+
+domain_gate = DomainGate(AGRICULTURE_KB)
+
+def is_agriculture_related(query: str, language: str) -> bool:
+    """Check if query is agriculture-related and reject non-agricultural queries"""
+    return domain_gate.matches(query, language)
+
+# Canned reply describing what the assistant covers, per language
+ASSISTANT_SCOPE_REPLIES = {
+    'en': "I'm your comprehensive agriculture assistant for ALL crops worldwide. Ask me about: Cereals (rice, wheat, corn, barley), Legumes (soybeans, chickpeas, lentils), Vegetables (tomatoes, potatoes, onions), Fruits (apples, oranges, bananas), Cash crops (cotton, sugarcane, coffee). I provide soil, pest, fertilizer, and growing advice!",
+    'ta': "நான் உலகளாவிய அனைத்து பயிர்களுக்கும் விரிவான வேளாண் உதவியாளர். என்னிடம் கேளுங்கள்: தானியங்கள், பருப்பு வகைகள், காய்கறிகள், பழங்கள், பணப்பயிர்கள் பற்றி.",
+    'te': "నేను ప్రపంచవ్యాప్త అన్ని పంటలకు సమగ్ర వ్యవసాయ సహాయకుడను. నన్ను అడగండి: ధాన్యాలు, గింజలు, కూరగాయలు, పండ్లు, వాణిజ్య పంటల గురించి.",
+    'ml': "ഞാൻ ലോകമെമ്പാടുമുള്ള എല്ലാ വിളകൾക്കും സമഗ്ര കാർഷിക സഹായിയാണ്. എന്നോട് ചോദിക്കുക: ധാന്യങ്ങൾ, പയർവർഗ്ഗങ്ങൾ, പച്ചക്കറികൾ, ഫലങ്ങൾ, വാണിജ്യ വിളകൾ.",
+    'hi': "मैं दुनिया भर की सभी फसलों के लिए व्यापक कृषि सहायक हूं। मुझसे पूछें: अनाज, दालें, सब्जियां, फल, नकदी फसलों के बारे में।"
+}
+
+# language="auto": the query's script picks the language. Devanagari, Tamil,
+# Telugu and Malayalam occupy disjoint Unicode blocks, so a histogram of code
+# points over these ranges decides. Latin-only text is English: the other
+# supported languages are only accepted in their native scripts.
+AUTO_LANGUAGE = "auto"
+SUPPORTED_LANGUAGES = ('en', 'hi', 'ta', 'te', 'ml')
+SCRIPT_BOUNDS = np.array([0x41, 0x5B, 0x61, 0x7B, 0x900, 0x980, 0xB80, 0xC00, 0xC80, 0xD00, 0xD80], dtype=np.uint32)
+# Language of each interval between consecutive bounds (None: not counted)
+SCRIPT_LANGUAGES = [None, 'en', None, 'en', None, 'hi', None, 'ta', 'te', None, 'ml', None]
+SCRIPT_CODES = np.array([SUPPORTED_LANGUAGES.index(lang) if lang else len(SUPPORTED_LANGUAGES)
+                         for lang in SCRIPT_LANGUAGES], dtype=np.intp)
+
+def detect_language(query: str) -> str:
+    """Language of a query from the Unicode blocks of its letters"""
+    code_points = np.frombuffer(query.encode('utf-32-le'), dtype=np.uint32)
+    codes = SCRIPT_CODES[np.searchsorted(SCRIPT_BOUNDS, code_points, side='right')]
+    counts = np.bincount(codes, minlength=len(SUPPORTED_LANGUAGES) + 1)[:len(SUPPORTED_LANGUAGES)]
+    indic = counts[1:]
+    if indic.any():
+        return SUPPORTED_LANGUAGES[1 + int(indic.argmax())]
+    return 'en'
+
+def resolve_language(language: str, query: str) -> str:
+    return detect_language(query) if language == AUTO_LANGUAGE else language
+
+class QueryRequest(BaseModel):
+    query: str
+    language: str = "en"  # or "auto"
+    mode: str = "direct"
+    user_type: str = "farmer"  # farmer, expert, student
+    crop_type: str = ""
+    land_size: str = ""
+    soil_type: str = ""
+    stage_timings: bool = False  # add a per-stage "stage_ms" breakdown to the response
+    compact: bool = False  # leave out the constant fields (see compact_response)
+
+MAX_BATCH_QUERIES = 512
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    language: str = "en"  # or "auto" (detected per query)
+    top_k: int = 3
+    crop_type: str = ""
+    soil_type: str = ""
+    stage_timings: bool = False
+    compact: bool = False
+
+# Kharif (monsoon) runs June-October and Rabi (winter) November-April, across the
+# new year; May, between the Rabi harvest and Kharif sowing, is no season ('')
+KHARIF_MONTHS = range(6, 11)
+RABI_END_MONTH = 5
+SEASON_CHANGE_MONTHS = (RABI_END_MONTH, KHARIF_MONTHS.start, KHARIF_MONTHS.stop)
+
+def current_season(now: Optional[datetime.datetime] = None) -> str:
+    month = (now or datetime.datetime.now()).month
+    if month in KHARIF_MONTHS:
+        return 'kharif'
+    if month >= KHARIF_MONTHS.stop or month < RABI_END_MONTH:
+        return 'rabi'
+    return ''
+
+def next_season_boundary(now: Optional[datetime.datetime] = None) -> float:
+    """Timestamp of the next season change (1 May, 1 June or 1 November, local time)"""
+    now = now or datetime.datetime.now()
+    month = next((month for month in SEASON_CHANGE_MONTHS if month > now.month), None)
+    if month is None:
+        boundary = datetime.datetime(now.year + 1, SEASON_CHANGE_MONTHS[0], 1)
+    else:
+        boundary = datetime.datetime(now.year, month, 1)
+    return boundary.timestamp()
+
+# Localized answer fragments, compiled once into ANSWER_FRAGMENTS/ANSWER_SUFFIXES (advice appended
+# to the retrieved KB text) and FALLBACK_ANSWER_TABLE (answers when nothing is retrieved)
+ANSWER_LANGUAGES = ('en', 'ta', 'te', 'ml', 'hi')
+
+SOIL_ADVICE = {
+    'clay': {
+        'en': " For clay soil: Good drainage system essential. Add organic matter to improve structure.",
+        'ta': " களிமண் மண்ணுக்கு: நல்ல வடிகால் அமைப்பு அவசியம். கரிமப் பொருட்களைச் சேர்க்கவும்.",
+        'te': " మట్టి మట్టికి: మంచి డ్రైనేజ్ వ్యవస్థ అవసరం. సేంద్రీయ పదార్థాలను కలపండి.",
+        'ml': " കളിമണ്ണിന്: നല്ല ഡ്രെയിനേജ് സിസ്റ്റം ആവശ്യം. ജൈവവസ്തുക്കൾ ചേർക്കുക.",
+        'hi': " चिकनी मिट्टी के लिए: अच्छी जल निकासी व्यवस्था जरूरी। जैविक पदार्थ मिलाएं।"
+    },
+    'sandy': {
+        'en': " For sandy soil: Frequent irrigation needed. Add compost to retain nutrients.",
+        'ta': " மணல் மண்ணுக்கு: அடிக்கடி நீர்ப்பாசனம் தேவை। கம்போஸ்ட் சேர்த்து ஊட்டச்சத்து தக்கவைக்கவும்.",
+        'te': " ఇసుక మట్టికి: తరచుగా నీటిపారుదల అవసరం. కంపోస్ట్ చేర்చి పోషకాలను నిలుపుకోండి.",
+        'ml': " മണൽമണ്ണിന്: ഇടയ്ക്കിടെ നനയ്ക്കണം. കമ്പോസ്റ്റ് ചേർത്ത് പോഷകങ്ങൾ നിലനിർത്തുക.",
+        'hi': " रेतीली मिट्टी के लिए: बार-बार सिंचाई चाहिए। कंपोस्ट मिलाकर पोषक तत्व बनाए रखें।"
+    }
+}
+
+LAND_SIZE_ADVICE = {
+    'small': {
+        'en': " For small land: Drip irrigation, vertical farming, soil mulching recommended.",
+        'ta': " சிறிய நிலத்திற்கு: சொட்டு நீர்ப்பாசனம், செங்குத்து விவசாயம், மண்ணின் மல்ச்சிங் பரிந்துரைக்கப்படுகிறது.",
+        'te': " చిన్న భూమికి: డ్రిప్ నీటిపారుదల, నిలువు వ్యవసాయం, మట్టి కవరింగ్ సిఫార్సు చేయబడింది.",
+        'ml': " ചെറിய ഭൂമിക്ക്: ഡ്രിപ്പ് ജലസേചനം, ലംബമായ കൃഷി, മണ്ണ് മൾച്ചിംഗ് ശുപാർശ ചെയ്യുന്നു.",
+        'hi': " छोटी जमीन के लिए: ड्रिप सिंचाई, ऊर्ध्वाधर खेती, मिट्टी मल्चिंग की सिफारिश।"
+    }
+}
+
+SEASON_ADVICE = {
+    'kharif': {
+        'en': " Current Kharif season. Suitable time for rice, cotton, corn, sugarcane.",
+        'ta': " தற்போது கரீப் பருவம். அரிசி, பருத்தி, சோளம், கரும்பு ஆகியவற்றுக்கு ஏற்ற காலம்.",
+        'te': " ప్రస్తుతం ఖరీఫ్ సీజన్. వరి, పత్తి, మొక్కజొన్న, చెరకుకు అనువైన సమయం.",
+        'ml': " ഇപ്പോൾ ഖരീഫ് സീസൺ. അരി, പരുത്തി, ചോളം, കരിമ്പ് എന്നിവയ്ക്ക് അനുയോജ്യമായ സമയം.",
+        'hi': " अभी खरीफ मौसम। धान, कपास, मक्का, गन्ने के लिए उपयुक्त समय।"
+    },
+    'rabi': {
+        'en': " Current Rabi season. Suitable time for wheat, barley, mustard, peas.",
+        'ta': " தற்போது ரபி பருவம். கோதுமை, பார்லி, கடுகு, பட்டாணி ஆகியவற்றுக்கு ஏற்ற காலம்.",
+        'te': " ప్రస్తుతం రబీ సీజన్. గోధుమ, బార్లీ, ఆవాలు, బఠానుల కోసం అనువైన సమయం.",
+        'ml': " ഇപ്പോൾ റബീ സീസൺ. ഗോതമ്പ്, ബാർലി, കടുക്, പയർ എന്നിവയ്ക്ക് അനുയോജ്യമായ സമയം.",
+        'hi': " अभी रबी मौसम। गेहूं, जौ, सरसों, मटर के लिए उपयुक्त समय।"
+    }
+}
+
+FALLBACK_ANSWERS = {
+    'en': {
+        'general': "For general farming: 1) Test soil pH (6.0-7.5 optimal), 2) Use organic compost, 3) Follow proper irrigation schedule, 4) Monitor for pests. I can help with any crop - cereals (rice, wheat, corn), legumes (soybeans, chickpeas), vegetables (tomatoes, potatoes), fruits (apples, oranges), or cash crops (cotton, sugarcane).",
+        'fertilizer': "Balanced NPK fertilizer guide: Most crops need 40kg Urea + 25kg DAP + 15kg MOP per acre. Split application - half at sowing, rest after 30-45 days. Organic options: compost, vermicompost, green manure.",
+        'pest': "Integrated pest management: 1) Neem oil spray (5ml/liter), 2) Remove affected parts, 3) Yellow sticky traps, 4) Beneficial insects, 5) Crop rotation. Specific treatments vary by crop and pest type.",
+        'disease': "Disease prevention: 1) Proper spacing for air circulation, 2) Avoid overhead watering, 3) Remove infected parts immediately, 4) Copper-based fungicides for fungal issues, 5) Resistant varieties when available."
+    },
+    'ta': {
+        'general': "பொதுவான வேளாண்மைக்கு: 1) மண் pH சோதனை (6.0-7.5 சிறந்தது), 2) கரிம கம்போஸ்ட் பயன்படுத்தவும், 3) சரியான நீர்ப்பாசனம், 4) பூச்சிகள் கண்காணிப்பு. நான் அனைத்து பயிர்களுக்கும் உதவ முடியும் - தானியங்கள், பருப்பு வகைகள், காய்கறிகள், பழங்கள், பணப்பயிர்கள்.",
+        'fertilizer': "சமச்சீர் NPK உரம்: பெரும்பாலான பயிர்களுக்கு ஏக்கருக்கு 40கிலோ யூரியா + 25கிலோ DAP + 15கிலோ MOP. பிரித்த பயன்பாடு - பாதி விதைக்கும்போது, மீதம் 30-45 நாட்களுக்குப் பிறகு.",
+        'pest': "ஒருங்கிணைந்த பூச்சி மேலாண்மை: 1) வேப்ப எண்ணெய் தெளிப்பு, 2) பாதிக்கப்பட்ட பகுதிகளை அகற்றவும், 3) மஞ்சள் ஒட்டும் பொறிகள், 4) பயன்படை பூச்சிகள், 5) பயிர் சுழற்சி.",
+        'disease': "நோய் தடுப்பு: 1) காற்றோட்டத்திற்கு சரியான இடைவெளி, 2) இலைகளில் நேரடி நீர் தெளிப்பு தவிர்க்கவும், 3) பாதிக்கப்பட்ட பகுதிகளை உடனே அகற்றவும்."
+    },
+    'te': {
+        'general': "సాధారణ వ్యవసాయానికి: 1) మట్టి pH పరీక్ష (6.0-7.5 ఉత్తమం), 2) సేంద్రీయ కంపోస్ట్ ఉపయోగించండి, 3) సరైన నీటిపారుదల, 4) కీటకాల పర్యవేక్షణ. నేను అన్ని పంటలకు సహాయం చేయగలను.",
+        'fertilizer': "సమతుల్య NPK ఎరువు: చాలా పంటలకు ఎకరకు 40కిలో యూరియా + 25కిలో DAP + 15కిలో MOP. విభజిత అప్లికేషన్ - సగం విత్తనాలో, మిగిలింది 30-45 రోజుల తర్వాత.",
+        'pest': "సమగ్ర కీటక నిర్వహణ: 1) వేప నూనె స్ప్రే, 2) ప్రభావిత భాగాలను తొలగించండి, 3) పసుపు జిగురు ఉచ్చులు, 4) ప్రయోజనకరమైన కీటకాలు.",
+        'disease': "వ్యాధి నివారణ: 1) గాలి ప్రసరణ కోసం సరైన అంతరం, 2) పై నుండి నీరు పోయడం మానుకోండి, 3) సోకిన భాగాలను వెంటనే తొలగించండి."
+    },
+    'ml': {
+        'general': "പൊതുവായ കൃഷിക്ക്: 1) മണ്ണിന്റെ pH പരിശോധന (6.0-7.5 ഉത്തമം), 2) ജൈവ കമ്പോസ്റ്റ് ഉപയോഗിക്കുക, 3) ശരിയായ ജലസേചനം, 4) കീടങ്ങളുടെ നിരീക്ഷണം. എനിക്ക് എല്ലാ വിളകൾക്കും സഹായിക്കാൻ കഴിയും.",
+        'fertilizer': "സമതുലിതമായ NPK വളം: മിക്ക വിളകൾക്കും ഏക്കറിന് 40കിലോ യൂറിയ + 25കിലോ DAP + 15കിലോ MOP. വിഭജിത പ്രയോഗം - പകുതി വിതയ്ക്കുമ്പോൾ, ബാക്കി 30-45 ദിവസങ്ങൾക്ക് ശേഷം.",
+        'pest': "സംയോജിത കീട പരിപാലനം: 1) വേപ്പെണ്ണ സ്പ്രേ, 2) ബാധിത ഭാഗങ്ങൾ നീക്കം ചെയ്യുക, 3) മഞ്ഞ ഒട്ടുന്ന കെണികൾ.",
+        'disease': "രോഗ പ്രതിരോധം: 1) വായു സഞ്ചാരത്തിന് ശരിയായ അകലം, 2) മുകളിൽ നിന്ന് വെള്ളം ഒഴിക്കുന്നത് ഒഴിവാക്കുക, 3) രോഗബാധിത ഭാഗങ്ങൾ ഉടനെ നീക്കം ചെയ്യുക."
+    },
+    'hi': {
+        'general': "सामान्य कृषि के लिए: 1) मिट्टी pH जांच (6.0-7.5 आदर्श), 2) जैविक खाद का उपयोग, 3) उचित सिंचाई, 4) कीट निगरानी। मैं सभी फसलों के लिए मदद कर सकता हूं।",
+        'fertilizer': "संतुलित NPK उर्वरक: अधिकांश फसलों के लिए प्रति एकड़ 40किलो यूरिया + 25किलो DAP + 15किलो MOP। विभाजित उपयोग - आधा बुआई के समय, बाकी 30-45 दिन बाद।",
+        'pest': "एकीकृत कीट प्रबंधन: 1) नीम तेल स्प्रे, 2) प्रभावित भागों को हटाएं, 3) पीले चिपचिपे जाल, 4) लाभकारी कीड़े।",
+        'disease': "रोग रोकथाम: 1) हवा के संचार के लिए उचित दूरी, 2) ऊपर से पानी देना बचें, 3) संक्रमित भागों को तुरंत हटाएं।"
+    }
+}
+
+def build_answer_fragments() -> Dict[Tuple[str, str, str, str], Tuple[Tuple[str, str], ...]]:
+    """(kind, text) advice fragments for every (language, soil, land_size, season); '' stands for any other value"""
+    table = {}
+    for language in ANSWER_LANGUAGES:
+        for soil in ('', *SOIL_ADVICE):
+            for land_size in ('', *LAND_SIZE_ADVICE):
+                for season in ('', *SEASON_ADVICE):
+                    fragments = [
+                        ('soil', SOIL_ADVICE.get(soil, {}).get(language, '')),
+                        ('land_size', LAND_SIZE_ADVICE.get(land_size, {}).get(language, '')),
+                        ('season', SEASON_ADVICE[season][language] if season else '')
+                    ]
+                    table[(language, soil, land_size, season)] = tuple((kind, text) for kind, text in fragments if text)
+    return table
+
+ANSWER_FRAGMENTS = build_answer_fragments()
+ANSWER_SUFFIXES = {key: ''.join(text for _, text in fragments) for key, fragments in ANSWER_FRAGMENTS.items()}
+FALLBACK_ANSWER_TABLE = {
+    (language, category): answers.get(category, FALLBACK_ANSWERS['en']['general'])
+    for language, answers in FALLBACK_ANSWERS.items()
+    for category in (*FALLBACK_ANSWERS['en'], 'general')
+}
+
+_season_of_day = {"season": "", "until": 0.0}
+
+def season_of_day() -> str:
+    """current_season(), recomputed at most once per day"""
+    now = time.time()
+    if now >= _season_of_day["until"]:
+        today = datetime.datetime.fromtimestamp(now)
+        midnight = datetime.datetime.combine(today.date() + datetime.timedelta(days=1), datetime.time())
+        _season_of_day.update(season=current_season(today), until=midnight.timestamp())
+    return _season_of_day["season"]
+
+def fallback_category(query: str) -> str:
+    folded = query.casefold()
+    for category, pattern in FALLBACK_CATEGORY_PATTERNS:
+        if pattern.search(folded):
+            return category
+    return 'general'
+
+def answer_key(language: str, soil_type: str, land_size: str, season: str) -> Tuple[str, str, str, str]:
+    return (
+        language if language in ANSWER_LANGUAGES else 'en',
+        soil_type if soil_type in SOIL_ADVICE else '',
+        land_size if land_size in LAND_SIZE_ADVICE else '',
+        season if season in SEASON_ADVICE else ''
+    )
+
+def compose_answer(query: str, language: str, rag_context: List[Dict], soil_type: str, land_size: str, season: str) -> str:
+    """Practical answer: the best KB match plus soil, land-size and season advice, or a fallback"""
+    if rag_context:
+        return ''.join((rag_context[0]['content'], ANSWER_SUFFIXES[answer_key(language, soil_type, land_size, season)]))
+
+    category = fallback_category(query)
+    return FALLBACK_ANSWER_TABLE.get((language, category), FALLBACK_ANSWER_TABLE[('en', category)])
+
+def answer_parts(query: str, language: str, rag_context: List[Dict], soil_type: str, land_size: str, season: str) -> List[Tuple[str, str]]:
+    """compose_answer() as (kind, text) parts in answer order; the texts concatenate to the same answer"""
+    if rag_context:
+        return [('content', rag_context[0]['content']), *ANSWER_FRAGMENTS[answer_key(language, soil_type, land_size, season)]]
+    return [('fallback', compose_answer(query, language, rag_context, soil_type, land_size, season))]
+
+def normalize_query(query: str) -> str:
+    """NFC, case-fold and collapse whitespace so trivially different questions share a key"""
+    return " ".join(unicodedata.normalize("NFC", query).casefold().split())
+
+# /query result cache: QUERY_CACHE_SIZE entries (0 disables), each kept for
+# QUERY_CACHE_TTL seconds but never past the next season boundary
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 2048))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 3600))
+
+class QueryCache:
+    """Bounded LRU cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Tuple):
+        if self.max_entries <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Tuple, value, expires_at: Optional[float] = None):
+        if self.max_entries <= 0:
+            return
+        deadline = time.time() + self.ttl
+        expires_at = deadline if expires_at is None else min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+# Per-stage latency histograms (crop detection, index, vectorize, score, content,
+# compose, gTTS, base64, request totals), labelled by stage, endpoint and language
+# and exported on /metrics in Prometheus text format. METRICS=0 turns recording off.
+METRICS_ENABLED = os.environ.get("METRICS", "1") != "0"
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Endpoint label and, when the client asked for it, the per-stage breakdown (ms) of
+# the current request; copied into worker threads by BoundedExecutor.submit
+request_metrics: "contextvars.ContextVar[Optional[Dict]]" = contextvars.ContextVar("request_metrics", default=None)
+
+class StageHistograms:
+    """Fixed-bucket histograms sharded per thread: recording takes no lock, /metrics merges the shards"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, endpoint: str, language: str, seconds: float):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        counts = shard.get((stage, endpoint, language))
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum of observed seconds
+            counts = shard[(stage, endpoint, language)] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def merged(self) -> Dict[Tuple[str, str, str], List]:
+        with self._lock:
+            shards = list(self._shards)
+        totals: Dict[Tuple[str, str, str], List] = {}
+        for shard in shards:
+            for labels, counts in list(shard.items()):
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, value in enumerate(counts):
+                    total[i] += value
+        return totals
+
+stage_histograms = StageHistograms(STAGE_BUCKETS)
+
+def metric_language(language: str) -> str:
+    """Bounded label values: the language parameter is client input"""
+    return language if language in SUPPORTED_LANGUAGES or language == AUTO_LANGUAGE else "other"
+
+def record_stage(stage: str, language: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    context = request_metrics.get()
+    stage_histograms.observe(stage, context["endpoint"] if context else "internal", metric_language(language), seconds)
+    if context is not None and context["stages"] is not None:
+        context["stages"][stage] = round(context["stages"].get(stage, 0.0) + seconds * 1000, 3)
+
+@contextmanager
+def timed_stage(stage: str, language: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, language, time.perf_counter() - started)
+
+def start_request_metrics(endpoint: str, breakdown: bool = False) -> Optional[Dict]:
+    """Label this request's stages with endpoint; returns the breakdown dict when one was asked for"""
+    stages = {} if breakdown else None
+    request_metrics.set({"endpoint": endpoint, "stages": stages})
+    return stages
+
+def prometheus_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_stage_metrics() -> List[str]:
+    lines = [
+        "# HELP agri_stage_duration_seconds Latency of each request processing stage.",
+        "# TYPE agri_stage_duration_seconds histogram"
+    ]
+    bounds = [repr(bound) for bound in STAGE_BUCKETS] + ["+Inf"]
+    for (stage, endpoint, language), counts in sorted(stage_histograms.merged().items()):
+        labels = (f'stage="{prometheus_label_value(stage)}",endpoint="{prometheus_label_value(endpoint)}",'
+                  f'language="{prometheus_label_value(language)}"')
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            lines.append(f'agri_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"agri_stage_duration_seconds_sum{{{labels}}} {counts[-1]!r}")
+        lines.append(f"agri_stage_duration_seconds_count{{{labels}}} {cumulative}")
+    return lines
+
+# CPU-bound request work runs on bounded thread pools so the event loop only does
+# I/O: RAG_WORKERS threads for retrieval and answer composition, TTS_WORKERS for
+# gTTS. Past *_MAX_PENDING queued or running tasks, requests get a 503.
+RAG_WORKERS = int(os.environ.get("RAG_WORKERS", min(4, os.cpu_count() or 1)))
+RAG_MAX_PENDING = int(os.environ.get("RAG_MAX_PENDING", 64))
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", 4))
+TTS_MAX_PENDING = int(os.environ.get("TTS_MAX_PENDING", 32))
+EXECUTOR_WAIT_SAMPLES = 1024
+
+class ExecutorSaturated(Exception):
+    pass
+
+class BoundedExecutor:
+    """Thread pool with a cap on pending tasks, queue depth and wait-time metrics"""
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queued = 0
+        self._waits: "deque[float]" = deque(maxlen=EXECUTOR_WAIT_SAMPLES)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool, raising ExecutorSaturated when too many tasks are pending"""
+        return await self.submit(fn, *args)
+
+    def submit(self, fn, *args) -> "asyncio.Future":
+        """Queue fn(*args) now and return an awaitable for its result; raises ExecutorSaturated right away"""
+        with self._lock:
+            if self.queued + self.running >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated(self.name)
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        submitted = time.perf_counter()
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._waits.append(time.perf_counter() - submitted)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        # Run under a copy of the caller's context so stage timings keep the request's labels
+        return asyncio.wrap_future(self._pool.submit(contextvars.copy_context().run, task))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits = np.array(self._waits) * 1000
+            stats = {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queued": self.queued,
+                "running": self.running,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected
+            }
+        if len(waits):
+            p50, p99 = np.percentile(waits, [50, 99])
+            stats["wait_ms"] = {"p50": round(float(p50), 3), "p99": round(float(p99), 3),
+                                "max": round(float(waits.max()), 3), "samples": len(waits)}
+        return stats
+
+retrieval_executor = BoundedExecutor("rag-worker", RAG_WORKERS, RAG_MAX_PENDING)
+tts_executor = BoundedExecutor("tts-worker", TTS_WORKERS, TTS_MAX_PENDING)
+
+class SingleFlight:
+    """Deduplicates concurrent identical work: callers with the same key share one in-flight task"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Tuple, "asyncio.Task"] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Tuple, make):
+        """Result of make() for key, awaiting the running call when one is already in flight"""
+        return await self.join(key, make)
+
+    def join(self, key: Tuple, make) -> "asyncio.Future":
+        """Awaitable for key's in-flight call, starting make() (a coroutine or future) when there is none"""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make())
+            self.executed += 1
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded: a caller that disconnects must not cancel the work the others wait for
+        return asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        total = self.executed + self.coalesced
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0
+        }
+
+# Identical concurrent /query (or /query/stream) requests, by query cache key, share one retrieval;
+# identical /generate-tts requests (same cleaned text and voice) one gTTS call
+query_flights = SingleFlight("query")
+tts_flights = SingleFlight("tts")
+
+def saturated_response(e: ExecutorSaturated) -> HTTPException:
+    logger.warning(f"⏳ {e} pool saturated, rejecting request")
+    return HTTPException(status_code=503, detail="Server busy, retry shortly", headers={"Retry-After": "1"})
+
+# Per-client admission control: a token bucket per client and budget, refilled at
+# *_RATE_PER_SEC up to *_BURST tokens. Retrieval (/query, /query/stream,
+# /query/batch at one token per query) and TTS (/generate-tts) have separate
+# budgets, so a batch can hold at most *_BURST / cost queries; a rate of 0 turns a
+# budget off and RATE_LIMIT=0 turns admission control off. Clients are identified
+# by IP, or by X-API-Key when it is one of RATE_LIMIT_API_KEYS (gateways that relay
+# many farmers), whose calls cost 1 / RATE_LIMIT_KEY_SCALE tokens. At most
+# RATE_LIMIT_MAX_CLIENTS buckets are kept; buckets idle for RATE_LIMIT_IDLE_SECONDS
+# (and full again) are dropped first. When the table is full, the least recently
+# used bucket is dropped only if it has refilled; otherwise new clients are shed
+# with 429 until it has, so no client gets a fresh burst by being evicted.
+#
+# X-Forwarded-For is only believed when the connection comes from one of
+# RATE_LIMIT_TRUSTED_PROXIES (addresses or CIDRs; by default loopback and the private
+# ranges that platform load balancers connect from). The client is then the
+# rightmost hop no trusted proxy added: entries to its left come from the client
+# itself and can be forged. A public peer is always the client.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT", "1") != "0"
+QUERY_RATE_PER_SEC = float(os.environ.get("QUERY_RATE_PER_SEC", 2))
+QUERY_BURST = float(os.environ.get("QUERY_BURST", 30))
+TTS_RATE_PER_SEC = float(os.environ.get("TTS_RATE_PER_SEC", 0.2))
+TTS_BURST = float(os.environ.get("TTS_BURST", 6))
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()]
+RATE_LIMIT_KEY_SCALE = float(os.environ.get("RATE_LIMIT_KEY_SCALE", 10))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 50000))
+RATE_LIMIT_IDLE_SECONDS = float(os.environ.get("RATE_LIMIT_IDLE_SECONDS", 600))
+RATE_LIMIT_TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(cidr.strip(), strict=False)
+    for cidr in os.environ.get(
+        "RATE_LIMIT_TRUSTED_PROXIES",
+        "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,100.64.0.0/10,fc00::/7"
+    ).split(",")
+    if cidr.strip()
+)
+
+class TokenBuckets:
+    """Token buckets for one budget, in least-recently-used order (only touched on the event loop)"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_clients: int, idle_seconds: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # A bucket is only dropped once it would have refilled (idle, or the least recently
+        # used when the table is full), so eviction never grants extra tokens
+        self.idle_seconds = max(idle_seconds, burst / rate) if rate > 0 else idle_seconds
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.shed = 0
+
+    def acquire(self, client: str, cost: float = 1.0, now: Optional[float] = None) -> float:
+        """Take cost tokens from client's bucket: 0.0 when admitted, else seconds until they are available"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.pop(client, None)
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if now - oldest[1] < self.idle_seconds:
+                break
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+        if bucket is None and len(self._buckets) >= self.max_clients:
+            # Full of active clients: make room only if the least recently used bucket has
+            # refilled, else shed the new client until it has
+            oldest = next(iter(self._buckets.values()))
+            refill = (self.burst - oldest[0]) / self.rate - (now - oldest[1])
+            if refill > 0:
+                self.rejected += 1
+                self.shed += 1
+                return refill
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+            self.admitted += 1
+        else:
+            wait = (cost - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[client] = (tokens, now)
+        return wait
+
+    def stats(self) -> Dict:
+        total = self.admitted + self.rejected
+        return {
+            "rate_per_sec": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "max_clients": self.max_clients,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "rejection_rate": self.rejected / total if total else 0.0,
+            "evicted": self.evicted,
+            "shed": self.shed
+        }
+
+query_buckets = TokenBuckets("query", QUERY_RATE_PER_SEC, QUERY_BURST, RATE_LIMIT_MAX_CLIENTS, RATE_LIMIT_IDLE_SECONDS)
+tts_buckets = TokenBuckets("tts", TTS_RATE_PER_SEC, TTS_BURST, RATE_LIMIT_MAX_CLIENTS, RATE_LIMIT_IDLE_SECONDS)
+RATE_LIMITED_PATHS = {
+    path: buckets
+    for path, buckets in {
+        "/query": query_buckets,
+        "/query/stream": query_buckets,
+        # The first token of a batch, before its body is read; charge_batch takes the rest
+        "/query/batch": query_buckets,
+        "/generate-tts": tts_buckets
+    }.items()
+    if buckets.rate > 0
 }
+RATE_LIMITED_BODY = b'{"detail":"Too many requests, retry shortly"}'
 
-# Load Knowledge Base (external JSON if present; fallback to built-in)
-DATA_PATH = Path(__file__).parent / "data" / "agri_kb.json"
+def rate_limit_client(scope: Dict) -> Tuple[str, float]:
+    """(bucket key, cost) of a request: a listed API key, or else the client IP"""
+    if RATE_LIMIT_API_KEYS:
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                if any(hmac.compare_digest(value, key.encode("utf-8")) for key in RATE_LIMIT_API_KEYS):
+                    return "key:" + value.decode("utf-8"), 1 / RATE_LIMIT_KEY_SCALE
+                break
+    client = scope.get("client")
+    address = client[0] if client and client[0] else "unknown"
+    if trusted_proxy(address):
+        address = forwarded_client(scope["headers"], address)
+    return "ip:" + address, 1.0
 
-def load_kb() -> Dict[str, Dict]:
-    if DATA_PATH.exists():
-        try:
-            with open(DATA_PATH, "r", encoding="utf-8") as f:
-                kb = json.load(f)
-            logger.info(f"📚 Loaded external KB: {DATA_PATH}")
-            return kb
-        except Exception as e:
-            logger.warning(f"Could not load external KB ({e}), using built-in fallback.")
-    return FALLBACK_KB
+def trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in RATE_LIMIT_TRUSTED_PROXIES)
 
-AGRICULTURE_KB = load_kb()
+def forwarded_client(headers: List[Tuple[bytes, bytes]], peer: str) -> str:
+    """Rightmost X-Forwarded-For hop not added by a trusted proxy (peer, the nearest one, sent the header)"""
+    hops = [hop.strip() for name, value in headers if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",")]
+    client = peer
+    for hop in reversed(hops):
+        if not hop:
+            continue
+        client = hop
+        if not trusted_proxy(hop):
+            break
+    return client
 
-# Multilingual, character n-gram based RAG index with crop/soil boosting
-kb_index: Dict[str, Dict] = {}
+def charge_batch(request: Request, queries: int):
+    """Take the retrieval tokens of a /query/batch call's other queries, or raise 429
 
-def build_lang_index(lang: str):
-    texts: List[str] = []
-    keys: List[Tuple[str, str]] = []
+    The middleware already took one token before the body was parsed; only the
+    handler can see how many queries there are.
+    """
+    if not RATE_LIMIT_ENABLED or query_buckets.rate <= 0 or queries <= 1:
+        return
+    client, cost = rate_limit_client(request.scope)
+    # Rounded so that e.g. 300 queries at 0.1 fit a burst of 30 exactly
+    wait = query_buckets.acquire(client, round(cost * (queries - 1), 6))
+    if wait <= 0:
+        return
+    largest = math.floor(round(query_buckets.burst / cost, 6))
+    if queries > largest:
+        detail = f"Batch of {queries} queries exceeds this client's limit of {largest} per batch, split it"
+    else:
+        detail = "Too many requests, retry shortly"
+    raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(wait)))})
 
-    for category, items in AGRICULTURE_KB.items():
-        for item, langs in items.items():
-            content = (langs.get(lang) or langs.get('en') or '').strip()
-            if content:
-                texts.append(content)
-                keys.append((category, item))
+class RateLimitMiddleware:
+    """ASGI middleware answering over-budget calls with 429 before routing, body parsing or any work"""
 
-    if not texts:
-        # fallback to English entries if none for the language
-        for category, items in AGRICULTURE_KB.items():
-            for item, langs in items.items():
-                content = (langs.get('en') or '').strip()
-                if content:
-                    texts.append(content)
-                    keys.append((category, item))
-
-    vect = TfidfVectorizer(
-        analyzer='char_wb',
-        ngram_range=(3, 5),
-        min_df=1,
-        max_features=5000
-    )
-    mat = vect.fit_transform(texts)
+    def __init__(self, app):
+        self.app = app
 
-    kb_index[lang] = {
-        'vectorizer': vect,
-        'vectors': mat,
-        'keys': keys,
-        'texts': texts
-    }
-    logger.info(f"✅ RAG index built for '{lang}' with {len(texts)} entries")
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            buckets = RATE_LIMITED_PATHS.get(scope["path"])
+            if buckets is not None:
+                client, cost = rate_limit_client(scope)
+                wait = buckets.acquire(client, cost)
+                if wait > 0:
+                    await send({
+                        "type": "http.response.start",
+                        "status": 429,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (b"content-length", str(len(RATE_LIMITED_BODY)).encode("latin-1")),
+                            (b"retry-after", str(max(1, math.ceil(wait))).encode("latin-1"))
+                        ]
+                    })
+                    await send({"type": "http.response.body", "body": RATE_LIMITED_BODY})
+                    return
+        await self.app(scope, receive, send)
 
-def ensure_lang_index(lang: str):
-    if lang not in kb_index:
-        build_lang_index(lang)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 
-def detect_explicit_crop(query: str, language: str) -> str:
-    """Detect crop mentions in multiple languages"""
-    crop_synonyms = {
-        'en': {
-            # Cereals
-            'rice': 'rice', 'paddy': 'rice', 'wheat': 'wheat', 'corn': 'corn', 'maize': 'corn',
-            'barley': 'barley', 'oats': 'oats', 'millet': 'millet', 'quinoa': 'quinoa',
-            # Legumes
-            'soybeans': 'soybeans', 'soy': 'soybeans', 'chickpeas': 'chickpeas', 'lentils': 'lentils',
-            'beans': 'beans', 'peas': 'peas', 'groundnut': 'groundnut', 'peanut': 'groundnut',
-            # Vegetables
-            'tomato': 'tomatoes', 'tomatoes': 'tomatoes', 'potato': 'potatoes', 'potatoes': 'potatoes',
-            'onion': 'onions', 'onions': 'onions', 'carrot': 'carrots', 'carrots': 'carrots',
-            'cabbage': 'cabbage', 'lettuce': 'lettuce', 'spinach': 'spinach', 'broccoli': 'broccoli',
-            # Fruits
-            'apple': 'apples', 'apples': 'apples', 'orange': 'oranges', 'oranges': 'oranges',
-            'banana': 'bananas', 'bananas': 'bananas', 'grape': 'grapes', 'grapes': 'grapes',
-            'mango': 'mango', 'papaya': 'papaya', 'pineapple': 'pineapple',
-            # Cash crops
-            'cotton': 'cotton', 'sugarcane': 'sugarcane', 'coffee': 'coffee', 'tea': 'tea',
-            'tobacco': 'tobacco', 'rubber': 'rubber'
-        },
-        'ta': {
-            # Tamil crop names
-            'அரிசி': 'rice', 'நெல்': 'rice', 'கோதுமை': 'wheat', 'சோளம்': 'corn',
-            'கேழ்வரகு': 'millet', 'பார்லி': 'barley', 'வெண்ணையடுங்': 'barley',
-            'சோயாபீன்': 'soybeans', 'கொண்டைக்கடலை': 'chickpeas', 'பருப்பு': 'lentils',
-            'தக்காளி': 'tomatoes', 'உருளைக்கிழங்கு': 'potatoes', 'வெங்காயம்': 'onions',
-            'கேரட்': 'carrots', 'முட்டைக்கோஸ்': 'cabbage', 'கீரை': 'spinach',
-            'ஆப்பிள்': 'apples', 'ஆரஞ்சு': 'oranges', 'வாழைப்பழம்': 'bananas',
-            'திராட்சை': 'grapes', 'மாம்பழம்': 'mango', 'பப்பாளி': 'papaya',
-            'பருத்தி': 'cotton', 'கரும்பு': 'sugarcane', 'காபி': 'coffee', 'தேயிலை': 'tea'
-        },
-        'te': {
-            # Telugu crop names
-            'వరి': 'rice', 'బియ్యం': 'rice', 'గోధుమ': 'wheat', 'మొక్కజొన్న': 'corn',
-            'జొన్న': 'millet', 'బార్లీ': 'barley', 'వోట్స్': 'oats',
-            'సోయాబీన్స్': 'soybeans', 'శనగలు': 'chickpeas', 'మసూర్': 'lentils',
-            'టమోటా': 'tomatoes', 'బంగాళాదుంప': 'potatoes', 'ఉల్లిపాయలు': 'onions',
-            'క్యారెట్': 'carrots', 'కాబేజీ': 'cabbage', 'పాలకూర': 'spinach',
-            'ఆపిల్స్': 'apples', 'నారింజలు': 'oranges', 'అరటిపండ్లు': 'bananas',
-            'ద్రాక్షలు': 'grapes', 'మామిడిపండు': 'mango', 'బొప్పాయి': 'papaya',
-            'పత్తి': 'cotton', 'చెరకు': 'sugarcane', 'కాఫీ': 'coffee', 'తేనీరు': 'tea'
-        },
-        'ml': {
-            # Malayalam crop names
-            'അരി': 'rice', 'നെൽ': 'rice', 'ഗോതമ്പ്': 'wheat', 'ചോളം': 'corn',
-            'കേഴ്വരകു': 'millet', 'ബാർലി': 'barley', 'ഓട്സ്': 'oats',
-            'സോയാബീൻ': 'soybeans', 'ചെറുപയർ': 'chickpeas', 'പയർ': 'lentils',
-            'തക്കാളി': 'tomatoes', 'ഉരുളക്കിഴങ്ങ്': 'potatoes', 'ഉള്ളി': 'onions',
-            'കാരറ്റ്': 'carrots', 'കാബേജ്': 'cabbage', 'ചീര': 'spinach',
-            'ആപ്പിൾ': 'apples', 'ഓറഞ്ച്': 'oranges', 'വാഴപ്പഴം': 'bananas',
-            'മുന്തിരി': 'grapes', 'മാമ്പഴം': 'mango', 'പപ്പായ': 'papaya',
-            'പരുത്തി': 'cotton', 'കരിമ്പ്': 'sugarcane', 'കാപ്പി': 'coffee', 'ചായ': 'tea'
-        },
-        'hi': {
-            # Hindi crop names
-            'चावल': 'rice', 'धान': 'rice', 'गेहूं': 'wheat', 'मक्का': 'corn',
-            'बाजरा': 'millet', 'जौ': 'barley', 'जई': 'oats',
-            'सोयाबीन': 'soybeans', 'चना': 'chickpeas', 'मसूर': 'lentils',
-            'टमाटर': 'tomatoes', 'आलू': 'potatoes', 'प्याज': 'onions',
-            'गाजर': 'carrots', 'पत्तागोभी': 'cabbage', 'पालक': 'spinach',
-            'सेब': 'apples', 'संतरा': 'oranges', 'केला': 'bananas',
-            'अंगूर': 'grapes', 'आम': 'mango', 'पपीता': 'papaya',
-            'कपास': 'cotton', 'गन्ना': 'sugarcane', 'कॉफी': 'coffee', 'चाय': 'tea'
-        }
-    }
-    
-    mapping = crop_synonyms.get(language, crop_synonyms['en'])
-    query_lower = query.lower()
-    
-    for crop_name, standardized_name in mapping.items():
-        if crop_name.lower() in query_lower:
-            return standardized_name
-    
-    return ""
+def query_cache_key(request: QueryRequest, season: str) -> Tuple:
+    return (
+        KB_HASH,
+        normalize_query(request.query),
+        request.language,
+        request.crop_type,
+        request.soil_type,
+        request.land_size,
+        season
+    )
 
-def is_agriculture_related(query: str, language: str) -> bool:
-    """Check if query is agriculture-related and reject non-agricultural queries"""
-    agriculture_keywords = {
-        'en': [
-            'crop', 'farming', 'agriculture', 'plant', 'soil', 'fertilizer', 'pest', 'disease',
-            'irrigation', 'harvest', 'seed', 'growth', 'cultivation', 'farm', 'field',
-            'pesticide', 'herbicide', 'organic', 'yield', 'planting', 'sowing', 'tractor',
-            'compost', 'manure', 'greenhouse', 'nursery', 'pruning', 'grafting', 'weather',
-            'climate', 'rain', 'drought', 'water', 'nitrogen', 'phosphorus', 'potassium',
-            'ph', 'acidity', 'alkaline', 'mulch', 'weeds', 'insects', 'fungus', 'bacteria',
-            'rice', 'wheat', 'corn', 'barley', 'oats', 'tomato', 'potato', 'onion', 'carrot',
-            'apple', 'orange', 'banana', 'grape', 'cotton', 'sugarcane', 'coffee', 'tea',
-            'beans', 'peas', 'lentil', 'soybean', 'cabbage', 'lettuce', 'spinach', 'mango'
-        ],
-        'ta': [
-            'பயிர்', 'விவசாயம்', 'வேளாண்மை', 'தாவரம்', 'மண்', 'உரம்', 'பூச்சி', 'நோய்',
-            'நீர்ப்பாசனம்', 'அறுவடை', 'விதை', 'வளர்ச்சி', 'சாகுபடி', 'வயல்', 'அரிசி', 'நெல்',
-            'கோதுமை', 'தக்காளி', 'உருளைக்கிழங்கு', 'வெங்காயம்', 'கேரட்', 'ஆப்பிள்', 'பருத்தி',
-            'பூச்சிக்கொல்லி', 'களைக்கொல்லி', 'கரிம', 'விளைச்சல்', 'நடவு', 'கரும்பு', 'காபி'
-        ],
-        'te': [
-            'పంట', 'వ్యవసాయం', 'వేషధారణ', 'మొక్క', 'మట్టి', 'ఎరువులు', 'కీటకాలు', 'వ్యాధి',
-            'నీటిపారుదల', 'కోత', 'విత్తనం', 'పెరుగుదల', 'సాగు', 'పొలం', 'వరి', 'గోధుమ',
-            'టమోటా', 'బంగాళాదుంప', 'ఉల్లిపాయలు', 'క్యారెట్', 'ఆపిల్స్', 'పత్తి', 'చెరకు'
-        ],
-        'ml': [
-            'വിള', 'കൃഷി', 'കാർഷികം', 'ചെടി', 'മണ്ണ്', 'വളം', 'കീടം', 'രോഗം',
-            'ജലസേചനം', 'വിളവെടുപ്പ്', 'വിത്ത്', 'വളർച്ച', 'കൃഷി', 'വയൽ', 'അരി', 'ഗോതമ്പ്',
-            'തക്കാളി', 'ഉരുളക്കിഴങ്ങ്', 'ഉള്ളി', 'കാരറ്റ്', 'ആപ്പിൾ', 'പരുത്തി', 'കരിമ്പ്'
-        ],
-        'hi': [
-            'फसल', 'खेती', 'कृषि', 'पौधा', 'मिट्टी', 'खाद', 'कीट', 'बीमारी',
-            'सिंचाई', 'कटाई', 'बीज', 'वृद्धि', 'खेती', 'खेत', 'चावल', 'गेहूं',
-            'टमाटर', 'आलू', 'प्याज', 'गाजर', 'सेब', 'कपास', 'गन्ना'
-        ]
-    }
-    
-    # First check for crop names (most important)
-    crop_detected = detect_explicit_crop(query, language)
-    if crop_detected:
+# HTTP caching for GET /query: a weak ETag over the KB hash, the normalized request
+# and the season, answered with 304 on If-None-Match, and Cache-Control: public with
+# max-age QUERY_HTTP_MAX_AGE seconds (capped at the next season boundary; 0 makes
+# caches revalidate every time) so a CDN or reverse proxy can absorb repeat questions
+QUERY_HTTP_MAX_AGE = int(os.environ.get("QUERY_HTTP_MAX_AGE", 300))
+
+def query_etag(request: QueryRequest, season: str) -> str:
+    """Weak validator: the response body also carries processing_time_ms, so it is not byte-identical"""
+    key = (*query_cache_key(request, season), request.user_type, request.compact, DOMAIN_GATE_ENABLED)
+    digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison: '*', or any listed tag equal to etag ignoring W/ prefixes"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
         return True
-    
-    # Get keywords for the language
-    keywords = agriculture_keywords.get(language, agriculture_keywords['en'])
-    query_lower = query.lower()
-    
-    # Check if any agriculture keyword is present
-    for keyword in keywords:
-        if keyword.lower() in query_lower:
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
             return True
-    
-    # Additional check for common agriculture phrases
-    agri_phrases = {
-        'en': ['grow', 'plant', 'farm', 'soil', 'water', 'sun', 'season', 'harvest', 'food production', 'agricultural'],
-        'ta': ['வளர்', 'நட', 'பயிர்', 'உணவு', 'மழை', 'காலநிலை'],
-        'te': ['పెరుగు', 'నాట', 'పంట', 'ఆహారం', 'వర్షం', 'వాతావరణం'],
-        'ml': ['വളർ', 'നട', 'വിള', 'ഭക്ഷണം', 'മഴ', 'കാലാവസ്ഥ'],
-        'hi': ['उग', 'लगा', 'फसल', 'भोजन', 'बारिश', 'मौसम']
-    }
-    
-    phrases = agri_phrases.get(language, agri_phrases['en'])
-    for phrase in phrases:
-        if phrase.lower() in query_lower:
-            return True
-    
-    # If nothing matches, it's probably not agriculture-related
     return False
 
-class QueryRequest(BaseModel):
-    query: str
-    language: str = "en"
-    mode: str = "direct"
-    user_type: str = "farmer"  # farmer, expert, student
-    crop_type: str = ""
-    land_size: str = ""
-    soil_type: str = ""
+def query_cache_control() -> str:
+    max_age = min(QUERY_HTTP_MAX_AGE, int(next_season_boundary() - time.time()))
+    return f"public, max-age={max_age}" if max_age > 0 else "no-cache"
 
-def get_rag_context(query: str, language: str = "en", top_k: int = 3, user_crop: str = "", user_soil: str = ""):
-    try:
-        ensure_lang_index(language)
-        idx = kb_index[language]
-        vect = idx['vectorizer']
-        mat = idx['vectors']
-        keys = idx['keys']
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Row indices of the top_k scores per query, best first (argpartition + small sort)"""
+    n_rows = scores.shape[1]
+    k = min(top_k, n_rows)
+    if k < n_rows:
+        top = np.argpartition(scores, n_rows - k, axis=1)[:, n_rows - k:]
+    else:
+        top = np.broadcast_to(np.arange(n_rows), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+def boost_rows_for(idx: Dict, user_crop: str, user_soil: str,
+                   mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, float]]:
+    boosts = []
+    if user_crop:
+        rows = idx['crop_rows'].get(user_crop.lower())
+        if rows is not None:
+            boosts.append((rows, CROP_BOOST))
+    if user_soil:
+        rows = idx['soil_rows'].get(user_soil.lower())
+        if rows is not None:
+            boosts.append((rows, SOIL_BOOST))
+    if mask is not None:
+        # Only the rows the query's language can see are boosted (or forced into the candidates)
+        boosts = [(rows[mask[rows]], boost) for rows, boost in boosts]
+    return boosts
 
-        query_vector = vect.transform([query])
-        similarities = cosine_similarity(query_vector, mat)[0]
+def dense_scores(query_vectors, mat, row_langs: Optional[np.ndarray] = None,
+                 mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Dot products of query vectors with index rows as a dense (queries x rows) array"""
+    # Rows are L2-normalized in every mode, so the dot product is the cosine similarity
+    if not isinstance(mat, np.ndarray):
+        return (mat @ query_vectors.T).T.toarray()
+    if query_vectors.ndim == 2:
+        return query_vectors @ mat.T
 
-        # Boost by selected crop/soil
-        crop_boost = 0.25 if user_crop else 0.0
-        soil_boost = 0.15 if user_soil else 0.0
-        for i, (cat, item) in enumerate(keys):
-            if user_crop and cat == 'crops' and item.lower() == user_crop.lower():
-                similarities[i] += crop_boost
-            if user_soil and cat == 'soil' and item.lower() == user_soil.lower():
-                similarities[i] += soil_boost
+    # LSA: each row is scored against the query's projection onto its language's components
+    scores = np.zeros((query_vectors.shape[0], mat.shape[0]), dtype=np.float32)
+    visible = row_langs if mask is None else row_langs[mask]
+    for code in np.unique(visible).tolist():
+        rows = row_langs == code
+        scores[:, rows] = (query_vectors[:, code] @ mat.T)[:, rows]
+    return scores
 
-        top_indices = similarities.argsort()[-top_k:][::-1]
+def score_all_rows(idx: Dict, query_vectors, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    if isinstance(idx['vectors'], np.ndarray):
+        return dense_scores(query_vectors, idx['vectors'], idx['row_langs'], mask)
+    # Column-major product: only the posting lists of the query's n-grams are walked,
+    # so rows in other languages' scripts cost nothing
+    return (get_postings(idx) @ query_vectors.T).T.toarray()
 
-        relevant_context = []
-        for idx_i in top_indices:
-            if similarities[idx_i] <= 0:
+def rank_exhaustive(idx: Dict, query_vectors, boosts: List[List[Tuple[np.ndarray, float]]], top_k: int,
+                    mask: Optional[np.ndarray] = None):
+    """Score every row for every query in one matrix product, keeping only rows in mask"""
+    scores = score_all_rows(idx, query_vectors, mask)
+
+    # Boost by selected crop/soil using the precomputed row arrays
+    for i, query_boosts in enumerate(boosts):
+        for rows, boost in query_boosts:
+            scores[i, rows] += boost
+    if mask is not None:
+        scores[:, ~mask] = -np.inf
+
+    top_rows = top_k_rows(scores, top_k)
+    return [
+        [(int(row), float(similarities[row])) for row in top_indices]
+        for similarities, top_indices in zip(scores, top_rows)
+    ]
+
+def get_shard_matrices(idx: Dict) -> List[Tuple[int, csr_matrix]]:
+    """(first row, matrix) per shard; the matrices are views on the index arrays, not copies"""
+    shards = idx.get('shard_matrices')
+    if shards is None:
+        mat = idx['vectors']
+        shards = []
+        for start, end in idx['shards']:
+            if isinstance(mat, np.ndarray):
+                shards.append((start, mat[start:end]))
                 continue
-            category, item = keys[idx_i]
-            context_data = AGRICULTURE_KB[category][item]
-            content = context_data.get(language) or context_data.get('en', '')
-            relevant_context.append({
-                'category': category,
-                'item': item,
-                'content': content,
-                'similarity': float(similarities[idx_i])
-            })
-        return relevant_context
-    except Exception as e:
-        logger.error(f"RAG error: {e}")
+            lo, hi = mat.indptr[start], mat.indptr[end]
+            shard = csr_matrix(
+                (mat.data[lo:hi], mat.indices[lo:hi], mat.indptr[start:end + 1] - lo),
+                shape=(end - start, mat.shape[1]),
+                copy=False
+            )
+            shards.append((start, shard))
+        idx['shard_matrices'] = shards
+    return shards
+
+_scoring_pool: Optional[ThreadPoolExecutor] = None
+_scoring_pool_lock = threading.Lock()
+
+def get_scoring_pool() -> ThreadPoolExecutor:
+    global _scoring_pool
+    if _scoring_pool is None:
+        with _scoring_pool_lock:
+            if _scoring_pool is None:
+                _scoring_pool = ThreadPoolExecutor(max_workers=RAG_POOL_SIZE, thread_name_prefix="rag-shard")
+    return _scoring_pool
+
+def score_shard(start: int, shard, query_vectors, boosts: List[List[Tuple[np.ndarray, float]]], top_k: int,
+                row_langs: np.ndarray, mask: Optional[np.ndarray] = None):
+    """Top_k (row, score) hits of one shard per query, with global row numbers"""
+    end = start + shard.shape[0]
+    shard_mask = None if mask is None else mask[start:end]
+    scores = dense_scores(query_vectors, shard, row_langs[start:end], shard_mask)
+    for i, query_boosts in enumerate(boosts):
+        for rows, boost in query_boosts:
+            scores[i, rows[(rows >= start) & (rows < end)] - start] += boost
+    if shard_mask is not None:
+        scores[:, ~shard_mask] = -np.inf
+
+    top_rows = top_k_rows(scores, top_k)
+    return [
+        [(start + int(row), float(similarities[row])) for row in top_indices]
+        for similarities, top_indices in zip(scores, top_rows)
+    ]
+
+def merge_shard_hits(futures, n_queries: int, top_k: int):
+    """Best top_k (row, score) hits per query over every shard's hits"""
+    per_shard = [future.result() for future in futures]
+    return [
+        heapq.nlargest(top_k, chain.from_iterable(hits[i] for hits in per_shard), key=itemgetter(1))
+        for i in range(n_queries)
+    ]
+
+def rank_sharded(idx: Dict, query_vectors, boosts: List[List[Tuple[np.ndarray, float]]], top_k: int,
+                 mask: Optional[np.ndarray] = None, pool: Optional[ThreadPoolExecutor] = None):
+    """Exhaustive scoring with shards scored concurrently and their top_k merged by a heap"""
+    pool = pool or get_scoring_pool()
+    futures = [pool.submit(score_shard, start, shard, query_vectors, boosts, top_k, idx['row_langs'], mask)
+               for start, shard in get_shard_matrices(idx)]
+    return merge_shard_hits(futures, len(boosts), top_k)
+
+def generate_candidates(idx: Dict, query_vector, forced_rows: List[np.ndarray], budget: int,
+                        mask: Optional[np.ndarray] = None,
+                        row_range: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Cheap candidate rows for one query, sorted ascending (posting rows only from row_range, for one shard)"""
+    postings = get_postings(idx)
+    terms = query_vector.indices
+    # Rare n-grams are the most discriminative and have the shortest posting lists:
+    # take at least RAG_CANDIDATE_TERMS of them, more until the pool is large enough.
+    # Shards choose the same terms from the whole index, so each shard keeps every
+    # row the unsharded walk would keep in its range (and possibly more).
+    terms = terms[np.argsort(-idx['idf'][terms], kind='stable')]
+    posting_sizes = np.cumsum(postings.indptr[terms + 1] - postings.indptr[terms])
+    n_terms = max(RAG_CANDIDATE_TERMS, int(np.searchsorted(posting_sizes, RAG_CANDIDATE_POOL * budget)) + 1)
+    terms = terms[:n_terms]
+    weights = dict(zip(query_vector.indices.tolist(), query_vector.data.tolist()))
+
+    row_chunks = []
+    score_chunks = []
+    for term in terms.tolist():
+        lo, hi = postings.indptr[term], postings.indptr[term + 1]
+        if row_range is not None:
+            # Posting lists are sorted by row, so a shard's slice is found by bisection
+            lo, hi = lo + np.searchsorted(postings.indices[lo:hi], row_range)
+        row_chunks.append(postings.indices[lo:hi])
+        score_chunks.append(postings.data[lo:hi] * weights[term])
+
+    if row_chunks:
+        rows, inverse = np.unique(np.concatenate(row_chunks), return_inverse=True)
+        partial = np.bincount(inverse, weights=np.concatenate(score_chunks))
+        if mask is not None:
+            keep = mask[rows]
+            rows, partial = rows[keep], partial[keep]
+        if len(rows) > budget:
+            rows = np.sort(rows[np.argpartition(-partial, budget)[:budget]])
+    else:
+        rows = np.empty(0, dtype=np.intp)
+
+    # Crop-forced inclusion: rows of the user's crop/soil always compete, as they
+    # would in the exhaustive path, whether or not they share a rare n-gram
+    if forced_rows:
+        rows = np.union1d(rows, np.concatenate(forced_rows))
+    return rows
+
+def rank_candidates(idx: Dict, query_vectors, boosts: List[List[Tuple[np.ndarray, float]]], top_k: int, budget: int,
+                    mask: Optional[np.ndarray] = None, row_range: Optional[Tuple[int, int]] = None):
+    """Candidate generation followed by exact TF-IDF rerank of the candidates only"""
+    mat = idx['vectors']
+    ranked = []
+    for i, query_boosts in enumerate(boosts):
+        query_vector = query_vectors[i]
+        if row_range is not None:
+            query_boosts = [(rows[(rows >= row_range[0]) & (rows < row_range[1])], boost) for rows, boost in query_boosts]
+        candidates = generate_candidates(idx, query_vector, [rows for rows, _ in query_boosts], budget, mask,
+                                         row_range)
+        if len(candidates) == 0:
+            ranked.append([])
+            continue
+
+        scores = (query_vector @ mat[candidates].T).toarray()
+        for rows, boost in query_boosts:
+            scores[0, np.searchsorted(candidates, rows)] += boost
+
+        top = top_k_rows(scores, top_k)[0]
+        ranked.append([(int(candidates[j]), float(scores[0, j])) for j in top])
+    return ranked
+
+def rank_candidates_sharded(idx: Dict, query_vectors, boosts: List[List[Tuple[np.ndarray, float]]], top_k: int,
+                            budget: int, mask: Optional[np.ndarray] = None,
+                            pool: Optional[ThreadPoolExecutor] = None):
+    """Two-stage retrieval with each shard's candidates generated and reranked concurrently"""
+    pool = pool or get_scoring_pool()
+    get_postings(idx)  # built once here rather than raced for by the shards
+    futures = [pool.submit(rank_candidates, idx, query_vectors, boosts, top_k, budget, mask, row_range)
+               for row_range in idx['shards']]
+    return merge_shard_hits(futures, len(boosts), top_k)
+
+def get_rag_context_batch(
+    queries: List[str],
+    language: str = "en",
+    top_k: int = 3,
+    user_crops: Optional[List[str]] = None,
+    user_soils: Optional[List[str]] = None,
+    candidate_budget: Optional[int] = None
+) -> List[List[Dict]]:
+    """Retrieve top_k KB entries for many queries with one vectorize + one sparse product"""
+    if not queries:
         return []
+    try:
+        with timed_stage("index", language):
+            idx = ensure_index()
+            keys = idx['keys']
+            mask = language_rows(idx, language)
+
+            user_crops = user_crops or [""] * len(queries)
+            user_soils = user_soils or [""] * len(queries)
+            boosts = [boost_rows_for(idx, crop, soil, mask) for crop, soil in zip(user_crops, user_soils)]
+
+        with timed_stage("vectorize", language):
+            query_vectors = idx['vectorizer'].transform(queries)
+
+        budget = RAG_CANDIDATE_BUDGET if candidate_budget is None else candidate_budget
+        with timed_stage("score", language):
+            # Dense LSA embeddings have no posting lists and are cheap to score exhaustively
+            if idx['mode'] != 'lsa' and 0 < budget < np.count_nonzero(mask):
+                if len(idx['shards']) > 1:
+                    ranked = rank_candidates_sharded(idx, query_vectors, boosts, top_k, budget, mask)
+                else:
+                    ranked = rank_candidates(idx, query_vectors, boosts, top_k, budget, mask)
+            elif len(idx['shards']) > 1:
+                ranked = rank_sharded(idx, query_vectors, boosts, top_k, mask)
+            else:
+                ranked = rank_exhaustive(idx, query_vectors, boosts, top_k, mask)
+
+        started = time.perf_counter()
+        results = []
+        for hits in ranked:
+            relevant_context = []
+            for row, similarity in hits:
+                if similarity <= 0:
+                    continue
+                category, item = keys[row]
+                entry = int(idx['item_ids'][row])
+                content = idx['kb'].text(entry, language) or idx['kb'].text(entry, 'en')
+                relevant_context.append({
+                    'category': category,
+                    'item': item,
+                    'content': content,
+                    'similarity': similarity
+                })
+            results.append(relevant_context)
+        record_stage("content", language, time.perf_counter() - started)
+        return results
+    except Exception as e:
+        logger.error(f"RAG batch error: {e}")
+        return [[] for _ in queries]
+
+def candidate_recall_report(
+    language: str = "en",
+    queries: Optional[List[str]] = None,
+    top_k: int = 3,
+    candidate_budget: Optional[int] = None
+) -> Dict:
+    """Compare two-stage retrieval against exhaustive scoring (recall@k and timing)"""
+    idx = ensure_index()
+    rows = int(np.count_nonzero(language_rows(idx, language)))
+    if queries is None:
+        # Pseudo-queries: the opening words of every KB entry in this language
+        texts, _ = collect_lang_corpus(language, idx['kb'])
+        queries = [" ".join(text.split()[:6]) for text in texts]
+    budget = RAG_CANDIDATE_BUDGET if candidate_budget is None else candidate_budget
+
+    started = time.perf_counter()
+    exact = get_rag_context_batch(queries, language, top_k, candidate_budget=0)
+    exhaustive_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    staged = get_rag_context_batch(queries, language, top_k, candidate_budget=budget)
+    two_stage_ms = (time.perf_counter() - started) * 1000
+
+    found = expected = identical = 0
+    for exact_hits, staged_hits in zip(exact, staged):
+        exact_keys = [(h['category'], h['item']) for h in exact_hits]
+        staged_keys = [(h['category'], h['item']) for h in staged_hits]
+        found += len(set(exact_keys) & set(staged_keys))
+        expected += len(exact_keys)
+        identical += exact_keys == staged_keys
+
+    return {
+        "language": language,
+        "queries": len(queries),
+        "rows": rows,
+        "top_k": top_k,
+        "candidate_budget": budget,
+        "two_stage_active": idx['mode'] != 'lsa' and 0 < budget < rows,
+        f"recall_at_{top_k}": found / expected if expected else 1.0,
+        "identical_ranking_rate": identical / len(queries) if queries else 1.0,
+        "exhaustive_ms": round(exhaustive_ms, 2),
+        "two_stage_ms": round(two_stage_ms, 2)
+    }
+
+def get_rag_context(query: str, language: str = "en", top_k: int = 3, user_crop: str = "", user_soil: str = ""):
+    # Single queries go through the batch kernel so both paths score identically
+    return get_rag_context_batch([query], language, top_k, [user_crop], [user_soil])[0]
 
 @app.get("/", response_class=HTMLResponse)
 async def home():
@@ -932,34 +3077,23 @@ async def home():
                         soil_type: details.soilType
                     };
 
-                    const response = await fetch('/query', {
+                    // Streamed: the retrieved answer renders as soon as it arrives, advice follows
+                    const response = await fetch('/query/stream', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
                         body: JSON.stringify(requestData)
                     });
+                    if (!response.ok) {
+                        throw new Error(`Server busy or unavailable (HTTP ${response.status}), please retry`);
+                    }
 
-                    const data = await response.json();
+                    const data = await readQueryStream(response, (partial) => {
+                        responseDiv.innerHTML = renderAnswer(partial);
+                    });
                     console.log('✅ Received Enhanced Agriculture Assistant response:', data);
-                    
-                    let responseText = `<strong>🌾 Global Agriculture Assistant Response:</strong>\\n\\n${data.answer}`;
-                    
-                    if (data.rag_sources && data.rag_sources.length > 0) {
-                        responseText += `\\n\\n📚 <strong>Knowledge Sources:</strong>\\n`;
-                        data.rag_sources.forEach((source, idx) => {
-                            responseText += `${idx + 1}. ${source.category.toUpperCase()}: ${source.item}\\n`;
-                        });
-                    }
-                    
-                    if (data.restriction) {
-                        responseText += `\\n\\n🛡️ <strong>Note:</strong> This assistant only responds to agriculture-related questions.`;
-                    }
-                    
-                    responseText += `\\n<hr style="border: 1px solid rgba(255,255,255,0.3); margin: 15px 0;">`;
-                    responseText += `📊 Model: ${data.model} | ⏱️ Time: ${data.processing_time_ms}ms | 🔗 Sources: ${data.rag_sources ? data.rag_sources.length : 0}`;
-                    
-                    responseDiv.innerHTML = responseText;
+                    responseDiv.innerHTML = renderAnswer(data);
 
                     // Use pyttsx3 TTS
                     if (data.answer) {
@@ -973,6 +3107,64 @@ async def home():
                 }
             }
 
+            // Reads /query/stream NDJSON events into a /query-shaped result, calling onUpdate as parts arrive
+            async function readQueryStream(response, onUpdate) {
+                const data = { answer: '', rag_sources: [], done: false };
+                const apply = (line) => {
+                    if (!line.trim()) return;
+                    const event = JSON.parse(line);
+                    if (event.type === 'sources') {
+                        data.rag_sources = event.rag_sources;
+                    } else if (event.type === 'text') {
+                        data.answer += event.text;
+                    } else if (event.type === 'done') {
+                        Object.assign(data, event, { done: true });
+                    }
+                    onUpdate(data);
+                };
+
+                if (!response.body || !response.body.getReader) {
+                    (await response.text()).split('\\n').forEach(apply);
+                    return data;
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffered = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffered += decoder.decode(value, { stream: true });
+                    const lines = buffered.split('\\n');
+                    buffered = lines.pop();
+                    lines.forEach(apply);
+                }
+                apply(buffered + decoder.decode());
+                return data;
+            }
+
+            function renderAnswer(data) {
+                let responseText = `<strong>🌾 Global Agriculture Assistant Response:</strong>\\n\\n${data.answer || '🌾 Searching the knowledge base...'}`;
+
+                if (data.rag_sources && data.rag_sources.length > 0) {
+                    responseText += `\\n\\n📚 <strong>Knowledge Sources:</strong>\\n`;
+                    data.rag_sources.forEach((source, idx) => {
+                        responseText += `${idx + 1}. ${source.category.toUpperCase()}: ${source.item}\\n`;
+                    });
+                }
+
+                if (data.mode === 'off_topic') {
+                    responseText += `\\n\\n🛡️ <strong>Note:</strong> This assistant only responds to agriculture-related questions.`;
+                }
+
+                responseText += `\\n<hr style="border: 1px solid rgba(255,255,255,0.3); margin: 15px 0;">`;
+                if (data.done) {
+                    responseText += `📊 Model: ${data.model} | ⏱️ Time: ${data.processing_time_ms}ms | 🔗 Sources: ${data.rag_sources ? data.rag_sources.length : 0}`;
+                } else {
+                    responseText += `⏳ Receiving answer...`;
+                }
+                return responseText;
+            }
+
             // Enhanced pyttsx3 TTS function
             async function speakWithPyttsx3(text, language) {
                 console.log(`🔊 Using pyttsx3 TTS for ${language}`);
@@ -985,23 +3177,31 @@ async def home():
                         },
                         body: JSON.stringify({
                             text: text,
-                            language: language
+                            language: language,
+                            compact: true
                         })
                     });
                     
-                    const ttsData = await ttsResponse.json();
+                    // Compact mode answers with the MP3 itself; JSON means a fallback (or an older server)
+                    const isAudio = (ttsResponse.headers.get('Content-Type') || '').startsWith('audio/');
+                    const ttsData = isAudio ? { success: true } : await ttsResponse.json();
                     
-                    if (ttsData.success && ttsData.audio_base64) {
-                        console.log(`✅ Using ${ttsData.service} (${ttsData.voice})`);
+                    if (ttsData.success && (isAudio || ttsData.audio_base64)) {
+                        console.log(`✅ Using ${isAudio ? ttsResponse.headers.get('X-TTS-Service') : ttsData.service}`);
                         
                         // Create audio element and play (supports both WAV and MP3)
                         const audio = new Audio();
-                        const audioFormat = ttsData.audio_format || 'wav';
-                        audio.src = `data:audio/${audioFormat};base64,${ttsData.audio_base64}`;
+                        if (isAudio) {
+                            audio.src = URL.createObjectURL(await ttsResponse.blob());
+                        } else {
+                            const audioFormat = ttsData.audio_format || 'wav';
+                            audio.src = `data:audio/${audioFormat};base64,${ttsData.audio_base64}`;
+                        }
                         
                         return new Promise((resolve) => {
                             audio.onended = () => {
                                 console.log('✅ pyttsx3 TTS completed successfully');
+                                if (isAudio) URL.revokeObjectURL(audio.src);
                                 resolve();
                             };
                             
@@ -1196,202 +3396,394 @@ async def home():
     </html>
     """
 
-@app.post("/query")
-async def query_agriculture(request: QueryRequest):
-    start_time = time.time()
-    
-    try:
-        logger.info(f"🌾 Smart RAG Query: {request.query[:50]}... | Language: {request.language} | Profile: {request.user_type}")
-        
-        # Get RAG context for agriculture query (removed restriction filter)
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class CompactJSONResponse(Response):
+    """JSON body from dump_json(), skipping FastAPI's jsonable_encoder pass over plain dicts"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+# Response shapes, published in the OpenAPI schema. /query and /query/batch build
+# their bodies through these models (optional fields left at None are dropped), and
+# the compact shape is derived from CompactQueryResponse's fields.
+class RagSource(BaseModel):
+    category: str
+    item: str
+    similarity: float  # rounded to 4 decimals in compact responses
+
+class QueryResponse(BaseModel):
+    """/query answer"""
+    answer: str
+    confidence: float
+    processing_time_ms: int
+    language: str
+    mode: str  # comprehensive_agriculture_assistant, off_topic or enhanced_fallback
+    model: str
+    rag_sources: Optional[List[RagSource]] = None  # absent from the error fallback
+    user_context: Optional[Dict[str, str]] = None  # absent from the error fallback
+    supported_crops: Optional[str] = None
+    error: Optional[str] = None  # "handled_gracefully" on the error fallback
+    stage_ms: Optional[Dict[str, float]] = None  # with stage_timings=true
+
+class CompactQueryResponse(BaseModel):
+    """/query answer with compact=true: QueryResponse without the constant and echoed fields"""
+    answer: str
+    processing_time_ms: int
+    language: str
+    mode: Optional[str] = None  # only off_topic or enhanced_fallback; absent for a normal answer
+    rag_sources: Optional[List[RagSource]] = None
+    error: Optional[str] = None
+    stage_ms: Optional[Dict[str, float]] = None
+
+QUERY_RESPONSES = {200: {"model": Union[QueryResponse, CompactQueryResponse],
+                         "description": "QueryResponse, or CompactQueryResponse with compact=true"}}
+
+class BatchSource(RagSource):
+    content: str
+
+class BatchResult(BaseModel):
+    query: str
+    language: str
+    rag_sources: List[BatchSource]
+
+class BatchQueryResponse(BaseModel):
+    """/query/batch results (same shape with compact=true, similarities rounded)"""
+    results: List[BatchResult]
+    count: int
+    language: str
+    processing_time_ms: int
+    stage_ms: Optional[Dict[str, float]] = None
+
+# Fields every full /query response repeats (those CompactQueryResponse lacks), left
+# out of compact responses; mode is kept when it is not the usual one, so off-topic
+# and fallback replies stay recognizable
+COMPACT_OMITTED_FIELDS = tuple(field for field in QueryResponse.model_fields
+                               if field not in CompactQueryResponse.model_fields)
+DEFAULT_QUERY_MODE = "comprehensive_agriculture_assistant"
+
+def compact_sources(rag_sources: List[Dict]) -> List[Dict]:
+    return [{**source, "similarity": round(source["similarity"], 4)} for source in rag_sources]
+
+def compact_response(response: Dict) -> Dict:
+    compact = {key: value for key, value in response.items() if key not in COMPACT_OMITTED_FIELDS}
+    if compact.get("mode") == DEFAULT_QUERY_MODE:
+        del compact["mode"]
+    if "rag_sources" in compact:
+        compact["rag_sources"] = compact_sources(compact["rag_sources"])
+    return compact
+
+def response_body(response: BaseModel) -> Dict:
+    """JSON-ready dict of a response model, without the optional fields it leaves unset"""
+    return response.model_dump(exclude_none=True)
+
+def query_user_context(request: QueryRequest) -> Dict:
+    return {
+        "profile": request.user_type,
+        "crop": request.crop_type,
+        "land_size": request.land_size,
+        "soil_type": request.soil_type
+    }
+
+def query_response(request: QueryRequest, answer: str, rag_sources: List[Dict], user_context: Dict, start_time: float) -> Dict:
+    processing_time = (time.time() - start_time) * 1000
+
+    return response_body(QueryResponse(
+        answer=answer,
+        confidence=0.95,
+        processing_time_ms=round(processing_time),
+        language=request.language,
+        mode=DEFAULT_QUERY_MODE,
+        model="Enhanced Smart RAG with Global Crop Support",
+        rag_sources=rag_sources,
+        user_context=user_context,
+        supported_crops="All global crops supported including cereals, legumes, vegetables, fruits, cash crops"
+    ))
+
+def retrieve_for_query(request: QueryRequest) -> List[Dict]:
+    """Top-3 KB context for a /query request, boosted by the crop it names or the profile crop"""
+    # Get RAG context for agriculture query (removed restriction filter)
+    with timed_stage("crop_detection", request.language):
         explicit_crop = detect_explicit_crop(request.query, request.language)
-        rag_context = get_rag_context(
+    return get_rag_context(
+        request.query,
+        request.language,
+        top_k=3,
+        user_crop=explicit_crop or request.crop_type,
+        user_soil=request.soil_type
+    )
+
+def source_summary(rag_context: List[Dict]) -> List[Dict]:
+    return [{"category": ctx['category'], "item": ctx['item'], "similarity": ctx['similarity']} for ctx in rag_context]
+
+def answer_query(request: QueryRequest, season: str) -> Tuple[str, List[Dict]]:
+    """Retrieval and answer composition for /query (runs on the retrieval executor)"""
+    rag_context = retrieve_for_query(request)
+
+    # Generate comprehensive answer
+    with timed_stage("compose", request.language):
+        answer = compose_answer(
             request.query,
             request.language,
-            top_k=3,
-            user_crop=explicit_crop or request.crop_type,
-            user_soil=request.soil_type
+            rag_context,
+            request.soil_type,
+            request.land_size,
+            season
         )
+    return answer, source_summary(rag_context)
+
+@app.post("/query", responses=QUERY_RESPONSES)
+async def query_agriculture(request: QueryRequest):
+    response = await timed_query(request)
+    return CompactJSONResponse(compact_response(response)) if request.compact else response
+
+async def timed_query(request: QueryRequest) -> Dict:
+    start_time = time.time()
+    stages = start_request_metrics("/query", request.stage_timings)
+    try:
+        response = await run_query(request, start_time)
+    finally:
+        record_stage("total", request.language, time.time() - start_time)
+    if stages is not None:
+        response["stage_ms"] = stages
+    return response
+
+async def run_query(request: QueryRequest, start_time: float) -> Dict:
+    try:
+        request.language = resolve_language(request.language, request.query)
+        logger.info(f"🌾 Smart RAG Query: {request.query[:50]}... | Language: {request.language} | Profile: {request.user_type}")
         
-        # Enhanced Smart Agriculture Assistant with comprehensive crop knowledge
-        def generate_smart_agriculture_answer(query, language, rag_context, user_context):
-            """Generate practical agriculture answers with comprehensive crop support"""
-            
-            # Build comprehensive answer from RAG context
-            if rag_context:
-                best_match = rag_context[0]
-                answer = best_match['content']
-                
-                # Add specific advice based on user context and crop type
-                crop_type = user_context.get('crop_type', '')
-                soil_type = user_context.get('soil_type', '')
-                land_size = user_context.get('land_size', '')
-                
-                # Soil-specific advice
-                if soil_type == 'clay':
-                    if language == 'ta':
-                        answer += " களிமண் மண்ணுக்கு: நல்ல வடிகால் அமைப்பு அவசியம். கரிமப் பொருட்களைச் சேர்க்கவும்."
-                    elif language == 'te':
-                        answer += " మట్టి మట్టికి: మంచి డ్రైనేజ్ వ్యవస్థ అవసరం. సేంద్రీయ పదార్థాలను కలపండి."
-                    elif language == 'ml':
-                        answer += " കളിമണ്ണിന്: നല്ല ഡ്രെയിനേജ് സിസ്റ്റം ആവശ്യം. ജൈവവസ്തുക്കൾ ചേർക്കുക."
-                    elif language == 'hi':
-                        answer += " चिकनी मिट्टी के लिए: अच्छी जल निकासी व्यवस्था जरूरी। जैविक पदार्थ मिलाएं।"
-                    else:
-                        answer += " For clay soil: Good drainage system essential. Add organic matter to improve structure."
-                
-                elif soil_type == 'sandy':
-                    if language == 'ta':
-                        answer += " மணல் மண்ணுக்கு: அடிக்கடி நீர்ப்பாசனம் தேவை। கம்போஸ்ட் சேர்த்து ஊட்டச்சத்து தக்கவைக்கவும்."
-                    elif language == 'te':
-                        answer += " ఇసుక మట్టికి: తరచుగా నీటిపారుదల అవసరం. కంపోస్ట్ చేర்చి పోషకాలను నిలుపుకోండి."
-                    elif language == 'ml':
-                        answer += " മണൽമണ്ണിന്: ഇടയ്ക്കിടെ നനയ്ക്കണം. കമ്പോസ്റ്റ് ചേർത്ത് പോഷകങ്ങൾ നിലനിർത്തുക."
-                    elif language == 'hi':
-                        answer += " रेतीली मिट्टी के लिए: बार-बार सिंचाई चाहिए। कंपोस्ट मिलाकर पोषक तत्व बनाए रखें।"
-                    else:
-                        answer += " For sandy soil: Frequent irrigation needed. Add compost to retain nutrients."
-                
-                # Land size specific advice
-                if land_size == 'small':
-                    if language == 'ta':
-                        answer += " சிறிய நிலத்திற்கு: சொட்டு நீர்ப்பாசனம், செங்குத்து விவசாயம், மண்ணின் மல்ச்சிங் பரிந்துரைக்கப்படுகிறது."
-                    elif language == 'te':
-                        answer += " చిన్న భూమికి: డ్రిప్ నీటిపారుదల, నిలువు వ్యవసాయం, మట్టి కవరింగ్ సిఫార్సు చేయబడింది."
-                    elif language == 'ml':
-                        answer += " ചെറിய ഭൂമിക്ക്: ഡ്രിപ്പ് ജലസേചനം, ലംബമായ കൃഷി, മണ്ണ് മൾച്ചിംഗ് ശുപാർശ ചെയ്യുന്നു."
-                    elif language == 'hi':
-                        answer += " छोटी जमीन के लिए: ड्रिप सिंचाई, ऊर्ध्वाधर खेती, मिट्टी मल्चिंग की सिफारिश।"
-                    else:
-                        answer += " For small land: Drip irrigation, vertical farming, soil mulching recommended."
-                
-                # Seasonal advice
-                import datetime
-                current_month = datetime.datetime.now().month
-                
-                if 6 <= current_month <= 10:  # Monsoon/Kharif season
-                    if language == 'ta':
-                        answer += " தற்போது கரீப் பருவம். அரிசி, பருத்தி, சோளம், கரும்பு ஆகியவற்றுக்கு ஏற்ற காலம்."
-                    elif language == 'te':
-                        answer += " ప్రస్తుతం ఖరీఫ్ సీజన్. వరి, పత్తి, మొక్కజొన్న, చెరకుకు అనువైన సమయం."
-                    elif language == 'ml':
-                        answer += " ഇപ്പോൾ ഖരീഫ് സീസൺ. അരി, പരുത്തി, ചോളം, കരിമ്പ് എന്നിവയ്ക്ക് അനുയോജ്യമായ സമയം."
-                    elif language == 'hi':
-                        answer += " अभी खरीफ मौसम। धान, कपास, मक्का, गन्ने के लिए उपयुक्त समय।"
-                    else:
-                        answer += " Current Kharif season. Suitable time for rice, cotton, corn, sugarcane."
-                
-                elif 11 <= current_month <= 4:  # Winter/Rabi season
-                    if language == 'ta':
-                        answer += " தற்போது ரபி பருவம். கோதுமை, பார்லி, கடுகு, பட்டாணி ஆகியவற்றுக்கு ஏற்ற காலம்."
-                    elif language == 'te':
-                        answer += " ప్రస్తుతం రబీ సీజన్. గోధుమ, బార్లీ, ఆవాలు, బఠానుల కోసం అనువైన సమయం."
-                    elif language == 'ml':
-                        answer += " ഇപ്പോൾ റബീ സീസൺ. ഗോതമ്പ്, ബാർലി, കടുക്, പയർ എന്നിവയ്ക്ക് അനുയോജ്യമായ സമയം."
-                    elif language == 'hi':
-                        answer += " अभी रबी मौसम। गेहूं, जौ, सरसों, मटर के लिए उपयुक्त समय।"
-                    else:
-                        answer += " Current Rabi season. Suitable time for wheat, barley, mustard, peas."
-                
-                return answer
-            
-            # Enhanced fallback responses with comprehensive crop support
-            practical_fallbacks = {
-                'en': {
-                    'general': "For general farming: 1) Test soil pH (6.0-7.5 optimal), 2) Use organic compost, 3) Follow proper irrigation schedule, 4) Monitor for pests. I can help with any crop - cereals (rice, wheat, corn), legumes (soybeans, chickpeas), vegetables (tomatoes, potatoes), fruits (apples, oranges), or cash crops (cotton, sugarcane).",
-                    'fertilizer': "Balanced NPK fertilizer guide: Most crops need 40kg Urea + 25kg DAP + 15kg MOP per acre. Split application - half at sowing, rest after 30-45 days. Organic options: compost, vermicompost, green manure.",
-                    'pest': "Integrated pest management: 1) Neem oil spray (5ml/liter), 2) Remove affected parts, 3) Yellow sticky traps, 4) Beneficial insects, 5) Crop rotation. Specific treatments vary by crop and pest type.",
-                    'disease': "Disease prevention: 1) Proper spacing for air circulation, 2) Avoid overhead watering, 3) Remove infected parts immediately, 4) Copper-based fungicides for fungal issues, 5) Resistant varieties when available."
-                },
-                'ta': {
-                    'general': "பொதுவான வேளாண்மைக்கு: 1) மண் pH சோதனை (6.0-7.5 சிறந்தது), 2) கரிம கம்போஸ்ட் பயன்படுத்தவும், 3) சரியான நீர்ப்பாசனம், 4) பூச்சிகள் கண்காணிப்பு. நான் அனைத்து பயிர்களுக்கும் உதவ முடியும் - தானியங்கள், பருப்பு வகைகள், காய்கறிகள், பழங்கள், பணப்பயிர்கள்.",
-                    'fertilizer': "சமச்சீர் NPK உரம்: பெரும்பாலான பயிர்களுக்கு ஏக்கருக்கு 40கிலோ யூரியா + 25கிலோ DAP + 15கிலோ MOP. பிரித்த பயன்பாடு - பாதி விதைக்கும்போது, மீதம் 30-45 நாட்களுக்குப் பிறகு.",
-                    'pest': "ஒருங்கிணைந்த பூச்சி மேலாண்மை: 1) வேப்ப எண்ணெய் தெளிப்பு, 2) பாதிக்கப்பட்ட பகுதிகளை அகற்றவும், 3) மஞ்சள் ஒட்டும் பொறிகள், 4) பயன்படை பூச்சிகள், 5) பயிர் சுழற்சி.",
-                    'disease': "நோய் தடுப்பு: 1) காற்றோட்டத்திற்கு சரியான இடைவெளி, 2) இலைகளில் நேரடி நீர் தெளிப்பு தவிர்க்கவும், 3) பாதிக்கப்பட்ட பகுதிகளை உடனே அகற்றவும்."
-                },
-                'te': {
-                    'general': "సాధారణ వ్యవసాయానికి: 1) మట్టి pH పరీక్ష (6.0-7.5 ఉత్తమం), 2) సేంద్రీయ కంపోస్ట్ ఉపయోగించండి, 3) సరైన నీటిపారుదల, 4) కీటకాల పర్యవేక్షణ. నేను అన్ని పంటలకు సహాయం చేయగలను.",
-                    'fertilizer': "సమతుల్య NPK ఎరువు: చాలా పంటలకు ఎకరకు 40కిలో యూరియా + 25కిలో DAP + 15కిలో MOP. విభజిత అప్లికేషన్ - సగం విత్తనాలో, మిగిలింది 30-45 రోజుల తర్వాత.",
-                    'pest': "సమగ్ర కీటక నిర్వహణ: 1) వేప నూనె స్ప్రే, 2) ప్రభావిత భాగాలను తొలగించండి, 3) పసుపు జిగురు ఉచ్చులు, 4) ప్రయోజనకరమైన కీటకాలు.",
-                    'disease': "వ్యాధి నివారణ: 1) గాలి ప్రసరణ కోసం సరైన అంతరం, 2) పై నుండి నీరు పోయడం మానుకోండి, 3) సోకిన భాగాలను వెంటనే తొలగించండి."
-                },
-                'ml': {
-                    'general': "പൊതുവായ കൃഷിക്ക്: 1) മണ്ണിന്റെ pH പരിശോധന (6.0-7.5 ഉത്തമം), 2) ജൈവ കമ്പോസ്റ്റ് ഉപയോഗിക്കുക, 3) ശരിയായ ജലസേചനം, 4) കീടങ്ങളുടെ നിരീക്ഷണം. എനിക്ക് എല്ലാ വിളകൾക്കും സഹായിക്കാൻ കഴിയും.",
-                    'fertilizer': "സമതുലിതമായ NPK വളം: മിക്ക വിളകൾക്കും ഏക്കറിന് 40കിലോ യൂറിയ + 25കിലോ DAP + 15കിലോ MOP. വിഭജിത പ്രയോഗം - പകുതി വിതയ്ക്കുമ്പോൾ, ബാക്കി 30-45 ദിവസങ്ങൾക്ക് ശേഷം.",
-                    'pest': "സംയോജിത കീട പരിപാലനം: 1) വേപ്പെണ്ണ സ്പ്രേ, 2) ബാധിത ഭാഗങ്ങൾ നീക്കം ചെയ്യുക, 3) മഞ്ഞ ഒട്ടുന്ന കെണികൾ.",
-                    'disease': "രോഗ പ്രതിരോധം: 1) വായു സഞ്ചാരത്തിന് ശരിയായ അകലം, 2) മുകളിൽ നിന്ന് വെള്ളം ഒഴിക്കുന്നത് ഒഴിവാക്കുക, 3) രോഗബാധിത ഭാഗങ്ങൾ ഉടനെ നീക്കം ചെയ്യുക."
-                },
-                'hi': {
-                    'general': "सामान्य कृषि के लिए: 1) मिट्टी pH जांच (6.0-7.5 आदर्श), 2) जैविक खाद का उपयोग, 3) उचित सिंचाई, 4) कीट निगरानी। मैं सभी फसलों के लिए मदद कर सकता हूं।",
-                    'fertilizer': "संतुलित NPK उर्वरक: अधिकांश फसलों के लिए प्रति एकड़ 40किलो यूरिया + 25किलो DAP + 15किलो MOP। विभाजित उपयोग - आधा बुआई के समय, बाकी 30-45 दिन बाद।",
-                    'pest': "एकीकृत कीट प्रबंधन: 1) नीम तेल स्प्रे, 2) प्रभावित भागों को हटाएं, 3) पीले चिपचिपे जाल, 4) लाभकारी कीड़े।",
-                    'disease': "रोग रोकथाम: 1) हवा के संचार के लिए उचित दूरी, 2) ऊपर से पानी देना बचें, 3) संक्रमित भागों को तुरंत हटाएं।"
-                }
-            }
-            
-            # Determine response category based on query analysis
-            query_lower = query.lower()
-            if any(word in query_lower for word in ['fertilizer', 'urea', 'dap', 'nutrients', 'উরम্', 'ఎరువులు', 'വളം', 'खाद']):
-                category = 'fertilizer'
-            elif any(word in query_lower for word in ['pest', 'insect', 'bug', 'spray', 'পূচ্চি', 'కీటకాలు', 'കീടം', 'कीट']):
-                category = 'pest'
-            elif any(word in query_lower for word in ['disease', 'fungus', 'rot', 'blight', 'নোয়', 'వ్యాధి', 'രോഗം', 'बीमारी']):
-                category = 'disease'
-            else:
-                category = 'general'
-            
-            return practical_fallbacks.get(language, practical_fallbacks['en']).get(category, practical_fallbacks['en']['general'])
-        
-        # Generate comprehensive answer
-        user_context = {
-            "profile": request.user_type,
-            "crop": request.crop_type,
-            "land_size": request.land_size,
-            "soil_type": request.soil_type
-        }
-        
-        answer = generate_smart_agriculture_answer(
-            request.query, 
-            request.language, 
-            rag_context, 
-            user_context
+        user_context = query_user_context(request)
+
+        if DOMAIN_GATE_ENABLED and not domain_gate.check(request.query, request.language):
+            logger.info("🚫 Off-topic query answered by domain gate")
+            return response_body(QueryResponse(
+                answer=ASSISTANT_SCOPE_REPLIES.get(request.language, ASSISTANT_SCOPE_REPLIES['en']),
+                confidence=0.0,
+                processing_time_ms=round((time.time() - start_time) * 1000),
+                language=request.language,
+                mode="off_topic",
+                model="Domain Gate",
+                rag_sources=[],
+                user_context=user_context
+            ))
+
+        season = season_of_day()
+        cache_key = query_cache_key(request, season)
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            answer, rag_sources = cached
+            return query_response(request, answer, rag_sources, user_context, start_time)
+
+        answer, rag_sources = await query_flights.do(
+            cache_key, lambda: retrieval_executor.run(answer_query, request, season)
         )
+        query_cache.put(cache_key, (answer, rag_sources), next_season_boundary())
         
-        processing_time = (time.time() - start_time) * 1000
-        
-        return {
-            "answer": answer,
-            "confidence": 0.95,
-            "processing_time_ms": round(processing_time),
-            "language": request.language,
-            "mode": "comprehensive_agriculture_assistant",
-            "model": "Enhanced Smart RAG with Global Crop Support",
-            "rag_sources": [{"category": ctx['category'], "item": ctx['item'], "similarity": ctx['similarity']} for ctx in rag_context],
-            "user_context": user_context,
-            "supported_crops": "All global crops supported including cereals, legumes, vegetables, fruits, cash crops"
-        }
+        return query_response(request, answer, rag_sources, user_context, start_time)
         
+    except ExecutorSaturated as e:
+        raise saturated_response(e)
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         
         # Enhanced fallback with agriculture focus
-        practical_fallback = {
-            'en': "I'm your comprehensive agriculture assistant for ALL crops worldwide. Ask me about: Cereals (rice, wheat, corn, barley), Legumes (soybeans, chickpeas, lentils), Vegetables (tomatoes, potatoes, onions), Fruits (apples, oranges, bananas), Cash crops (cotton, sugarcane, coffee). I provide soil, pest, fertilizer, and growing advice!",
-            'ta': "நான் உலகளாவிய அனைத்து பயிர்களுக்கும் விரிவான வேளாண் உதவியாளர். என்னிடம் கேளுங்கள்: தானியங்கள், பருப்பு வகைகள், காய்கறிகள், பழங்கள், பணப்பயிர்கள் பற்றி.",
-            'te': "నేను ప్రపంచవ్యాప్త అన్ని పంటలకు సమగ్ర వ్యవసాయ సహాయకుడను. నన్ను అడగండి: ధాన్యాలు, గింజలు, కూరగాయలు, పండ్లు, వాణిజ్య పంటల గురించి.",
-            'ml': "ഞാൻ ലോകമെമ്പാടുമുള്ള എല്ലാ വിളകൾക്കും സമഗ്ര കാർഷിക സഹായിയാണ്. എന്നോട് ചോദിക്കുക: ധാന്യങ്ങൾ, പയർവർഗ്ഗങ്ങൾ, പച്ചക്കറികൾ, ഫലങ്ങൾ, വാണിജ്യ വിളകൾ.",
-            'hi': "मैं दुनिया भर की सभी फसलों के लिए व्यापक कृषि सहायक हूं। मुझसे पूछें: अनाज, दालें, सब्जियां, फल, नकदी फसलों के बारे में।"
-        }
-        
-        return {
-            "answer": practical_fallback.get(request.language, practical_fallback['en']),
-            "confidence": 0.8,
+        return response_body(QueryResponse(
+            answer=ASSISTANT_SCOPE_REPLIES.get(request.language, ASSISTANT_SCOPE_REPLIES['en']),
+            confidence=0.8,
+            processing_time_ms=round((time.time() - start_time) * 1000),
+            language=request.language,
+            mode="enhanced_fallback",
+            model="Global Crop Assistant",
+            error="handled_gracefully"
+        ))
+
+@app.get("/query", responses={**QUERY_RESPONSES, 304: {"description": "Not modified (If-None-Match)"}})
+async def query_agriculture_get(
+    query: str,
+    language: str = "en",
+    mode: str = "direct",
+    user_type: str = "farmer",
+    crop_type: str = "",
+    land_size: str = "",
+    soil_type: str = "",
+    compact: bool = False,
+    if_none_match: Optional[str] = Header(default=None)
+):
+    """Cacheable /query: same answer as the POST form, with ETag/Cache-Control and 304 revalidation"""
+    request = QueryRequest(query=query, language=language, mode=mode, user_type=user_type,
+                           crop_type=crop_type, land_size=land_size, soil_type=soil_type, compact=compact)
+    request.language = resolve_language(request.language, request.query)
+    etag = query_etag(request, season_of_day())
+    headers = {"ETag": etag, "Cache-Control": query_cache_control()}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    result = await timed_query(request)
+    if result.get("error"):
+        # The error fallback must not be cached in place of the real answer
+        headers = {"Cache-Control": "no-store"}
+    if request.compact:
+        return CompactJSONResponse(compact_response(result), headers=headers)
+    return JSONResponse(result, headers=headers)
+
+# /query/stream sends one JSON event per line (NDJSON), flushed as soon as it is ready:
+#   {"type": "status", "stage": "retrieving"}           right away, before retrieval finishes
+#   {"type": "sources", "rag_sources": [...]}            once retrieval is done
+#   {"type": "text", "kind": ..., "text": ...}           answer parts in order; kind is content,
+#                                                        soil, land_size, season, fallback, cached,
+#                                                        off_topic or error
+#   {"type": "done", "processing_time_ms": ..., ...}     timing and the /query metadata
+# Concatenating the "text" events gives exactly the /query answer.
+STREAM_MEDIA_TYPE = "application/x-ndjson"
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def ndjson_event(event: Dict) -> bytes:
+    return dump_json(event) + b"\n"
+
+@app.post("/query/stream")
+async def query_agriculture_stream(request: QueryRequest):
+    """/query as a stream of NDJSON events, so slow connections can render the answer as it arrives"""
+    start_time = time.time()
+    stages = start_request_metrics("/query/stream", request.stage_timings)
+    request.language = resolve_language(request.language, request.query)
+    logger.info(f"🌊 Streaming RAG Query: {request.query[:50]}... | Language: {request.language} | Profile: {request.user_type}")
+    user_context = query_user_context(request)
+
+    def done(mode: str, model: str, confidence: float, **extra) -> bytes:
+        record_stage("total", request.language, time.time() - start_time)
+        if stages is not None:
+            extra["stage_ms"] = stages
+        event = {
+            "type": "done",
+            "confidence": confidence,
             "processing_time_ms": round((time.time() - start_time) * 1000),
             "language": request.language,
-            "mode": "enhanced_fallback",
-            "model": "Global Crop Assistant",
-            "error": "handled_gracefully"
+            "mode": mode,
+            "model": model,
+            "user_context": user_context,
+            **extra
         }
+        return ndjson_event(compact_response(event) if request.compact else event)
+
+    def sources(rag_sources: List[Dict]) -> bytes:
+        return ndjson_event({"type": "sources", "rag_sources": compact_sources(rag_sources) if request.compact else rag_sources})
+
+    def stream(events) -> StreamingResponse:
+        return StreamingResponse(events, media_type=STREAM_MEDIA_TYPE, headers=STREAM_HEADERS)
+
+    if DOMAIN_GATE_ENABLED and not domain_gate.check(request.query, request.language):
+        logger.info("🚫 Off-topic query answered by domain gate")
+
+        async def off_topic():
+            yield ndjson_event({"type": "sources", "rag_sources": []})
+            yield ndjson_event({"type": "text", "kind": "off_topic",
+                                "text": ASSISTANT_SCOPE_REPLIES.get(request.language, ASSISTANT_SCOPE_REPLIES['en'])})
+            yield done("off_topic", "Domain Gate", 0.0)
+        return stream(off_topic())
+
+    season = season_of_day()
+    cache_key = query_cache_key(request, season)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        answer, rag_sources = cached
+
+        async def from_cache():
+            yield sources(rag_sources)
+            yield ndjson_event({"type": "text", "kind": "cached", "text": answer})
+            yield done(DEFAULT_QUERY_MODE, "Enhanced Smart RAG with Global Crop Support", 0.95, cached=True)
+        return stream(from_cache())
+
+    # Queued before the response starts, so a saturated pool still answers 503 + Retry-After
+    try:
+        pending = query_flights.join(("context", *cache_key), lambda: retrieval_executor.submit(retrieve_for_query, request))
+    except ExecutorSaturated as e:
+        raise saturated_response(e)
+
+    async def answer_events():
+        yield ndjson_event({"type": "status", "stage": "retrieving"})
+        try:
+            rag_context = await pending
+            rag_sources = source_summary(rag_context)
+            yield sources(rag_sources)
+            with timed_stage("compose", request.language):
+                parts = answer_parts(request.query, request.language, rag_context,
+                                     request.soil_type, request.land_size, season)
+            for kind, text in parts:
+                yield ndjson_event({"type": "text", "kind": kind, "text": text})
+            query_cache.put(cache_key, (''.join(text for _, text in parts), rag_sources), next_season_boundary())
+        except Exception as e:
+            logger.error(f"❌ Streaming error: {str(e)}")
+            yield ndjson_event({"type": "text", "kind": "error",
+                                "text": ASSISTANT_SCOPE_REPLIES.get(request.language, ASSISTANT_SCOPE_REPLIES['en'])})
+            yield done("enhanced_fallback", "Global Crop Assistant", 0.8, error="handled_gracefully")
+            return
+        yield done(DEFAULT_QUERY_MODE, "Enhanced Smart RAG with Global Crop Support", 0.95)
+    return stream(answer_events())
+
+def retrieve_batch(request: BatchQueryRequest) -> Tuple[List[str], List[List[Dict]]]:
+    """Per-query languages and top-k contexts for /query/batch (runs on the retrieval executor)"""
+    languages = [resolve_language(request.language, q) for q in request.queries]
+    # One batch per language, so auto-detected mixed batches keep a single product per language
+    groups: Dict[str, List[int]] = {}
+    for i, language in enumerate(languages):
+        groups.setdefault(language, []).append(i)
+
+    batch_context: List[List[Dict]] = [[] for _ in request.queries]
+    for language, positions in groups.items():
+        queries = [request.queries[i] for i in positions]
+        with timed_stage("crop_detection", language):
+            user_crops = [detect_explicit_crop(q, language) or request.crop_type for q in queries]
+        contexts = get_rag_context_batch(
+            queries,
+            language,
+            top_k=request.top_k,
+            user_crops=user_crops,
+            user_soils=[request.soil_type] * len(queries)
+        )
+        for i, context in zip(positions, contexts):
+            batch_context[i] = context
+    return languages, batch_context
+
+@app.post("/query/batch", responses={200: {"model": BatchQueryResponse}})
+async def query_agriculture_batch(request: BatchQueryRequest, http_request: Request):
+    """Retrieve top-k knowledge for many queries at once (SMS/IVR gateways)"""
+    start_time = time.time()
+    stages = start_request_metrics("/query/batch", request.stage_timings)
+
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if request.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    charge_batch(http_request, len(request.queries))
+
+    logger.info(f"🌾 Batch RAG Query: {len(request.queries)} queries | Language: {request.language}")
+
+    try:
+        languages, batch_context = await retrieval_executor.run(retrieve_batch, request)
+    except ExecutorSaturated as e:
+        raise saturated_response(e)
+
+    processing_time = (time.time() - start_time) * 1000
+    record_stage("total", request.language, processing_time / 1000)
+
+    if request.compact:
+        batch_context = [compact_sources(rag_context) for rag_context in batch_context]
+    response = response_body(BatchQueryResponse(
+        results=[
+            BatchResult(query=query, language=language, rag_sources=rag_context)
+            for query, language, rag_context in zip(request.queries, languages, batch_context)
+        ],
+        count=len(request.queries),
+        language=request.language,
+        processing_time_ms=round(processing_time),
+        stage_ms=stages
+    ))
+    return CompactJSONResponse(response) if request.compact else response
 
 @app.post("/whisper-transcribe")
 async def whisper_transcribe(request: dict):
@@ -1419,9 +3811,27 @@ async def whisper_transcribe(request: dict):
             "confidence": 0.0
         }
 
-@app.post("/generate-tts")
+def synthesize_speech(text: str, lang: str) -> bytes:
+    """MP3 bytes from gTTS"""
+    buffer = io.BytesIO()
+    with timed_stage("tts_synthesis", lang):
+        gTTS(text=text, lang=lang, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
+
+@app.post("/generate-tts", responses={200: {
+    "description": "JSON with audio_base64, or with compact=true the MP3 itself (JSON on failure)",
+    "content": {"audio/mpeg": {"schema": {"type": "string", "format": "binary"}}}
+}})
 async def generate_tts(request: dict):
     """Generate TTS using gTTS (Google Text-to-Speech) - Perfect for Indian languages"""
+    start_time = time.time()
+    stages = start_request_metrics("/generate-tts", bool(request.get("stage_timings")))
+    try:
+        return await run_tts(request, stages)
+    finally:
+        record_stage("total", str(request.get("language", "en")), time.time() - start_time)
+
+async def run_tts(request: dict, stages: Optional[Dict]) -> Union[Dict, Response]:
     try:
         text = request.get("text", "")
         language = request.get("language", "en")
@@ -1452,24 +3862,26 @@ async def generate_tts(request: dict):
         gtts_lang = gtts_language_map.get(language, 'en')
         logger.info(f"🎵 Using gTTS for {language} -> {gtts_lang}")
         
-        # Generate TTS using gTTS
-        tts = gTTS(text=text, lang=gtts_lang, slow=False)
-        
-        # Save to temporary file
-        temp_audio = tempfile.mktemp(suffix=".mp3")
-        tts.save(temp_audio)
+        # Generate TTS using gTTS (network-bound, so it runs on the TTS executor; identical
+        # concurrent requests share one call)
+        audio = await tts_flights.do((text, gtts_lang), lambda: tts_executor.run(synthesize_speech, text, gtts_lang))
         
+        # Compact mode: the MP3 itself, a third smaller than base64 in JSON and no encoding work
+        if audio and request.get("compact"):
+            logger.info(f"✅ gTTS generated successfully for {language}")
+            headers = {"Content-Language": gtts_lang, "X-TTS-Service": f"gTTS-{gtts_lang}"}
+            if stages is not None:
+                headers["Server-Timing"] = ", ".join(f"{stage};dur={ms}" for stage, ms in stages.items())
+            return Response(audio, media_type="audio/mpeg", headers=headers)
+
         # Convert MP3 to base64 for web playback
-        if os.path.exists(temp_audio) and os.path.getsize(temp_audio) > 0:
-            with open(temp_audio, "rb") as audio_file:
-                audio_base64 = base64.b64encode(audio_file.read()).decode('utf-8')
-            
-            # Clean up temporary file
-            os.unlink(temp_audio)
+        if audio:
+            with timed_stage("base64", language):
+                audio_base64 = base64.b64encode(audio).decode('utf-8')
             
             logger.info(f"✅ gTTS generated successfully for {language}")
             
-            return {
+            response = {
                 "success": True,
                 "audio_base64": audio_base64,
                 "service": f"gTTS-{gtts_lang}",
@@ -1478,9 +3890,14 @@ async def generate_tts(request: dict):
                 "audio_format": "mp3",
                 "message": f"Generated high-quality gTTS for {language}"
             }
+            if stages is not None:
+                response["stage_ms"] = stages
+            return response
         else:
             raise Exception("gTTS failed to generate audio file")
             
+    except ExecutorSaturated as e:
+        raise saturated_response(e)
     except Exception as e:
         logger.error(f"❌ gTTS generation failed: {e}")
         
@@ -1491,9 +3908,147 @@ async def generate_tts(request: dict):
             "message": f"gTTS failed: {str(e)}. Using browser TTS fallback."
         }
 
+@app.on_event("startup")
+async def start_kb_watcher():
+    if KB_WATCH_INTERVAL > 0:
+        threading.Thread(target=watch_kb_file, name="kb-watcher", daemon=True).start()
+        logger.info(f"👀 Watching {kb_source_path()} for KB changes every {KB_WATCH_INTERVAL:g}s")
+
+@app.on_event("shutdown")
+async def stop_executors():
+    retrieval_executor.shutdown()
+    tts_executor.shutdown()
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/reload-kb")
+async def admin_reload_kb(x_admin_token: Optional[str] = Header(default=None)):
+    """Reload the KB file in the background and swap the index when ready"""
+    require_admin(x_admin_token)
+    started = start_kb_reload()
+    return {
+        "status": "reloading" if started else "already_reloading",
+        "kb_hash": KB_HASH
+    }
+
+@app.get("/admin/kb-status")
+async def admin_kb_status(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {
+        "kb_hash": KB_HASH,
+        "kb_path": str(kb_source_path()),
+        "index_loaded": kb_index is not None,
+        "index_languages": kb_index['languages'] if kb_index is not None else [],
+        "index_rows": len(kb_index['keys']) if kb_index is not None else 0,
+        "reloading": _reload_lock.locked(),
+        **kb_reload_status
+    }
+
+@app.get("/admin/cache-stats")
+async def admin_cache_stats(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {"query_cache": query_cache.stats()}
+
+@app.get("/admin/executor-stats")
+async def admin_executor_stats(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {"retrieval": retrieval_executor.stats(), "tts": tts_executor.stats()}
+
+def render_component_metrics() -> List[str]:
+    """The numeric counters of the admin stats endpoints, as untyped samples"""
+    components = {
+        "query_cache": query_cache.stats(),
+        "retrieval_executor": retrieval_executor.stats(),
+        "tts_executor": tts_executor.stats(),
+        "query_coalescing": query_flights.stats(),
+        "tts_coalescing": tts_flights.stats(),
+        "domain_gate": domain_gate.stats(),
+        "query_rate_limit": query_buckets.stats(),
+        "tts_rate_limit": tts_buckets.stats()
+    }
+    lines = []
+    for component, stats in components.items():
+        for name, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"agri_{component}_{name} {value!r}")
+    return lines
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition: per-stage latency histograms plus cache, pool and gate counters"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body = "\n".join(render_stage_metrics() + render_component_metrics()) + "\n"
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/rate-limit-stats")
+async def admin_rate_limit_stats(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {"enabled": RATE_LIMIT_ENABLED, "query": query_buckets.stats(), "tts": tts_buckets.stats()}
+
+@app.get("/admin/coalescing-stats")
+async def admin_coalescing_stats(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {"query": query_flights.stats(), "tts": tts_flights.stats()}
+
+@app.get("/admin/domain-gate-stats")
+async def admin_domain_gate_stats(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+    return {"domain_gate": domain_gate.stats()}
+
 if __name__ == "__main__":
+    import argparse
+    import sys
     import uvicorn
     import os
+
+    parser = argparse.ArgumentParser(description="Fast Agriculture AI server")
+    parser.add_argument(
+        "--prebuild-index",
+        action="store_true",
+        help="Build and persist the RAG index for all KB languages, then exit"
+    )
+    parser.add_argument(
+        "--convert-kb",
+        metavar="JSON",
+        help="Convert a nested JSON KB to the streaming JSONL format, then exit"
+    )
+    parser.add_argument("--out", metavar="JSONL", help="Output for --convert-kb (default: next to the input)")
+    parser.add_argument(
+        "--recall-report",
+        metavar="LANG",
+        help="Print two-stage retrieval recall against exhaustive scoring, then exit"
+    )
+    parser.add_argument("--queries", metavar="FILE", help="Queries for --recall-report, one per line")
+    parser.add_argument("--candidate-budget", type=int, help="Candidate budget for --recall-report")
+    parser.add_argument("--top-k", type=int, default=3, help="top_k for --recall-report")
+    args = parser.parse_args()
+
+    if args.convert_kb:
+        source = Path(args.convert_kb)
+        target = Path(args.out) if args.out else source.with_suffix(".jsonl")
+        kb = read_nested_kb(source)
+        count = write_kb_jsonl(iter_kb_records(kb), target)
+        kb_hash = compute_kb_hash(kb)
+        logger.info(f"📝 Wrote {count} KB items to {target} (KB hash {kb_hash[:12]})")
+        sys.exit(0)
+
+    if args.prebuild_index:
+        logger.info(f"🏗️ Prebuilding RAG index into {INDEX_PATH} (KB hash {KB_HASH[:12]})")
+        sys.exit(0 if prebuild_index() else 1)
+
+    if args.recall_report:
+        report_queries = None
+        if args.queries:
+            with open(args.queries, "r", encoding="utf-8") as f:
+                report_queries = [line.strip() for line in f if line.strip()]
+        report = candidate_recall_report(args.recall_report, report_queries, args.top_k, args.candidate_budget)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        sys.exit(0)
     
     # Get port from environment variable for Railway deployment
     port = int(os.environ.get("PORT", 8002))